@@ -16,11 +16,12 @@ from os.path import normpath
 
 from twisted.python import log
 from twisted.web import http, server
+from twisted.internet.protocol import Factory
 from zope.interface import implementer
 
 from mamba import plugin
 from mamba.web import routing
-from mamba.web import asyncjson
+from mamba.web import asyncjson, asynctemplate, websocket
 from mamba.utils.output import bold
 from mamba.core import module, resource
 from mamba.core.interfaces import IController
@@ -75,6 +76,7 @@ class Controller(resource.Resource, ControllerProvider):
     loaded = False
     __parent__ = None
     _router = routing.Router()
+    _websocket_factory = None
 
     def __init__(self, *args, **kwargs):
         """Initialize
@@ -83,6 +85,28 @@ class Controller(resource.Resource, ControllerProvider):
         resource.Resource.__init__(self, *args, **kwargs)
         self._router.install_routes(self)
 
+    @property
+    def websocket_factory(self):
+        """
+        The :class:`~mamba.web.websocket.WebSocketFactory` shared by all the
+        WebSocket routes of this controller that don't define their own one,
+        so they share the keepalive timers, the limits and the statistics.
+
+        It is created on first use but it can be replaced with a configured
+        factory by the application.
+
+        .. versionadded:: 0.3.6
+        """
+
+        if self._websocket_factory is None:
+            self._websocket_factory = websocket.WebSocketFactory(Factory())
+
+        return self._websocket_factory
+
+    @websocket_factory.setter
+    def websocket_factory(self, factory):
+        self._websocket_factory = factory
+
     def getChild(self, name, request):
         """
         This method is not supposed to be called because we are overriden
@@ -155,10 +179,16 @@ class Controller(resource.Resource, ControllerProvider):
         :type result: dict
         """
 
+        if result.code == http.SWITCHING:
+            # the connection belongs to another protocol (a WebSocket) now
+            return
+
         self.prepare_headers(request, result.code, result.headers)
 
         try:
-            if type(result.subject) is not str:
+            if isinstance(result.subject, asynctemplate.AsyncTemplate):
+                return result.subject.send(request)
+            elif type(result.subject) is not str:
                 d = asyncjson.AsyncJSON(result.subject).begin(request)
                 d.addCallback(lambda ignored: request.finish())
                 return d
@@ -22,7 +22,6 @@ from collections import OrderedDict
 from storm.uri import URI
 from twisted.python import log
 from storm.expr import Desc, Undef
-from storm.twisted.transact import Transactor
 from storm.references import Reference, ReferenceSet
 from storm.properties import PropertyPublisherMeta, PropertyColumn
 from storm.variables import (
@@ -33,7 +32,10 @@ from storm.variables import (
 from mamba import plugin
 from mamba.utils import config, json
 from mamba.core import interfaces, module
-from mamba.enterprise.database import Database, AdapterFactory, transact
+from mamba.enterprise import statements
+from mamba.enterprise.database import (
+    Database, AdapterFactory, Transactor, transact
+)
 
 
 class MambaStorm(PropertyPublisherMeta, plugin.ExtensionPoint):
@@ -328,7 +330,7 @@ class Model(ModelProvider):
             raise
 
         store = obj.database.store(klass.mamba_database())
-        data = store.get(klass, id)
+        data = statements.get(store, klass, id)
 
         if data is not None:
             if copy is True:
@@ -352,16 +354,11 @@ class Model(ModelProvider):
             )
 
         if type(primary_key) is tuple:
-            args = []
-            for key in primary_key:
-                args.append(getattr(self.__class__, key) == getattr(self, key))
-            copy = store.find(self.__class__, *args).one()
+            key = tuple(getattr(self, name) for name in primary_key)
         else:
-            value = getattr(self, primary_key)
-            copy = store.find(
-                self.__class__,
-                getattr(self.__class__, primary_key) == value
-            ).one()
+            key = getattr(self, primary_key)
+
+        copy = statements.get(store, self.__class__, key)
 
         for column in self._storm_columns.values():
             setattr(copy, column.name, getattr(self, column.name))
@@ -410,7 +407,7 @@ class Model(ModelProvider):
         .. versionadded:: 0.3.6
         """
 
-        def inner_transaction():
+        def inner_transaction(klass):
             store = klass.database.store(klass.mamba_database())
             data = store.find(klass)
             if order_by is not None:
@@ -418,8 +415,10 @@ class Model(ModelProvider):
 
             return data
 
+        # the transaction is named after the function in the metrics
+        inner_transaction.__name__ = 'all'
         return Transactor(
-            klass.database.pool).run(inner_transaction, *args, **kwargs)
+            klass.database.pool).run(inner_transaction, klass, *args, **kwargs)
 
     @transact
     def create_table(self):
@@ -461,6 +460,13 @@ class Model(ModelProvider):
         adapter = self.get_adapter()
         return adapter.insert_data(scheme)
 
+    def iter_dump_data(self, scheme=None):
+        """Dumps the SQL data in chunks as it is fetched from the database
+        """
+
+        adapter = self.get_adapter()
+        return adapter.iter_insert_data(scheme)
+
     def dump_references(self):
         """Dump SQL references (used by PostgreSQL)
         """
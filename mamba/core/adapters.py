@@ -61,6 +61,14 @@ class MambaSQLAdapter:
 
         return self.original.insert_data(scheme)
 
+    def iter_insert_data(self, scheme):
+        """
+        Return a generator that yields the SQL syntax to insert data that
+        populate a table in batches
+        """
+
+        return self.original.iter_insert_data(scheme)
+
     def parse_references(self):
         """Return the SQL syntax to create foreign keys for PostgreSQL
         """
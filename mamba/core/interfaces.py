@@ -143,6 +143,12 @@ class IMambaSQL(Interface):
         """Return the SQL syntax string to insert data that populate a table
         """
 
+    def iter_insert_data(self, scheme):
+        """
+        Return a generator that yields the SQL syntax to insert data that
+        populate a table in batches
+        """
+
 
 class ISession(Interface):
     """
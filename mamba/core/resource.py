@@ -12,12 +12,69 @@
 """
 
 
-from twisted.web import static
+from twisted.python import log
+from twisted.internet import reactor
+from twisted.python.filepath import InsecurePath
 from twisted.web.resource import NoResource, Resource as TwistedResource
 
+from mamba.core import GNU_LINUX
+from mamba.web import bundle
+from mamba.web.staticfile import StaticFile
+from mamba.utils import json
 from mamba.http import headers
 from mamba.utils.config import Application
 from mamba.application import scripts, appstyles
+from mamba.enterprise.metrics import TransactionMetrics
+
+if GNU_LINUX:
+    from twisted.internet import inotify
+    from twisted.python._inotify import INotifyError
+
+
+class RenderKeys(dict):
+    """
+    Dictionary of template render keys that counts how many times it has
+    been modified so rendered templates can be cached until it changes.
+
+    Changes made inside nested values (like the header dict) are not
+    noticed, set the key again or call :meth:`touch` after doing them
+    """
+
+    version = 0
+
+    def touch(self):
+        """Mark the render keys as modified
+        """
+
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.touch()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.touch()
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.touch()
+
+    def setdefault(self, key, default=None):
+        self.touch()
+        return dict.setdefault(self, key, default)
+
+    def pop(self, key, *args):
+        self.touch()
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        self.touch()
+        return dict.popitem(self)
+
+    def clear(self):
+        dict.clear(self)
+        self.touch()
 
 
 class Resource(TwistedResource):
@@ -34,9 +91,16 @@ class Resource(TwistedResource):
 
         config = Application()
 
+        styles = self._styles_manager.get_styles().values()
+        scripts = self._scripts_manager.get_scripts().values()
+        if config.development is False:
+            # reference the bundles built with `mamba-admin view --bundle`
+            styles, scripts = bundle.apply(
+                styles, scripts, bundle.load_manifest())
+
         # headers and render keys for root_page and index templates
         header = headers.Headers()
-        self.render_keys = {
+        self.render_keys = RenderKeys({
             'doctype': header.get_doctype(),
             'header': {
                 'title': config.name,
@@ -46,11 +110,11 @@ class Resource(TwistedResource):
                 'language_content': header.get_language_content(),
                 'mamba_content': header.get_mamba_content(),
                 'media': header.get_favicon_content('assets'),
-                'styles': self._styles_manager.get_styles().values(),
-                'scripts': self._scripts_manager.get_scripts().values(),
+                'styles': styles,
+                'scripts': scripts,
                 'lessjs': Application().lessjs
             }
-        }
+        })
 
 
 class Assets(TwistedResource):
@@ -58,13 +122,28 @@ class Assets(TwistedResource):
     This object is used to serve the static assets for all the packages that
     we use in a mamba application.
 
+    The names of the files in the assets paths are indexed when the paths
+    are added so requests don't list the assets paths. If two paths contain
+    the same file name the first path added wins. When a file that is not
+    in the index is requested, the assets paths are checked for that name
+    only and missing names are remembered for `missing_ttl` seconds. Call
+    :meth:`watch` to refresh the index when files are added, removed or
+    renamed instead (only on Linux)
+
     :param paths: a list of filepaths
     :type paths: list
     """
 
+    clock = reactor
+    missing_ttl = 5
+    missing_size = 1024
+
     def __init__(self, paths):
         TwistedResource.__init__(self)
         self.paths = []
+        self.notifier = None
+        self.index = {}
+        self.missing = {}
 
         self.add_paths(paths)
 
@@ -76,12 +155,34 @@ class Assets(TwistedResource):
         """
 
         for path in paths:
-            self.paths.append(static.File(path))
+            self.paths.append(StaticFile(path))
+            if self.notifier is not None:
+                self._watch(self.paths[-1])
 
-    def getChild(self, path, request):
+        self._build_index()
+
+    def watch(self):
+        """
+        Watch the assets paths so the index is refreshed when files are
+        added, removed or renamed (only on Linux)
+        """
+
+        if not GNU_LINUX:
+            return
+
+        self.notifier = inotify.INotify()
+        self.notifier.startReading()
         for file in self.paths:
-            if path in file.listNames():
-                return file.getChild(path, request)
+            self._watch(file)
+
+    def getChild(self, path, request):
+        file = self.index.get(path)
+        if file is None and path != '' and self.notifier is None:
+            # maybe the file has been added after the index was built
+            file = self._lookup(path)
+
+        if file is not None:
+            return file.getChild(path, request)
 
         if path != '':
             return NoResource('File not found')
@@ -92,3 +193,85 @@ class Assets(TwistedResource):
         return ''
 
     render_HEAD = render_GET
+
+    def _build_index(self):
+        """
+        Build the dictionary of the files names in the assets paths and the
+        :class:`~mamba.web.staticfile.StaticFile` for the path that contains
+        them
+        """
+
+        index = {}
+        for file in self.paths:
+            for name in file.listNames():
+                index.setdefault(name, file)
+
+        self.index = index
+        self.missing = {}
+        return index
+
+    def _lookup(self, name):
+        """
+        Look for a file name that is not in the index in the assets paths
+        and add it to the index if found
+        """
+
+        now = self.clock.seconds()
+        if self.missing.get(name, now) > now:
+            return None
+
+        for file in self.paths:
+            try:
+                if file.child(name).exists():
+                    self.index[name] = file
+                    self.missing.pop(name, None)
+                    return file
+            except InsecurePath:
+                return None
+
+        if len(self.missing) >= self.missing_size:
+            self.missing = {}
+
+        self.missing[name] = now + self.missing_ttl
+        return None
+
+    def _watch(self, file):
+        """Watch the given assets path
+        """
+
+        try:
+            self.notifier.watch(
+                file,
+                mask=(
+                    inotify.IN_CREATE | inotify.IN_DELETE |
+                    inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+                ),
+                callbacks=[self._notify]
+            )
+        except (INotifyError, OSError):
+            log.msg('Can not watch assets path {}'.format(file.path))
+
+    def _notify(self, ignore, file_path, mask):
+        """Refresh the index when the assets paths change
+        """
+
+        self._build_index()
+
+
+class Metrics(TwistedResource):
+    """
+    This object is used to serve the database thread pool metrics as JSON
+
+    :param pool: the database thread pool
+    :type pool: :class:`twisted.python.threadpool.ThreadPool`
+    """
+
+    isLeaf = True
+
+    def __init__(self, pool):
+        TwistedResource.__init__(self)
+        self.pool = pool
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(TransactionMetrics().stats(self.pool))
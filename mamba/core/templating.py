@@ -12,12 +12,15 @@
 """
 
 import os
+import threading
 from inspect import getframeinfo, currentframe, getfile
 
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemBytecodeCache
 from jinja2 import PackageLoader, FileSystemLoader, ChoiceLoader
-from jinja2 import TemplateNotFound
+from jinja2 import TemplateNotFound, TemplateSyntaxError
+from twisted.python import log
 
+from mamba.utils import config
 from mamba.http import headers
 
 
@@ -31,6 +34,170 @@ class NotConfigured(TemplateError):
     """
 
 
+def autoescape(name):
+    """Autoescape HTML templates only
+    """
+
+    return name.rsplit('.', 1)[1] == 'html' if name is not None else False
+
+
+def get_bytecode_cache():
+    """
+    Return back the Jinja2 bytecode cache configured with the
+    `templates_bytecode_cache` option of the application configuration.
+    It can be the directory where to store the compiled templates, true to
+    use the default Jinja2 directory (in the system temporary directory) or
+    false to disable it. Returns None if the cache is disabled or unusable
+    """
+
+    directory = getattr(
+        config.Application(), 'templates_bytecode_cache', True)
+    if directory is None or directory is False:
+        return None
+
+    try:
+        if directory is True:
+            return FileSystemBytecodeCache()
+
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        return FileSystemBytecodeCache(directory)
+    except (OSError, RuntimeError) as error:
+        log.msg('Templates bytecode cache disabled: {}'.format(error))
+        return None
+
+
+def compile_templates(search_paths, bytecode_cache=None):
+    """
+    Compile every template found in the given search paths into the
+    bytecode cache, this way the application starts with all of its
+    templates already compiled. Returns back a list with the names of the
+    compiled templates and a list of (name, error) for the templates that
+    could not be compiled
+
+    :param search_paths: the templates search paths
+    :type search_paths: list
+    :param bytecode_cache: the cache to use (the configured one if None)
+    :type bytecode_cache: :class:`jinja2.BytecodeCache`
+    """
+
+    if bytecode_cache is None:
+        bytecode_cache = get_bytecode_cache()
+        if bytecode_cache is None:
+            raise NotConfigured('Templates bytecode cache is disabled')
+
+    compiled, errors = [], []
+    for path in search_paths:
+        # the cache key is the template name and its absolute path
+        env = Environment(
+            autoescape=autoescape, bytecode_cache=bytecode_cache,
+            loader=FileSystemLoader(os.path.abspath(path))
+        )
+        for name in env.list_templates():
+            try:
+                env.get_template(name)
+                compiled.append(name)
+            except (TemplateSyntaxError, UnicodeDecodeError) as error:
+                errors.append((name, error))
+
+    return compiled, errors
+
+
+class EnvironmentRegistry(object):
+    """
+    Process wide registry of Jinja2 environments keyed by the set of
+    search paths, the loader type, the cache size and the environment
+    settings in :attr:`options`. Templates that share the same
+    configuration share the same environment so each template is compiled
+    once and then rendered from the Jinja2 cache (that still reloads the
+    templates modified on disk).
+
+    Environments with unhashable options can not be shared so a new one is
+    created for them every time.
+
+    Environments without extra options use the bytecode cache returned by
+    :func:`get_bytecode_cache` so the compiled templates survive restarts.
+    Environments with options don't as the cached bytecode depends on them.
+    """
+
+    # the Jinja2 environment settings that can be set on render time, any
+    # other render argument is part of the template context
+    options = frozenset([
+        'block_start_string', 'block_end_string', 'variable_start_string',
+        'variable_end_string', 'comment_start_string', 'comment_end_string',
+        'line_statement_prefix', 'line_comment_prefix', 'trim_blocks',
+        'lstrip_blocks', 'newline_sequence', 'keep_trailing_newline',
+        'autoescape', 'optimized', 'auto_reload'
+    ])
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._environments = {}
+
+    def __len__(self):
+        return len(self._environments)
+
+    def get(self, search_paths, loader=FileSystemLoader, cache_size=50,
+            **options):
+        """
+        Return back the environment for the given configuration, create it
+        if it does not exists yet
+
+        :param search_paths: the templates search paths
+        :type search_paths: list
+        :param loader: the Jinja2 loader class
+        :param cache_size: size of the Jinja2 templates cache
+        :type cache_size: int
+        """
+
+        paths = tuple(os.path.abspath(path) for path in search_paths)
+        key = (paths, loader, cache_size, tuple(sorted(options.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return self.create(paths, loader, cache_size, options)
+
+        with self._lock:
+            env = self._environments.get(key)
+
+        if env is None:
+            env = self.create(paths, loader, cache_size, options)
+            with self._lock:
+                env = self._environments.setdefault(key, env)
+
+        return env
+
+    def create(self, paths, loader, cache_size, options):
+        """Create a new environment for the given configuration
+        """
+
+        if loader is ChoiceLoader:
+            loader = ChoiceLoader([FileSystemLoader(path) for path in paths])
+        else:
+            loader = loader(list(paths))
+
+        env = Environment(
+            autoescape=autoescape, cache_size=cache_size, loader=loader,
+            bytecode_cache=None if options else get_bytecode_cache()
+        )
+        for option, value in options.iteritems():
+            setattr(env, option, value)
+
+        return env
+
+    def clear(self):
+        """Forget all the environments
+        """
+
+        with self._lock:
+            self._environments.clear()
+
+
+environments = EnvironmentRegistry()
+
+
 class MambaTemplate(object):
     """
     This class loads templates from the Mamba package and is used internally
@@ -75,6 +242,10 @@ class Template(object):
     If controller is not None, then we use the controller directory templates
     instead of global view ones.
 
+    If no environment is provided, the shared one for our search paths is
+    taken from the :data:`environments` registry so the templates are not
+    compiled again for every new :class:`Template` object.
+
     :param env: the Jinja2 environment
     :param controller: mamba controller that uses the templates
     :type controller: :class:`~mamba.application.controller.Controller`
@@ -125,59 +296,79 @@ class Template(object):
         :type template: string
         """
 
+        tpl, kwargs = self._get_template(
+            template, kwargs, getframeinfo(currentframe().f_back).function)
+
+        return tpl.render(**kwargs)
+
+    def stream(self, template=None, **kwargs):
+        """
+        Renders a template in chunks as it is being generated. The result
+        is an :class:`~mamba.web.asynctemplate.AsyncTemplate` producer that
+        can be returned as the subject of a controller response to send big
+        pages without building them in memory
+
+        :param template: the template to render
+        :type template: string
+        """
+
+        from mamba.web.asynctemplate import AsyncTemplate
+
+        tpl, kwargs = self._get_template(
+            template, kwargs, getframeinfo(currentframe().f_back).function)
+
+        return AsyncTemplate(tpl.generate(**kwargs))
+
+    def _get_template(self, template, kwargs, caller):
+        """
+        Get the Jinja2 template to render and the arguments to render it
+        with, caller is the name of the controller method that is used as
+        template name when no template is given
+        """
+
         if template is None:
             template = self.template
 
-        if self.env is None:
+        env = self.env
+        if env is None:
             if kwargs.get('loader', None) is None:
-                if self.loader is None:
-                    loader = FileSystemLoader(self.search_paths)
-                elif self.loader is ChoiceLoader:
-                    loader = self.loader(
-                        [FileSystemLoader(path) for path in self.search_paths]
-                    )
-                else:
-                    loader = self.loader(self.search_paths)
+                loader = self.loader or FileSystemLoader
             else:
-                loader = kwargs.pop('loader')(self.search_paths)
-
-            self.env = Environment(
-                autoescape=lambda name: (
-                    name.rsplit('.', 1)[1] == 'html'
-                    if name is not None else False
-                ),
-                cache_size=self.cache_size,
-                loader=loader
-            )
+                loader = kwargs.pop('loader')
 
-        for arg, value in kwargs.iteritems():
-            if hasattr(self.env, arg):
-                setattr(self.env, arg, value)
+            env = environments.get(
+                self.search_paths, loader, self.cache_size, **dict(
+                    (arg, value) for arg, value in kwargs.iteritems()
+                    if arg in environments.options
+                )
+            )
+        else:
+            for arg, value in kwargs.iteritems():
+                if arg in environments.options:
+                    setattr(env, arg, value)
 
         if template is not None:
             try:
-                tpl = self.env.get_template(template)
+                tpl = env.get_template(template)
             except TemplateNotFound:
                 if self.controller is None:
                     raise
                 try:
-                    tpl = self.env.get_template(template)
+                    tpl = env.get_template(template)
                 except TemplateNotFound:
                     raise TemplateNotFound('{} template not found'.format(
                         template)
                     )
 
-            return tpl.render(**kwargs)
+            return tpl, kwargs
 
         if self.controller is not None:
-            template = '{}.html'.format(
-                getframeinfo(currentframe().f_back).function
-            )
+            template = '{}.html'.format(caller)
 
             for key, value in self.controller.render_keys.iteritems():
                 kwargs[key] = value
 
-            return self.env.get_template(template).render(**kwargs)
+            return env.get_template(template), kwargs
 
         raise NotConfigured(
             'Template is not configured. Missing controller parameter at '
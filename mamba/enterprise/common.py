@@ -11,6 +11,8 @@
 
 """
 
+from decimal import Decimal
+
 from storm.expr import Undef
 from storm import variables, properties
 from storm.locals import create_database, Store
@@ -73,48 +75,104 @@ class CommonSQL(object):
     """I do nothing, my only purpose is serve as dummy object
     """
 
+    dump_batch_size = 500
+
     def insert_data(self, scheme):
         """
         Return the SQL syntax needed to insert the data already present
         in the table.
         """
 
-        if scheme is not None:
-            store = Store(create_database(config.Database().uri[scheme]))
-        else:
-            store = Store(create_database(config.Database().uri))
-        registers = []
-        rows = store.find(self.model.__class__)
-        fields = [
-            r._detect_attr_name(self.model.__class__) for r in
-            self.model._storm_columns.keys()
-        ]
-        for r in rows:
-            tmp_row = {}
-            for field in fields:
-                tmp_row[field] = getattr(r, field)
-            registers.append(tmp_row)
+        return '\n'.join(self.iter_insert_data(scheme))
+
+    def iter_insert_data(self, scheme):
+        """
+        Generator that yields the SQL syntax needed to insert the data
+        already present in the table. Rows are fetched and dumped in
+        batches of :attr:`dump_batch_size` rows using multi-row INSERTs
+        """
+
+        store = self._get_dump_store(scheme)
+        fields, columns = self._get_dump_columns()
 
         if self.__class__.__name__ == 'MySQL':
             commas = '`'
         else:
             commas = "'"
 
-        query = ''
-        for register in registers:
-            query += ('INSERT INTO {}{}{} ({}) VALUES ({});\n'.format(
-                commas,
-                self.model.__storm_table__,
-                commas,
-                ', '.join(register.keys()),
-                ', '.join([(
-                    str(field) if type(field) is not unicode
-                    else "'{}'".format(field))
-                    for field in register.values()
-                ])
-            ))
-
-        return query
+        insert = 'INSERT INTO {}{}{} ({}) VALUES\n'.format(
+            commas, self.model.__storm_table__, commas, ', '.join(fields)
+        )
+
+        try:
+            for batch in self._batches(store, columns):
+                yield insert + ',\n'.join([
+                    '({})'.format(', '.join([
+                        self._literal(value) for value in row
+                    ])) for row in batch
+                ]) + ';'
+        finally:
+            store.close()
+
+    def _get_dump_store(self, scheme):
+        """Return a new store to dump the data of the given scheme
+        """
+
+        if scheme is not None:
+            return Store(create_database(config.Database().uri[scheme]))
+
+        return Store(create_database(config.Database().uri))
+
+    def _get_dump_columns(self):
+        """Return back the names and columns of the fields to dump
+        """
+
+        fields = [
+            p._detect_attr_name(self.model.__class__) for p in
+            self.model._storm_columns.keys()
+        ]
+
+        return fields, self.model._storm_columns.values()
+
+    def _batches(self, store, columns):
+        """
+        Generator that yields lists of at most :attr:`dump_batch_size` rows
+        (tuples) from the model table
+        """
+
+        batch = []
+        rows = store.find(self.model.__class__).values(*columns)
+        for row in rows:
+            batch.append(row if len(columns) > 1 else (row,))
+            if len(batch) >= self.dump_batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _literal(self, value):
+        """Return back the given Python value as a SQL literal
+        """
+
+        if value is None:
+            return 'NULL'
+
+        if type(value) is bool:
+            return str(int(value))
+
+        if type(value) is float:
+            return repr(value)
+
+        if isinstance(value, (int, long, Decimal)):
+            return str(value)
+
+        if type(value) is unicode:
+            value = value.encode('utf-8')
+        elif type(value) is not str:
+            value = str(value)
+
+        return "'{}'".format(value.replace("'", "''"))
 
     def is_compound_key(self, name):
         """Detects if given name is part of a compound primary key
@@ -12,8 +12,10 @@
 """
 
 import sys
+import time
 import datetime
 import functools
+import threading
 from sqlite3 import sqlite_version_info
 
 if '__pypy__' in sys.modules:
@@ -41,18 +43,23 @@ if '__pypy__' in sys.modules:
             'psycopg2ct in order to can use psycopg2 with PyPy'
         )
 
+from twisted.python import log
+from twisted.internet.threads import deferToThreadPool
 from storm.database import URI
+from storm.twisted import transact as storm_transact
 from storm.zope.interfaces import IZStorm
 from storm.zope.zstorm import global_zstorm
 from twisted.python.threadpool import ThreadPool
 from zope.component import provideUtility, getUtility
-from storm.twisted.transact import Transactor, DisconnectionError
+from storm.twisted.transact import DisconnectionError
 
 from mamba import version
 from mamba.utils import config
 from mamba.enterprise.mysql import MySQL
 from mamba.enterprise.sqlite import SQLite
 from mamba.enterprise.common import CommonSQL
+from mamba.enterprise.metrics import TransactionMetrics
+from mamba.enterprise.tracer import QueryTracer
 from mamba.enterprise.postgres import PostgreSQL
 
 if (hasattr(config.Database(), 'storm_debug')
@@ -60,6 +67,95 @@ if (hasattr(config.Database(), 'storm_debug')
     from mamba.utils.logger import StormDebugLogFile
     StormDebugLogFile.start()
 
+if getattr(config.Database(), 'query_tracer', False) is True:
+    QueryTracer.start(getattr(config.Database(), 'slow_query_threshold', 1.0))
+
+
+class Transactor(storm_transact.Transactor):
+    """
+    Storm :class:`~storm.twisted.transact.Transactor` that retries the
+    transaction up to `connection_retries` times (as configured in the
+    database configuration file) when the connection to the database
+    server is lost. Storm reconnects the stores of the running thread
+    before every retry.
+
+    The time that every transaction waits for a free thread in the pool
+    and the time it takes to run are recorded in
+    :class:`~mamba.enterprise.metrics.TransactionMetrics`.
+
+    :param threadpool: the thread pool to run the transactions into
+    :type threadpool: :class:`twisted.python.threadpool.ThreadPool`
+    """
+
+    # read once, transactors are created for every model operation
+    retries = getattr(
+        config.Database(), 'connection_retries',
+        storm_transact.Transactor.retries
+    )
+
+    def __init__(self, threadpool, transaction=None):
+        super(Transactor, self).__init__(threadpool, transaction)
+        self.metrics = TransactionMetrics()
+
+    def run(self, function, *args, **kwargs):
+        """Run the given function in a thread from the pool
+        """
+
+        from twisted.internet import reactor
+
+        name = self._name(function, args)
+        if QueryTracer.instance is not None:
+            function = QueryTracer.instance.bind(function, name)
+
+        return deferToThreadPool(
+            reactor, self._threadpool, self._measure,
+            (name, time.time()), function, *args, **kwargs
+        )
+
+    def on_retry(self, context):
+        """Log every retry attempt so disconnections don't go unnoticed
+        """
+
+        log.msg('Retrying {} ({}/{}) after {}: {}'.format(
+            context.function.__name__, context.retry, self.retries,
+            context.error.__class__.__name__, context.error
+        ))
+
+    def _measure(self, *args, **kwargs):
+        """
+        Run a transaction (its commit and retries included) recording how
+        long it waited in the pool queue, how long it took to run and if it
+        failed. The transaction name, the time it was queued at and the
+        function are the first positional arguments so they never collide
+        with the function keyword arguments
+        """
+
+        (name, queued), function, args = args[0], args[1], args[2:]
+
+        started = time.time()
+        outcome = 'error'
+        try:
+            result = self._wrap(function, *args, **kwargs)
+            outcome = 'success'
+            return result
+        finally:
+            self.metrics.record(
+                name, started - queued, time.time() - started, outcome)
+
+    @staticmethod
+    def _name(function, args):
+        """
+        Return back a name for the given function, if the first argument is
+        a model class or object the name is prefixed with the class name
+        """
+
+        name = getattr(function, '__name__', repr(function))
+        if len(args) > 0:
+            owner = args[0] if isinstance(args[0], type) else type(args[0])
+            name = '{}.{}'.format(owner.__name__, name)
+
+        return name
+
 
 class Database(object):
     """
@@ -70,6 +166,8 @@ class Database(object):
     """
 
     monkey_patched = False
+    # read once, it is checked every time a store is requested
+    keepalive_interval = getattr(config.Database(), 'keepalive_interval', 300)
     pool = ThreadPool(
         config.Database().min_threads,
         config.Database().max_threads,
@@ -85,6 +183,7 @@ class Database(object):
 
         self.started = False
         self.__testing = testing
+        self.__activity = threading.local()
 
         if not self.zstorm_configured:
             provideUtility(global_zstorm, IZStorm)
@@ -152,21 +251,59 @@ class Database(object):
     def store(self, database='mamba', ensure_connect=False):
         """
         Returns a Store per-thread through :class:`storm.zope.zstorm.ZStorm`
+
+        If `ensure_connect` is True and the store of this thread has been
+        idle for longer than the configured `keepalive_interval`, we check
+        that the connection is still alive before returning it back.
+
+        :param database: the name of the database store to get
+        :type database: str
+        :param ensure_connect: make sure the store is connected
+        :type ensure_connect: bool
         """
 
         if not self.started:
             self.start()
 
         if ensure_connect is True:
-            self._ensure_connect()
+            self._ensure_connect(database)
 
+        self._touch(database)
         zstorm = getUtility(IZStorm)
         return zstorm.get(database)
 
-    def dump(self, model_manager, scheme=None, full=False):
+    def dump(self, model_manager, scheme=None, full=False, stream=None):
         """
         Dumps the full database
 
+        If a stream is given, the dump is written into it as it is being
+        generated (rows are fetched from the database in batches) and
+        nothing is returned, so big databases can be dumped using a
+        constant amount of memory.
+
+        :param model_manager: the model manager from mamba application
+        :type model_manager: :class:`~mamba.application.model.ModelManager`
+        :param scheme: dump which scheme? if None just everything
+        :type scheme: str
+        :param full: should be dumped full?
+        :type full: bool
+        :param stream: file like object to write the dump into
+        :type stream: file
+        """
+
+        lines = self.iter_dump(model_manager, scheme, full)
+        if stream is None:
+            return '\n'.join(lines)
+
+        for line in lines:
+            stream.write(line)
+            stream.write('\n')
+
+    def iter_dump(self, model_manager, scheme=None, full=False):
+        """
+        Generator that yields the lines of the database dump (without the
+        trailing new line character)
+
         :param model_manager: the model manager from mamba application
         :type model_manager: :class:`~mamba.application.model.ModelManager`
         :param scheme: dump which scheme? if None just everything
@@ -210,26 +347,31 @@ class Database(object):
                 'SET FOREIGN_KEY_CHECKS = 0;'
             ]
 
+        for line in sql:
+            yield line
+
         if full is False:
-            self._dump_scheme(sql, references, indexes, model_manager, scheme)
+            dumper = self._dump_scheme
         else:
-            self._dump_data(sql, references, indexes, model_manager, scheme)
+            dumper = self._dump_data
+
+        for line in dumper(references, indexes, model_manager, scheme):
+            yield line
 
         if self.backend == 'mysql':
-            sql += [
+            for line in [
                 '--',
                 '-- Enable foreign key checks',
                 '--',
                 'SET FOREIGN_KEY_CHECKS = 1;'
-            ]
+            ]:
+                yield line
 
         for reference in references:
-            sql.append(reference)
+            yield reference
 
         for index in indexes:
-            sql.append(index)
-
-        return '\n'.join(sql)
+            yield index
 
     def reset(self, model_manager, scheme=None):
         """
@@ -286,11 +428,11 @@ class Database(object):
 
         return self.backend, self.host, self.database
 
-    def _dump_scheme(self, sql, references, indexes, model_manager, scheme):
+    def _dump_scheme(self, references, indexes, model_manager, scheme):
         """Dump the database scheme
         """
 
-        sql.append('')
+        yield ''
         for model in model_manager.get_models().values():
             if not model.get('object').on_schema():
                 continue
@@ -306,9 +448,9 @@ class Database(object):
                 if model.get('object').dump_indexes():
                     indexes.append(model.get('object').dump_indexes())
 
-            sql += [model.get('object').dump_table() + '\n']
+            yield model.get('object').dump_table() + '\n'
 
-    def _dump_data(self, sql, references, indexes, model_manager, scheme):
+    def _dump_data(self, references, indexes, model_manager, scheme):
         """Dump the database data
         """
 
@@ -322,18 +464,19 @@ class Database(object):
                     and model.get('object').mamba_database() != scheme):
                 continue
 
-            sql.append('--')
-            sql.append('-- Table structure for table {}'.format(
+            yield '--'
+            yield '-- Table structure for table {}'.format(
                 model_object.__storm_table__
-            ))
-            sql.append('--\n')
-            sql.append(model_object.dump_table())
-            sql.append('--')
-            sql.append('-- Dumping data for table {}'.format(
+            )
+            yield '--\n'
+            yield model_object.dump_table()
+            yield '--'
+            yield '-- Dumping data for table {}'.format(
                 model_object.__storm_table__
-            ))
-            sql.append('--\n')
-            sql.append(model_object.dump_data(scheme=scheme))
+            )
+            yield '--\n'
+            for chunk in model_object.iter_dump_data(scheme=scheme):
+                yield chunk
 
             if self.backend == 'postgres':
                 references.append(model_object.dump_references())
@@ -342,17 +485,43 @@ class Database(object):
                 if model.get('object').dump_indexes():
                     indexes.append(model_object.dump_indexes())
 
-    def _ensure_connect(self):
-        """Ensure that we are connected to the database server
+    def _ensure_connect(self, database='mamba'):
         """
+        Ensure that we are connected to the database server, the server is
+        only pinged if the store of this thread has been idle for longer
+        than the configured `keepalive_interval`
+
+        :param database: the name of the database store to check
+        :type database: str
+        """
+
+        last_activity = self._last_activity(database)
+        if last_activity is not None and self.keepalive_interval > 0:
+            if time.time() - last_activity < self.keepalive_interval:
+                return
 
-        store = getUtility(IZStorm).get('mamba')
+        store = getUtility(IZStorm).get(database)
         try:
             store.execute('SELECT 1')
             store.commit()
         except DisconnectionError:
             store.rollback()
 
+    def _last_activity(self, database):
+        """Return the last time the given store was used in this thread
+        """
+
+        return getattr(self.__activity, 'stores', {}).get(database)
+
+    def _touch(self, database):
+        """Record that the given store has been used in this thread
+        """
+
+        if not hasattr(self.__activity, 'stores'):
+            self.__activity.stores = {}
+
+        self.__activity.stores[database] = time.time()
+
     def _set_zstorm_default_uris(self, zstorm):
         """Register the default_uri for each configured database with ZStorm
         """
@@ -427,4 +596,4 @@ def transact(method):
     return wrapper
 
 
-__all__ = ['Database', 'AdapterFactory', 'transact']
+__all__ = ['Database', 'AdapterFactory', 'Transactor', 'transact']
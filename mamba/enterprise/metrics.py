@@ -0,0 +1,126 @@
+# -*- test-case-name: mamba.test.test_metrics -*-
+# Copyright (c) 2012 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+.. module:: metrics
+    :platform: Unix, Windows
+    :synopsis: Database thread pool metrics for Mamba
+
+.. moduleauthor:: Oscar Campos <oscar.campos@member.fsf.org>
+
+"""
+
+import bisect
+import threading
+
+from mamba.utils import borg
+
+
+class TransactionMetrics(borg.Borg):
+    """
+    Collects how long every transaction waited in the database thread pool
+    queue for a free thread, how long it took to run and its outcome,
+    aggregated by the model method that started it. It inherits from
+    :class:`~mamba.utils.borg.Borg` so every instance shares the same
+    metrics::
+
+        >>> TransactionMetrics().stats()['Dummy.read']['wait']['max']
+        0.0004
+    """
+
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        super(TransactionMetrics, self).__init__()
+        if not hasattr(self, '_stats'):
+            self._lock = threading.Lock()
+            self._stats = {}
+
+    def record(self, name, wait, run, outcome):
+        """
+        Record a transaction
+
+        :param name: the name of the method that started the transaction
+        :type name: str
+        :param wait: seconds the transaction waited for a free thread
+        :type wait: float
+        :param run: seconds the transaction took to run
+        :type run: float
+        :param outcome: the result of the transaction (success or error)
+        :type outcome: str
+        """
+
+        with self._lock:
+            data = self._stats.get(name)
+            if data is None:
+                data = self._stats[name] = {
+                    'count': 0, 'outcomes': {},
+                    'wait': self._timing(), 'run': self._timing()
+                }
+
+            data['count'] += 1
+            data['outcomes'][outcome] = data['outcomes'].get(outcome, 0) + 1
+            self._add(data['wait'], wait)
+            self._add(data['run'], run)
+
+    def stats(self, pool=None):
+        """
+        Return back a copy of the collected metrics as a dictionary, if a
+        thread pool is given, the size of it is returned as well
+
+        :param pool: the database thread pool
+        :type pool: :class:`twisted.python.threadpool.ThreadPool`
+        """
+
+        with self._lock:
+            result = {'transactions': dict(
+                (name, {
+                    'count': data['count'],
+                    'outcomes': dict(data['outcomes']),
+                    'wait': dict(
+                        data['wait'], histogram=list(data['wait']['histogram'])
+                    ),
+                    'run': dict(
+                        data['run'], histogram=list(data['run']['histogram'])
+                    )
+                }) for name, data in self._stats.iteritems()
+            )}
+
+        if pool is not None:
+            result['pool'] = {
+                'min': pool.min,
+                'max': pool.max,
+                'threads': len(getattr(pool, 'threads', [])),
+                'waiting': len(getattr(pool, 'waiters', [])),
+                'working': len(getattr(pool, 'working', []))
+            }
+
+        return result
+
+    def reset(self):
+        """Clear all the collected metrics
+        """
+
+        with self._lock:
+            self._stats.clear()
+
+    def _timing(self):
+        """Return back an empty timing record
+        """
+
+        return {
+            'total': 0.0, 'max': 0.0,
+            'histogram': [0] * (len(self.buckets) + 1)
+        }
+
+    def _add(self, timing, value):
+        """Add the given value to the timing record
+        """
+
+        timing['total'] += value
+        timing['max'] = max(timing['max'], value)
+        timing['histogram'][bisect.bisect_left(self.buckets, value)] += 1
+
+
+__all__ = ['TransactionMetrics']
@@ -82,6 +82,17 @@ class MySQL(CommonSQL):
 
         return self.model.__engine__
 
+    def _literal(self, value):
+        """
+        Return back the given Python value as a MySQL literal, MySQL uses
+        backslash as escape character in string literals by default
+        """
+
+        if type(value) in (str, unicode):
+            value = value.replace('\\', '\\\\')
+
+        return super(MySQL, self)._literal(value)
+
     @staticmethod
     def register():
         """Register this component
@@ -19,7 +19,7 @@ from storm.references import Reference
 from storm import properties, variables
 from storm.expr import Undef, compile as storm_compile
 
-from mamba.utils import config
+from mamba.utils import config, json
 from mamba.core.interfaces import IMambaSQL
 from mamba.core.adapters import MambaSQLAdapter
 from mamba.enterprise.common import CommonSQL, NativeEnum, NativeEnumVariable
@@ -497,6 +497,84 @@ class PostgreSQL(CommonSQL):
 
         return ''
 
+    def iter_insert_data(self, scheme):
+        """
+        Generator that yields the data already present in the table using
+        the PostgreSQL COPY text format. Rows are fetched and dumped in
+        batches of :attr:`dump_batch_size` rows
+        """
+
+        store = self._get_dump_store(scheme)
+        fields, columns = self._get_dump_columns()
+
+        yield 'COPY {} ({}) FROM stdin;'.format(
+            self._parse_column_name(self.model.__storm_table__),
+            ', '.join([self._parse_column_name(f) for f in fields])
+        )
+
+        try:
+            for batch in self._batches(store, columns):
+                yield '\n'.join([
+                    '\t'.join([self._copy_value(value) for value in row])
+                    for row in batch
+                ])
+        finally:
+            store.close()
+
+        yield '\\.'
+
+    def _copy_value(self, value):
+        """Return back the given Python value in COPY text format
+        """
+
+        if value is None:
+            return '\\N'
+
+        return self._copy_text(value).replace('\\', '\\\\').replace(
+            '\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def _copy_text(self, value):
+        """Return back the given (not None) Python value as PostgreSQL text
+        input before the COPY escaping is applied
+        """
+
+        if type(value) is bool:
+            return 't' if value else 'f'
+
+        if type(value) is float:
+            return repr(value)
+
+        if type(value) is str:
+            # RawStr columns are bytea
+            return '\\x' + value.encode('hex')
+
+        if type(value) is unicode:
+            return value.encode('utf-8')
+
+        if type(value) is dict:
+            return json.dumps(value)
+
+        if type(value) in (list, tuple):
+            return self._array_literal(value)
+
+        return str(value)
+
+    def _array_literal(self, value):
+        """Return back the given list as a PostgreSQL array literal
+        """
+
+        items = []
+        for item in value:
+            if item is None:
+                items.append('NULL')
+            elif type(item) in (list, tuple):
+                items.append(self._array_literal(item))
+            else:
+                items.append('"{}"'.format(self._copy_text(item).replace(
+                    '\\', '\\\\').replace('"', '\\"')))
+
+        return '{{{}}}'.format(','.join(items))
+
     def _parse_column_name(self, column_name):
         """Parse a column name to make sure we quote resrerved words
         """
@@ -0,0 +1,150 @@
+# -*- test-case-name: mamba.test.test_statements -*-
+# Copyright (c) 2012 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+.. module:: statements
+    :platform: Unix, Windows
+    :synopsis: Compiled SQL statements cache for hot Model queries
+
+.. moduleauthor:: Oscar Campos <oscar.campos@member.fsf.org>
+
+"""
+
+import threading
+from collections import OrderedDict
+
+from storm.info import get_cls_info
+from storm.variables import Variable
+from storm.expr import Select, State, compare_columns
+
+from mamba.utils import config
+
+
+class StatementCache(object):
+    """
+    LRU cache of compiled SQL statements keyed by query shape. A query
+    shape is anything that identifies the generated SQL except the values
+    of its parameters, for example the model class and the operation.
+
+    Reusing the very same SQL text for the same shape also let the
+    database drivers that cache prepared statements by text (like the
+    sqlite3 module does) skip the statement parsing.
+
+    :param size: maximum number of statements to keep
+    :type size: int
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._lock = threading.Lock()
+        self._statements = OrderedDict()
+
+    def __len__(self):
+        return len(self._statements)
+
+    def get(self, key, factory):
+        """
+        Return back the statement for the given key, if it is not cached
+        the factory is called to compile it. If the factory returns None
+        the statement can not be cached and None is returned
+
+        :param key: the query shape
+        :type key: tuple
+        :param factory: callable that compiles the statement
+        :type factory: callable
+        """
+
+        with self._lock:
+            statement = self._statements.pop(key, None)
+            if statement is not None:
+                self._statements[key] = statement
+                return statement
+
+        statement = factory()
+        if statement is None:
+            return None
+
+        with self._lock:
+            self._statements[key] = statement
+            while len(self._statements) > self.size:
+                self._statements.popitem(False)
+
+        return statement
+
+    def clear(self):
+        """Clear the cache
+        """
+
+        with self._lock:
+            self._statements.clear()
+
+
+cache = StatementCache(
+    getattr(config.Database(), 'statement_cache_size', 256))
+
+
+def get(store, cls, key):
+    """
+    Get the object of type cls with the given primary key from the store
+    like :meth:`storm.store.Store.get` does but using a cached compiled
+    statement instead of compiling a new one on every call
+
+    :param store: the Storm store to use
+    :type store: :class:`storm.store.Store`
+    :param cls: the class of the object to retrieve
+    :type cls: class
+    :param key: the primary key, it may be a tuple for compound keys
+    :return: the object found or None
+    """
+
+    if store._implicit_flush_block_count == 0:
+        store.flush()
+
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    cls_info = get_cls_info(cls)
+    connection = store._connection
+
+    assert len(key) == len(cls_info.primary_key)
+
+    primary_vars = []
+    for column, variable in zip(cls_info.primary_key, key):
+        if not isinstance(variable, Variable):
+            variable = column.variable_factory(value=variable)
+        primary_vars.append(variable)
+
+    primary_values = tuple(var.get(to_db=True) for var in primary_vars)
+    obj_info = store._alive.get((cls_info.cls, primary_values))
+    if obj_info is not None and not obj_info.get('invalidated'):
+        return store._get_object(obj_info)
+
+    def compile_statement():
+        state = State()
+        statement = connection.compile(Select(
+            cls_info.columns, compare_columns(
+                cls_info.primary_key, primary_vars),
+            default_tables=cls_info.table, limit=1
+        ), state)
+
+        # only cache it if the primary key values are the only parameters
+        if len(state.parameters) != len(primary_vars) or any(
+                p is not v for p, v in zip(state.parameters, primary_vars)):
+            return None
+
+        return statement
+
+    statement = cache.get((type(connection), cls, 'get'), compile_statement)
+    if statement is None:
+        return store.get(cls, key)
+
+    result = connection.execute(statement, primary_vars)
+    values = result.get_one()
+    if values is None:
+        return None
+
+    return store._load_object(cls_info, result, values)
+
+
+__all__ = ['StatementCache', 'get']
@@ -0,0 +1,174 @@
+# -*- test-case-name: mamba.test.test_tracer -*-
+# Copyright (c) 2012 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+.. module:: tracer
+    :platform: Unix, Windows
+    :synopsis: Storm tracer that collects query statistics for Mamba
+
+.. moduleauthor:: Oscar Campos <oscar.campos@member.fsf.org>
+
+"""
+
+import time
+import bisect
+import logging
+import threading
+import functools
+
+from twisted.python import log
+from storm.tracer import install_tracer, remove_tracer
+
+
+class QueryTracer(object):
+    """
+    Lightweight Storm tracer that records the time spent and the rows
+    affected by every SQL statement executed through Storm, aggregated
+    by statement. Statements that take longer than `threshold` seconds
+    are logged as slow queries.
+
+    The tracer is not installed at all unless `query_tracer` is set to
+    true in the database configuration file so it costs nothing when
+    disabled. Use :meth:`start` and :meth:`stop` to install it manually.
+
+    :param threshold: log statements slower than this (in seconds)
+    :type threshold: float
+    :param max_statements: maximum number of different statements to track
+    :type max_statements: int
+    """
+
+    instance = None
+    current_route = None
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self, threshold=1.0, max_statements=1000):
+        self.threshold = threshold
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {}
+
+    @classmethod
+    def start(cls, threshold=1.0, max_statements=1000):
+        """Install a new query tracer into Storm and return it back
+        """
+
+        if cls.instance is None:
+            cls.instance = cls(threshold, max_statements)
+            install_tracer(cls.instance)
+
+        return cls.instance
+
+    @classmethod
+    def stop(cls):
+        """Remove the installed query tracer from Storm (if any)
+        """
+
+        if cls.instance is not None:
+            remove_tracer(cls.instance)
+            cls.instance = None
+
+    def bind(self, function, origin):
+        """
+        Wrap the given function so the statements that it executes are
+        recorded as originated from `origin` (and from the route being
+        dispatched in the moment that the function has been bound)
+
+        :param function: the function that is going to run the statements
+        :type function: callable
+        :param origin: the name of the function (usually a model method)
+        :type origin: str
+        """
+
+        if self.current_route is not None:
+            origin = '{} -> {}'.format(self.current_route, origin)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self._local.origin = origin
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.origin = None
+
+        return wrapper
+
+    def stats(self):
+        """
+        Return back a copy of the aggregated statistics for every statement
+        as a dictionary with the statement as key. Histograms are lists of
+        counts for every bucket in :attr:`buckets` plus the overflow one.
+        """
+
+        with self._lock:
+            return dict(
+                (statement, dict(
+                    data,
+                    histogram=list(data['histogram']),
+                    origins=dict(data['origins'])
+                )) for statement, data in self._stats.iteritems()
+            )
+
+    def reset(self):
+        """Clear all the collected statistics
+        """
+
+        with self._lock:
+            self._stats.clear()
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        self._local.started = time.time()
+
+    def connection_raw_execute_success(self, connection, raw_cursor,
+                                       statement, params):
+        self._record(statement, getattr(raw_cursor, 'rowcount', -1))
+
+    def connection_raw_execute_error(self, connection, raw_cursor,
+                                     statement, params, error):
+        self._record(statement, -1, error)
+
+    def _record(self, statement, rows, error=None):
+        """Aggregate the statistics for the just executed statement
+        """
+
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            return
+
+        elapsed = time.time() - started
+        origin = getattr(self._local, 'origin', None)
+        self._local.started = None
+
+        with self._lock:
+            data = self._stats.get(statement)
+            if data is None:
+                if len(self._stats) >= self.max_statements:
+                    statement = '<other>'
+                data = self._stats.setdefault(statement, {
+                    'count': 0, 'errors': 0, 'rows': 0, 'time': 0.0,
+                    'max': 0.0, 'origins': {},
+                    'histogram': [0] * (len(self.buckets) + 1)
+                })
+
+            data['count'] += 1
+            data['time'] += elapsed
+            data['max'] = max(data['max'], elapsed)
+            data['histogram'][bisect.bisect_left(self.buckets, elapsed)] += 1
+            if rows > 0:
+                data['rows'] += rows
+            if error is not None:
+                data['errors'] += 1
+            if origin is not None:
+                data['origins'][origin] = data['origins'].get(origin, 0) + 1
+
+        if self.threshold is not None and elapsed >= self.threshold:
+            log.msg(
+                'Slow query ({:.3f}s, {} rows) from {}: {}'.format(
+                    elapsed, rows, origin or 'unknown', statement),
+                logLevel=logging.WARN
+            )
+
+
+__all__ = ['QueryTracer']
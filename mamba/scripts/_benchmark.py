@@ -0,0 +1,635 @@
+# -*- test-case-name: mamba.scripts.test.test_benchmark -*-
+# Copyright (c) 2012 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+WebSocket load test harness. It starts an echo server that uses
+:class:`~mamba.web.websocket.WebSocketProtocol` in a child process, opens
+a number of concurrent connections to it through the loopback interface
+and drives messages of the given size and rate through them.
+
+The throughput and the round trip latency are measured in the client side
+while the CPU time and the memory used by the server are measured in the
+child process so they are not polluted by the clients. The throughput of
+the frames masking is measured too.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import math
+import time
+import random
+from struct import pack, unpack_from
+
+from twisted.python import usage
+from twisted.protocols import basic
+from twisted.internet.task import LoopingCall
+from twisted.internet import defer, protocol, stdio
+
+import mamba
+from mamba import copyright
+from mamba.utils import json
+from mamba.web import websocket
+from mamba._version import versions
+from mamba.utils.output import darkred, darkgreen
+
+# This is an auto-generated property. Do not edit it.
+version = versions.Version('benchmark', 0, 1, 0)
+
+# the server process must import the same mamba that we are using
+MAMBA_PATH = os.path.dirname(os.path.dirname(os.path.abspath(mamba.__file__)))
+
+
+def show_version():
+    print('Mamba Benchmark Tools v{}'.format(version.short()))
+    print('{}'.format(copyright.copyright))
+
+
+class BenchmarkOptions(usage.Options):
+    """Benchmark options for mamba-admin tool
+    """
+    synopsis = '[options]'
+
+    optFlags = [
+        ['binary', 'b', 'Send binary messages instead of text ones'],
+        ['json', 'j', 'Print the results as JSON']
+    ]
+
+    optParameters = [
+        ['connections', 'c', 100, 'Number of concurrent connections', int],
+        ['size', 's', 128, 'Size of the messages in bytes', int],
+        ['rate', 'r', 10,
+            'Messages per second sent through every connection, if zero '
+            'every connection sends a new message as soon as the previous '
+            'one is echoed back', float],
+        ['duration', 'd', 10, 'Duration of the test in seconds', float],
+        ['min-throughput', None, None,
+            'Fail if less messages per second than this are echoed back',
+            float],
+        ['max-p99', None, None,
+            'Fail if the 99th percentile latency is greater than this (in '
+            'milliseconds)', float]
+    ]
+
+    def opt_version(self):
+        """Show version information and exit
+        """
+        show_version()
+        sys.exit(0)
+
+    def postOptions(self):
+        """Post options processing
+        """
+
+        if self['connections'] <= 0:
+            raise usage.UsageError('connections should be greater than zero')
+
+        if self['size'] < 8:
+            raise usage.UsageError(
+                'size should be at least 8 bytes (the timestamp size)')
+
+        if self['rate'] < 0 or self['duration'] <= 0:
+            raise usage.UsageError(
+                'rate and duration should be positive numbers')
+
+
+class Benchmark(object):
+    """
+    Benchmark tool
+
+    :param options: the command line options
+    :type options: :class:`~mamba.scripts._benchmark.BenchmarkOptions`
+    """
+
+    def __init__(self, options):
+        from twisted.internet import reactor
+
+        self.options = options
+        self.exit_code = 0
+
+        load = LoadTest(
+            options.subOptions['connections'], options.subOptions['size'],
+            options.subOptions['rate'], options.subOptions['duration'],
+            options.subOptions['binary']
+        )
+        d = load.run()
+        d.addCallback(self.report)
+        d.addErrback(self.error)
+        d.addBoth(lambda _: reactor.stop())
+
+        reactor.run()
+        sys.exit(self.exit_code)
+
+    def report(self, results):
+        """Print the results and check them against the given thresholds
+        """
+
+        failures = check(
+            results,
+            self.options.subOptions['min-throughput'],
+            self.options.subOptions['max-p99']
+        )
+
+        if self.options.subOptions['json']:
+            print(json.dumps(dict(results, failures=failures), indent=4))
+        else:
+            print(format_results(results))
+            for failure in failures:
+                print('[{}] {}'.format(darkred('FAIL'), failure))
+            if not failures:
+                print('[{}]'.format(darkgreen('Ok')))
+
+        if failures:
+            self.exit_code = 1
+
+    def error(self, failure):
+        """Print the error that made the test to fail
+        """
+
+        print('[{}] {}'.format(darkred('ERROR'), failure.getErrorMessage()))
+        self.exit_code = -1
+
+
+class LoadTest(object):
+    """
+    Open `connections` WebSocket connections against an echo server running
+    in a child process and send messages of `size` bytes through every one
+    of them at `rate` messages per second during `duration` seconds
+
+    :param connections: the number of concurrent connections
+    :type connections: int
+    :param size: the size of the messages in bytes
+    :type size: int
+    :param rate: messages per second per connection (zero for closed loop)
+    :type rate: float
+    :param duration: the duration of the test in seconds
+    :type duration: float
+    :param binary: if True binary messages are sent
+    :type binary: bool
+    """
+
+    drain_timeout = 1.0
+
+    def __init__(self, connections=100, size=128, rate=10, duration=10,
+                 binary=False):
+        from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.connections = connections
+        self.size = size
+        self.rate = rate
+        self.duration = duration
+        self.binary = binary
+        self.server = None
+        self.clients = []
+        self.latencies = []
+        self.snapshots = []
+        self.started = None
+        self.finished = None
+
+    @defer.inlineCallbacks
+    def run(self):
+        """Run the test and return a Deferred that fires with the results
+        """
+
+        self.server = ServerProcess()
+        port = yield self.server.start(self.reactor)
+
+        try:
+            self.snapshots.append((yield self.server.stats()))
+            yield self.connect(port)
+            self.snapshots.append((yield self.server.stats()))
+
+            self.started = time.time()
+            for client in self.clients:
+                client.start(self.rate)
+
+            yield self.sleep(self.duration)
+            for client in self.clients:
+                client.stop()
+
+            self.finished = time.time()
+            yield self.drain()
+            self.snapshots.append((yield self.server.stats()))
+        finally:
+            for client in self.clients:
+                client.transport.loseConnection()
+
+            yield self.server.stop()
+
+        defer.returnValue(self.results())
+
+    def connect(self, port):
+        """Open all the connections and wait for their handshakes
+        """
+
+        factory = BenchmarkClientFactory(self)
+        handshakes = []
+        for i in range(self.connections):
+            self.reactor.connectTCP('127.0.0.1', port, factory)
+            handshakes.append(factory.handshake())
+
+        return defer.gatherResults(handshakes, consumeErrors=True)
+
+    def drain(self):
+        """Wait (for a while) for the messages that are still in flight
+        """
+
+        deadline = time.time() + self.drain_timeout
+
+        def check():
+            if time.time() < deadline and any(
+                    client.in_flight for client in self.clients):
+                return self.sleep(0.05).addCallback(lambda _: check())
+
+        return check()
+
+    def sleep(self, seconds):
+        """Return a Deferred that fires after the given seconds
+        """
+
+        d = defer.Deferred()
+        self.reactor.callLater(seconds, d.callback, None)
+        return d
+
+    def results(self):
+        """Compute the results of the test
+        """
+
+        before, connected, after = self.snapshots
+        elapsed = self.finished - self.started
+        sent = sum(client.sent for client in self.clients)
+        latencies = sorted(self.latencies)
+
+        return {
+            'connections': self.connections,
+            'size': self.size,
+            'rate': self.rate,
+            'duration': elapsed,
+            'sent': sent,
+            'received': len(latencies),
+            'lost': sent - len(latencies),
+            'throughput': len(latencies) / elapsed,
+            'mask_throughput': mask_throughput(),
+            'latency': {
+                'p50': percentile(latencies, 50) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'max': (latencies[-1] if latencies else 0) * 1000
+            },
+            'server': {
+                'cpu': after['cpu'] - connected['cpu'],
+                'cpu_per_connection': (
+                    after['cpu'] - connected['cpu']) / self.connections,
+                'cpu_per_message': (
+                    after['cpu'] - connected['cpu']) / max(1, len(latencies)),
+                'memory': connected['rss'],
+                'memory_per_connection': float(
+                    connected['rss'] - before['rss']) / self.connections
+            }
+        }
+
+
+class BenchmarkClientProtocol(protocol.Protocol):
+    """
+    Minimal WebSocket client. It sends masked messages that carry the time
+    when they were sent in their first eight bytes so the latency can be
+    measured when they are echoed back by the server
+    """
+
+    def __init__(self):
+        self.buf = ''
+        self.reader = None
+        self.sender = None
+        self.sent = 0
+        self.in_flight = 0
+        self.closed_loop = False
+
+    def connectionMade(self):
+        self.factory.test.clients.append(self)
+        self.key = os.urandom(16).encode('base64').strip()
+        self.transport.write(
+            'GET / HTTP/1.1\r\n'
+            'Host: 127.0.0.1\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Key: {}\r\n'
+            'Sec-WebSocket-Version: 13\r\n\r\n'.format(self.key)
+        )
+
+    def dataReceived(self, data):
+        if self.reader is None:
+            self.buf += data
+            if '\r\n\r\n' not in self.buf:
+                return
+
+            head, _, data = self.buf.partition('\r\n\r\n')
+            self.buf = ''
+            if not head.startswith('HTTP/1.1 101'):
+                self.factory.handshake_done(
+                    self, websocket.WebSocketError(head.split('\r\n')[0]))
+                self.transport.loseConnection()
+                return
+
+            self.reader = websocket.HyBi07FrameReader()
+            self.factory.handshake_done(self)
+
+        now = time.time()
+        for opcode, payload in self.reader.feed(data):
+            if opcode in (websocket.DATA, websocket.BINARY):
+                self.in_flight -= 1
+                self.factory.test.latencies.append(
+                    now - unpack_from('>d', payload)[0])
+                if self.closed_loop:
+                    self.send_message()
+
+    def start(self, rate):
+        """Start sending messages at the given rate
+        """
+
+        if rate > 0:
+            self.sender = LoopingCall(self.send_message)
+            self.sender.start(1.0 / rate, now=False)
+        else:
+            self.closed_loop = True
+            self.send_message()
+
+    def stop(self):
+        """Stop sending messages
+        """
+
+        self.closed_loop = False
+        if self.sender is not None and self.sender.running:
+            self.sender.stop()
+
+    def send_message(self):
+        """Send a masked message with the current time on it
+        """
+
+        test = self.factory.test
+        self.transport.writeSequence(client_frame(
+            pack('>d', time.time()) + '\x00' * (test.size - 8),
+            websocket.OPCODE_BINARY if test.binary else websocket.OPCODE_TEXT
+        ))
+        self.sent += 1
+        self.in_flight += 1
+
+
+class BenchmarkClientFactory(protocol.ClientFactory):
+    """Factory for the benchmark clients
+    """
+
+    protocol = BenchmarkClientProtocol
+
+    def __init__(self, test):
+        self.test = test
+        self.waiting = []
+
+    def handshake(self):
+        """Return a Deferred that fires when a connection completes its
+        handshake (or fails to connect)
+        """
+
+        d = defer.Deferred()
+        self.waiting.append(d)
+        return d
+
+    def handshake_done(self, client, error=None):
+        d = self.waiting.pop(0)
+        if error is None:
+            d.callback(client)
+        else:
+            d.errback(error)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.waiting.pop(0).errback(reason)
+
+
+class ServerProcess(protocol.ProcessProtocol):
+    """
+    Controls the echo server running in the child process, the server
+    prints its port when it is listening and answers to every `stats`
+    line written to its standard input with a JSON line
+    """
+
+    def __init__(self):
+        self.buf = ''
+        self.started = defer.Deferred()
+        self.ended = defer.Deferred()
+        self.waiting = []
+
+    def start(self, reactor):
+        """Spawn the server and return a Deferred that fires with its port
+        """
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [MAMBA_PATH, env.get('PYTHONPATH')]))
+        reactor.spawnProcess(
+            self, sys.executable,
+            [sys.executable, '-m', 'mamba.scripts._benchmark'], env=env
+        )
+
+        return self.started
+
+    def stats(self):
+        """Ask the server for its CPU time and memory usage
+        """
+
+        d = defer.Deferred()
+        self.waiting.append(d)
+        self.transport.write('stats\n')
+        return d
+
+    def stop(self):
+        """Stop the server closing its standard input
+        """
+
+        self.transport.closeStdin()
+        return self.ended
+
+    def outReceived(self, data):
+        self.buf += data
+        while '\n' in self.buf:
+            line, self.buf = self.buf.split('\n', 1)
+            if not self.started.called:
+                self.started.callback(int(line))
+            else:
+                self.waiting.pop(0).callback(json.loads(line))
+
+    def errReceived(self, data):
+        sys.stderr.write(data)
+
+    def processEnded(self, reason):
+        error = websocket.WebSocketError('benchmark server exited')
+        if not self.started.called:
+            self.started.errback(error)
+
+        while self.waiting:
+            self.waiting.pop(0).errback(error)
+
+        self.ended.callback(None)
+
+
+class EchoProtocol(websocket.MessageProtocol):
+    """Send back every message received
+    """
+
+    def messageReceived(self, opcode, data):
+        self.sendMessage(data, opcode == websocket.OPCODE_BINARY)
+
+
+class EchoFactory(protocol.ServerFactory):
+    protocol = EchoProtocol
+
+
+class StatsProtocol(basic.LineReceiver):
+    """Answer to the stats requests of the benchmark in the server process
+    """
+
+    delimiter = '\n'
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def lineReceived(self, line):
+        if line == 'stats':
+            # resource is only available on Unix
+            import resource
+
+            rusage = resource.getrusage(resource.RUSAGE_SELF)
+            self.sendLine(json.dumps({
+                'cpu': rusage.ru_utime + rusage.ru_stime,
+                'rss': memory_usage(),
+                'connections': len(self.factory.protocols)
+            }))
+
+    def connectionLost(self, reason):
+        from twisted.internet import reactor
+
+        reactor.stop()
+
+
+def serve():
+    """Run the echo server in the benchmark child process
+    """
+
+    from twisted.internet import reactor
+
+    factory = websocket.WebSocketFactory(EchoFactory())
+    factory.ping_interval = None
+    port = reactor.listenTCP(0, factory, backlog=1024, interface='127.0.0.1')
+    stdio.StandardIO(StatsProtocol(factory))
+    print(port.getHost().port)
+    sys.stdout.flush()
+    reactor.run()
+
+
+def client_frame(payload, opcode=websocket.OPCODE_TEXT):
+    """Build a masked (client) frame as a list of strings
+
+    :param payload: the message payload
+    :type payload: str
+    :param opcode: the opcode of the message
+    :type opcode: int
+    """
+
+    header = websocket.HyBi07Frame.header(len(payload), opcode)
+    key = pack('>I', random.getrandbits(32))
+    return [
+        header[0], chr(ord(header[1]) | 0x80), header[2:], key,
+        websocket.HyBi07Frame(payload).mask(payload, key)
+    ]
+
+
+def mask_throughput(size=1048576, rounds=10):
+    """Return back how many MB per second are masked by the frames
+
+    :param size: the size of the masked buffer in bytes
+    :type size: int
+    :param rounds: how many times the buffer is masked
+    :type rounds: int
+    """
+
+    key, buf = os.urandom(4), os.urandom(size)
+    frame = websocket.HyBi07Frame('')
+
+    started = time.time()
+    for i in range(rounds):
+        frame.mask(buf, key)
+    elapsed = max(time.time() - started, 1e-6)
+
+    return size * rounds / 1048576.0 / elapsed
+
+
+def percentile(values, percent):
+    """Return the given percentile (nearest rank) of the sorted values
+    """
+
+    if not values:
+        return 0
+
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+def memory_usage():
+    """Return back the resident memory size of this process in bytes
+    """
+
+    import resource
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # no procfs, use the peak resident size (kilobytes on Linux/BSD)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def check(results, min_throughput=None, max_p99=None):
+    """Return back a list with the thresholds that the results violate
+    """
+
+    failures = []
+    if min_throughput is not None and results['throughput'] < min_throughput:
+        failures.append('throughput {:.1f} msg/s is lower than {:.1f}'.format(
+            results['throughput'], min_throughput))
+
+    if max_p99 is not None and results['latency']['p99'] > max_p99:
+        failures.append('p99 latency {:.2f}ms is greater than {:.2f}ms'.format(
+            results['latency']['p99'], max_p99))
+
+    if results['lost'] > 0:
+        failures.append('{} messages were not echoed back'.format(
+            results['lost']))
+
+    return failures
+
+
+def format_results(results):
+    """Format the results as a human readable report
+    """
+
+    server = results['server']
+    return '\n'.join([
+        'connections: {connections}, message size: {size} bytes, '
+        'rate: {rate} msg/s per connection'.format(**results),
+        'messages: {sent} sent, {received} received in {duration:.2f}s '
+        '({throughput:.1f} msg/s)'.format(**results),
+        'latency: p50 {p50:.2f}ms, p99 {p99:.2f}ms, max {max:.2f}ms'.format(
+            **results['latency']),
+        'server cpu: {:.3f}s ({:.3f}ms per connection, {:.1f}us per '
+        'message)'.format(
+            server['cpu'], server['cpu_per_connection'] * 1000,
+            server['cpu_per_message'] * 1000000),
+        'server memory: {:.1f}MB ({:.1f}KB per connection)'.format(
+            server['memory'] / 1048576.0,
+            server['memory_per_connection'] / 1024.0),
+        'frame masking: {mask_throughput:.1f}MB/s'.format(**results)
+    ])
+
+
+if __name__ == '__main__':
+    serve()
@@ -461,22 +461,14 @@ class Sql(object):
 
         db = self._prepare_model_db()[1]
 
-        stdout = sys.stdout
-        capture = StringIO()
-        sys.stdout = capture
-
         if mgr is None:
-            print(db.dump(ModelManager(), None, True))
-        else:
-            print(db.dump(mgr, None, True))
-
-        sys.stdout = stdout
+            mgr = ModelManager()
 
         if self.options.subOptions.opts['file'] is None:
-            print(capture.getvalue())
+            db.dump(mgr, None, True, stream=sys.stdout)
         else:
             with open(self.options.subOptions.opts['file'], 'w') as dump_file:
-                dump_file.write(capture.getvalue())
+                db.dump(mgr, None, True, stream=dump_file)
 
         sys.exit(0)
 
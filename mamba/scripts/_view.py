@@ -12,9 +12,13 @@ from string import Template
 from twisted.python import usage, filepath
 
 from mamba import copyright
+from mamba.web import bundle
+from mamba.core import templating, packages
+from mamba.application import appstyles, scripts
 from mamba.scripts import commons
 from mamba._version import versions
 from mamba.utils.camelcase import CamelCase
+from mamba.utils.output import darkred, darkgreen
 from mamba.scripts._sql import mamba_services_not_found
 
 # This is an auto-generated property. Do not edit it.
@@ -28,11 +32,21 @@ def show_version():
 
 class ViewOptions(usage.Options):
     """View  Configuration options for mamba-admin tool
+
+    Use `mamba-admin view --compile` to compile all the application
+    templates into the templates bytecode cache and `mamba-admin view
+    --bundle` to build the minified bundles of the application scripts and
+    stylesheets
     """
-    synopsis = '[options] name <controller>'
+    synopsis = '[options] name <controller> | --compile | --bundle'
 
     optFlags = [
         ['dump', 'd', 'Dumo to the standard output'],
+        ['compile', None,
+            'Compile the application templates into the bytecode cache'],
+        ['bundle', None,
+            'Build the minified bundles of the application scripts and '
+            'stylesheets'],
         ['noquestions', 'n',
             'When this option is set, mamba will NOT ask anything to the user '
             'that means it will overwrite any other version of the view files '
@@ -91,10 +105,19 @@ class View(object):
 
         try:
             mamba_services = commons.import_services()
-            del mamba_services
         except Exception:
             mamba_services_not_found()
 
+        if self.options.subOptions.opts['compile']:
+            mamba_services.config.Application('config/application.json')
+            sys.exit(0 if self._compile_views() else -1)
+
+        if self.options.subOptions.opts['bundle']:
+            mamba_services.config.Application('config/application.json')
+            sys.exit(0 if self._bundle_assets() else -1)
+
+        del mamba_services
+
         if self.options.subOptions.opts['name'] is None:
             print(self.options.subOptions)
             sys.exit(-1)
@@ -106,6 +129,71 @@ class View(object):
         self._write_view()
         sys.exit(0)
 
+    def _compile_views(self):
+        """
+        Compile all the templates in the application and the shared
+        packages view directories (and the mamba ones) into the templates
+        bytecode cache
+        """
+
+        search_paths = [
+            '{}/templates/jinja'.format(
+                filepath.dirname(templating.__file__).rsplit(
+                    filepath.os.sep, 1)[0]
+            )
+        ]
+
+        views = ['application/view']
+        for package in packages.PackagesManager().packages.values():
+            views.append('{}/view'.format(package.get('path')))
+
+        for view in views:
+            view = filepath.FilePath(view)
+            search_paths.append(view.child('templates').path)
+            if view.exists():
+                search_paths += [
+                    child.path for child in view.children()
+                    if child.isdir() and child.basename() != 'templates'
+                ]
+
+        print('Compiling templates...'.ljust(73), end='')
+        try:
+            compiled, errors = templating.compile_templates(
+                [path for path in search_paths if filepath.exists(path)])
+        except templating.NotConfigured as error:
+            print('[{}]'.format(darkred('Fail')))
+            print(error)
+            return False
+
+        print('[{}]'.format(
+            darkred('Fail') if errors else darkgreen('Ok')))
+        print('{} templates compiled'.format(len(compiled)))
+        for name, error in errors:
+            print('{}: {}'.format(name, error))
+
+        return not errors
+
+    def _bundle_assets(self):
+        """
+        Build the bundles of the application (and shared packages) scripts
+        and stylesheets into the static/bundles directory
+        """
+
+        print('Bundling scripts and stylesheets...'.ljust(73), end='')
+        try:
+            manifest = bundle.build(
+                appstyles.AppStyles(), scripts.AppScripts())
+        except (IOError, OSError) as error:
+            print('[{}]'.format(darkred('Fail')))
+            print(error)
+            return False
+
+        print('[{}]'.format(darkgreen('Ok')))
+        for entry in manifest['styles'] + manifest['scripts']:
+            print('{}: {} files'.format(entry['data'], len(entry['files'])))
+
+        return True
+
     def _dump_view(self):
         """Dump the view model to the standard output
         """
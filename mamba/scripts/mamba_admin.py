@@ -25,6 +25,7 @@ from commons import import_services
 from _view import ViewOptions, View
 from _model import ModelOptions, Model
 from _package import PackageOptions, Package
+from _benchmark import BenchmarkOptions, Benchmark
 from _project import ApplicationOptions, Application
 from _controller import ControllerOptions, Controller
 
@@ -66,7 +67,10 @@ class Options(usage.Options):
         ['stop', None, usage.Options,
             'Stop a mamba application (you should be in the app directory)'],
         ['restart', None, usage.Options,
-            'Reatart a mamba application (you should be in the app directory)']
+            'Reatart a mamba application (you should be in the app '
+            'directory)'],
+        ['benchmark', None, BenchmarkOptions,
+            'Run a WebSocket load test against a local echo server']
     ]
 
     optFlags = [
@@ -321,6 +325,9 @@ def run():
     if options.subCommand == 'package':
         Package(options.subOptions)
 
+    if options.subCommand == 'benchmark':
+        Benchmark(options)
+
 
 if __name__ == '__main__':
     run()
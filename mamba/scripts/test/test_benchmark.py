@@ -0,0 +1,75 @@
+
+# Copyright (c) 2012 - 2013 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Tests for mamba.scripts._benchmark
+"""
+
+from twisted.trial import unittest
+from twisted.python import usage
+
+from mamba.web import websocket
+from mamba.scripts import _benchmark
+
+
+class BenchmarkOptionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.options = _benchmark.BenchmarkOptions()
+
+    def test_defaults(self):
+        self.options.parseOptions([])
+        self.assertEqual(self.options['connections'], 100)
+        self.assertEqual(self.options['size'], 128)
+        self.assertIdentical(self.options['max-p99'], None)
+
+    def test_size_must_fit_the_timestamp(self):
+        self.assertRaises(
+            usage.UsageError, self.options.parseOptions, ['--size=4'])
+
+
+class HelpersTest(unittest.TestCase):
+
+    def test_client_frames_are_parsed_by_the_server_reader(self):
+        reader = websocket.HyBi07FrameReader()
+        frame = ''.join(_benchmark.client_frame(
+            'x' * 300, websocket.OPCODE_BINARY))
+
+        self.assertEqual(ord(frame[1]) & 0x80, 0x80)
+        self.assertEqual(reader.feed(frame), [(websocket.BINARY, 'x' * 300)])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(_benchmark.percentile(values, 50), 50)
+        self.assertEqual(_benchmark.percentile(values, 99), 99)
+        self.assertEqual(_benchmark.percentile([], 99), 0)
+
+    def test_mask_throughput(self):
+        self.assertTrue(_benchmark.mask_throughput(size=1024, rounds=2) > 0)
+
+    def test_check_thresholds(self):
+        results = {'throughput': 10.0, 'latency': {'p99': 5.0}, 'lost': 0}
+        self.assertEqual(_benchmark.check(results, 5, 10), [])
+        self.assertEqual(len(_benchmark.check(results, 20, 1)), 2)
+
+
+class LoadTestTest(unittest.TestCase):
+
+    timeout = 30
+
+    def test_load_test_over_loopback(self):
+        load = _benchmark.LoadTest(
+            connections=3, size=64, rate=20, duration=0.3)
+
+        def check(results):
+            self.assertEqual(results['connections'], 3)
+            self.assertTrue(results['sent'] > 0)
+            self.assertEqual(results['received'], results['sent'])
+            self.assertTrue(
+                results['latency']['p99'] >= results['latency']['p50'])
+            self.assertTrue(results['server']['memory'] > 0)
+            self.assertIn('msg/s', _benchmark.format_results(results))
+            self.assertIn('MB/s', _benchmark.format_results(results))
+
+        return load.run().addCallback(check)
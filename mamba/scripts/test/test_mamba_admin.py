@@ -20,6 +20,7 @@ from twisted.python import usage, filepath
 from mamba.utils import config
 from mamba.scripts import mamba_admin, commons
 from mamba.scripts._project import Application
+from mamba.scripts import _view
 from mamba.scripts._view import ViewOptions, View
 from mamba.scripts._model import ModelOptions, Model
 from mamba.scripts._controller import ControllerOptions, Controller
@@ -31,6 +32,10 @@ from mamba.scripts._package import (
 )
 
 
+# keep the real View.process as some tests replace it
+view_process = View.process
+
+
 # set me as True if you want to skip slow command line tests
 # I dont think you want this set as True unless you are adding
 # some tests to command line scripts
@@ -784,6 +789,16 @@ class MambaAdminViewTest(unittest.TestCase):
         self.config.parseOptions(['test_model', 'test'])
         self.assertEqual(self.config['description'], None)
 
+    def test_compile_and_bundle_are_flags(self):
+        self.config.parseOptions(['--compile'])
+        self.assertTrue(self.config['compile'])
+        self.assertEqual(self.config['name'], None)
+
+        config = ViewOptions()
+        config.parseOptions(['compile'])
+        self.assertFalse(config['compile'])
+        self.assertEqual(config['name'], 'Compile')
+
 
 class ViewScriptTest(unittest.TestCase):
 
@@ -799,6 +814,62 @@ class ViewScriptTest(unittest.TestCase):
     def test_use_outside_application_directory_fails(self):
         _test_use_outside_application_directory_fails(self)
 
+    def test_no_arguments_prints_usage(self):
+        self.patch(View, 'process', view_process)
+        self.patch(commons, 'import_services', lambda: None)
+        exits = []
+
+        def exit(code):
+            exits.append(code)
+            raise SystemExit(code)
+
+        self.patch(sys, 'exit', exit)
+        self.config.parseOptions(['view'])
+        self.assertRaises(SystemExit, View, self.config)
+
+        self.assertEqual(exits, [-1])
+        self.assertTrue(
+            'Usage: mamba-admin [options] view' in self.capture.getvalue())
+
+    def test_views_named_compile_or_bundle_are_written(self):
+        self.patch(View, 'process', view_process)
+        self.patch(commons, 'import_services', lambda: None)
+        self.patch(sys, 'exit', lambda code: None)
+        written = []
+        self.patch(View, '_write_view', lambda view: written.append(
+            view.options.subOptions['filename']))
+        self.patch(View, '_compile_views', lambda view: self.fail('compiled'))
+        self.patch(View, '_bundle_assets', lambda view: self.fail('bundled'))
+
+        for name in ('compile', 'bundle'):
+            self.config.parseOptions(['view', name])
+            View(self.config)
+
+        self.assertEqual(written, ['compile', 'bundle'])
+
+    def test_compile_views_includes_shared_packages(self):
+        shared = filepath.FilePath(self.mktemp())
+        shared.child('view').child('templates').makedirs()
+        shared.child('view').child('Shared').makedirs()
+
+        class PackagesManager(object):
+            packages = {'shared': {'path': shared.path}}
+
+        compiled = []
+
+        def compile_templates(paths):
+            compiled.extend(paths)
+            return [], []
+
+        self.patch(_view.packages, 'PackagesManager', PackagesManager)
+        self.patch(_view.templating, 'compile_templates', compile_templates)
+        self.patch(View, 'process', lambda _: 0)
+        self.config.parseOptions(['view', '--compile'])
+
+        self.assertTrue(View(self.config)._compile_views())
+        self.assertIn(shared.child('view').child('templates').path, compiled)
+        self.assertIn(shared.child('view').child('Shared').path, compiled)
+
     def test_dump(self):
         View.process = lambda _: 0
 
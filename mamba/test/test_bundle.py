@@ -0,0 +1,171 @@
+
+# Copyright (c) 2012 - 2013 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Tests for mamba.web.bundle
+"""
+
+from twisted.trial import unittest
+from twisted.python import filepath
+from twisted.web.test.test_web import DummyRequest
+
+from mamba.utils import json
+from mamba.web import bundle
+
+
+class File(object):
+
+    def __init__(self, path, less=False, type='text/javascript'):
+        self.path = path
+        self.name = filepath.basename(path)
+        self.data = '/styles/{}'.format(self.name)
+        self.less = less
+        self.type = type
+
+
+class Manager(object):
+
+    def __init__(self, store, files):
+        self._styles_store = self._scripts_store = store
+        self.stylesheets = self.scripts = dict((f.name, f) for f in files)
+
+
+class Managers(object):
+
+    def __init__(self, *managers):
+        self.managers = managers
+
+
+class MinifyTest(unittest.TestCase):
+
+    def test_minify_css(self):
+        self.patch(bundle, 'rcssmin', None)
+        self.assertEqual(
+            bundle.minify_css(
+                '/* header */\nbody > p {\n    color: red;\n'
+                '    content: "a  /* b */";\n}\n'
+            ),
+            'body>p{color:red;content:"a  /* b */"}'
+        )
+
+    def test_rewrite_css_urls(self):
+        self.assertEqual(
+            bundle.rewrite_css_urls(
+                'a{background:url(img/a.png)}'
+                'b{background:url( "../fonts/b.woff" )}'
+                "c{background:url('/img/c.png')}"
+                'd{background:url(data:image/png;base64,AAA=)}'
+                'e{background:url(http://example.com/e.png)}',
+                '/styles/main.css'
+            ),
+            'a{background:url(/styles/img/a.png)}'
+            'b{background:url("/fonts/b.woff")}'
+            "c{background:url('/img/c.png')}"
+            'd{background:url(data:image/png;base64,AAA=)}'
+            'e{background:url(http://example.com/e.png)}'
+        )
+
+    def test_minify_js_without_rjsmin_keeps_the_source(self):
+        self.patch(bundle, 'rjsmin', None)
+        source = 'var s = `a\n\n    // b`;\nvar t = "c\\\n    d";\n'
+        self.assertEqual(bundle.minify_js(source), source)
+
+
+class BuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.package = filepath.FilePath(self.mktemp()).child('package')
+        self.views = self.package.child('view')
+        self.views.child('stylesheets').makedirs()
+        self.views.child('scripts').makedirs()
+        self.directory = filepath.FilePath(self.mktemp())
+
+        self.css = self.add('stylesheets', 'main.css', 'body {\n}\n')
+        self.less = self.add('stylesheets', 'theme.less', '@a: 1;')
+        self.js = self.add('scripts', 'main.js', 'var a = 1;\n')
+        self.dart = self.add('scripts', 'main.dart', 'main() {}')
+
+    def add(self, store, name, content):
+        child = self.views.child(store).child(name)
+        child.setContent(content)
+        return child
+
+    def build(self):
+        styles = Manager(self.views.child('stylesheets').path, [
+            File(self.css.path), File(self.less.path, less=True)])
+        scripts = Manager(self.views.child('scripts').path, [
+            File(self.js.path), File(self.dart.path, type='text/dart')])
+
+        return bundle.build(
+            Managers(styles), Managers(scripts), self.directory.path)
+
+    def test_build_writes_fingerprinted_bundles(self):
+        manifest = self.build()
+
+        style = manifest['styles'][0]
+        self.assertEqual(style['name'], 'package')
+        self.assertEqual(style['files'], ['main.css'])
+        self.assertTrue(style['data'].startswith('/bundles/package-'))
+        self.assertEqual(
+            self.directory.child(style['data'].rsplit('/', 1)[1]).getContent(),
+            bundle.minify_css('body {\n}\n')
+        )
+        self.assertEqual(manifest['scripts'][0]['type'], 'text/javascript')
+        self.assertEqual(
+            bundle.load_manifest(self.directory.path), json.loads(
+                json.dumps(manifest)))
+
+    def test_build_rewrites_relative_urls(self):
+        self.css.setContent('body {\n    background: url(img/bg.png);\n}\n')
+        manifest = self.build()
+
+        style = manifest['styles'][0]
+        self.assertIn(
+            'url(/styles/img/bg.png)',
+            self.directory.child(style['data'].rsplit('/', 1)[1]).getContent()
+        )
+
+    def test_build_does_not_bundle_imports(self):
+        self.css.setContent('@import url(reset.css);\n')
+        manifest = self.build()
+
+        self.assertEqual(manifest['styles'], [])
+
+    def test_build_removes_previous_bundles(self):
+        self.build()
+        self.css.setContent('p {\n}\n')
+        self.build()
+
+        self.assertEqual(len(self.directory.globChildren('*.css')), 1)
+
+    def test_load_manifest_returns_none_if_not_built(self):
+        self.assertIdentical(bundle.load_manifest(self.directory.path), None)
+
+    def test_apply_replaces_the_bundled_files(self):
+        manifest = self.build()
+        less = File(self.less.path, less=True)
+
+        styles, scripts = bundle.apply(
+            [File(self.css.path), less], [], manifest)
+        self.assertEqual(styles, [less, manifest['styles'][0]])
+        self.assertEqual(scripts, manifest['scripts'])
+
+
+class BundlesTest(unittest.TestCase):
+
+    def test_bundles_are_served_with_far_future_expiration(self):
+        directory = filepath.FilePath(self.mktemp())
+        directory.makedirs()
+        directory.child('main-0123.css').setContent('body{}')
+
+        request = DummyRequest([''])
+        resource = bundle.Bundles(directory.path).getChild(
+            'main-0123.css', request)
+        resource.render_GET(request)
+
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('cache-control'),
+            ['public, max-age={}'.format(bundle.MAX_AGE)]
+        )
+        self.assertTrue(request.responseHeaders.hasHeader('expires'))
@@ -9,8 +9,10 @@ Tests for mamba.enterprise.database
 import functools
 from sqlite3 import sqlite_version_info
 
-from storm.locals import Store
+from storm.locals import Store, Storm, Int, Unicode, Float, Bool
+from storm.locals import create_database
 from twisted.trial import unittest
+from twisted.python import filepath
 from zope.component import getUtility
 from storm.zope.interfaces import IZStorm
 from storm.exceptions import DisconnectionError
@@ -331,7 +333,7 @@ class DatabaseTest(unittest.TestCase):
 
     def test_ensure_connect_called_when_ensure_connect_is_true(self):
 
-        def _ensure_connect():
+        def _ensure_connect(database):
             raise RuntimeError
 
         self.database._ensure_connect = _ensure_connect
@@ -367,16 +369,175 @@ class DatabaseTest(unittest.TestCase):
 
         database.getUtility = _getUtility
 
-    def _prepare_store_spy(self, raises_exception=False):
+    def test_ensure_connect_uses_the_requested_database(self):
+
+        getUtility_spy, store = self._prepare_store_spy(database='mamba2')
+
+        from mamba.enterprise import database
+        _getUtility = database.getUtility
+        database.getUtility = getUtility_spy
+
+        self.database.store('mamba2', ensure_connect=True)
+        assert_that(store.execute, called().with_args('SELECT 1').times(1))
+
+        database.getUtility = _getUtility
+
+    def test_ensure_connect_does_not_ping_recently_used_stores(self):
+
+        getUtility_spy, store = self._prepare_store_spy()
+
+        from mamba.enterprise import database
+        _getUtility = database.getUtility
+        database.getUtility = getUtility_spy
+
+        self.database.store(ensure_connect=True)
+        self.database.store(ensure_connect=True)
+        self.database.store(ensure_connect=True)
+        assert_that(store.execute, called().with_args('SELECT 1').times(1))
+
+        database.getUtility = _getUtility
+
+    def test_ensure_connect_pings_idle_stores(self):
+
+        getUtility_spy, store = self._prepare_store_spy()
+
+        from mamba.enterprise import database
+        _getUtility = database.getUtility
+        database.getUtility = getUtility_spy
+
+        self.database.store(ensure_connect=True)
+        self.database._Database__activity.stores['mamba'] -= 3600
+        self.database.store(ensure_connect=True)
+        assert_that(store.execute, called().with_args('SELECT 1').times(2))
+
+        database.getUtility = _getUtility
+
+    def test_transactor_retries_are_configurable(self):
+
+        from mamba.enterprise.database import Transactor
+        self.assertEqual(
+            Transactor.retries,
+            getattr(config.Database(), 'connection_retries', 2)
+        )
+
+        self.patch(config, 'Database', lambda: self.fail('config read'))
+        self.assertEqual(
+            Transactor(self.get_pool()).retries, Transactor.retries)
+
+    def test_ensure_connect_does_not_read_the_config(self):
+
+        getUtility_spy, store = self._prepare_store_spy()
+
+        from mamba.enterprise import database
+        self.patch(database, 'getUtility', getUtility_spy)
+        self.database.store(ensure_connect=True)
+
+        self.patch(config, 'Database', lambda: self.fail('config read'))
+        self.database.store(ensure_connect=True)
+        assert_that(store.execute, called().with_args('SELECT 1').times(1))
+
+    def _prepare_store_spy(self, raises_exception=False, database='mamba'):
 
         with Spy() as store:
-            getUtility_spy = lambda _: {'mamba': store}
+            getUtility_spy = lambda _: {database: store}
             if raises_exception is True:
                 store.execute(ANY_ARG).raises(DisconnectionError)
 
         return getUtility_spy, store
 
 
+class DumpDataThing(Storm):
+    __storm_table__ = 'thing'
+    id = Int(primary=True)
+    name = Unicode()
+    value = Float()
+    active = Bool()
+
+
+class DumpDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.uri = config.Database().uri
+        # do not reload the config/database.json of the working directory
+        self.patch(config.Database, 'load', lambda self, config_file='': None)
+        config.Database().uri = 'sqlite:{}'.format(
+            filepath.FilePath(self.mktemp()).path)
+
+        store = Store(create_database(config.Database().uri))
+        store.execute(
+            'CREATE TABLE thing (id INTEGER PRIMARY KEY, name VARCHAR, '
+            'value FLOAT, active INTEGER)'
+        )
+        for i in range(5):
+            store.execute(
+                'INSERT INTO thing VALUES (?, ?, ?, ?)',
+                (i, u"O'Neil {}".format(i), i / 2.0, i % 2)
+            )
+        store.execute('INSERT INTO thing VALUES (5, NULL, NULL, NULL)')
+        store.commit()
+        store.close()
+
+    def tearDown(self):
+        config.Database().uri = self.uri
+
+    def test_insert_data_is_batched(self):
+        from mamba.enterprise.sqlite import SQLite
+
+        adapter = SQLite(DumpDataThing())
+        adapter.dump_batch_size = 4
+        chunks = list(adapter.iter_insert_data(None))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0].count('\n('), 4)
+        self.assertEqual(chunks[1].count('\n('), 2)
+        self.assertTrue(chunks[0].startswith("INSERT INTO 'thing' ("))
+        self.assertTrue(all(chunk.endswith(';') for chunk in chunks))
+
+    def test_insert_data_quotes_values(self):
+        from mamba.enterprise.sqlite import SQLite
+
+        sql = SQLite(DumpDataThing()).insert_data(None)
+        self.assertTrue("'O''Neil 1'" in sql)
+        self.assertEqual(sql.count('NULL'), 3)
+
+        store = Store(create_database('sqlite:'))
+        store.execute(
+            'CREATE TABLE thing (id INTEGER PRIMARY KEY, name VARCHAR, '
+            'value FLOAT, active INTEGER)'
+        )
+        store.execute(sql.replace("'thing'", 'thing'))
+        self.assertEqual(
+            store.execute('SELECT name FROM thing WHERE id = 1').get_one(),
+            (u"O'Neil 1",)
+        )
+
+    def test_postgres_insert_data_uses_copy(self):
+        from mamba.enterprise.postgres import PostgreSQL
+
+        chunks = list(PostgreSQL(DumpDataThing()).iter_insert_data(None))
+        self.assertTrue(chunks[0].startswith('COPY thing ('))
+        self.assertTrue(chunks[0].endswith(') FROM stdin;'))
+        self.assertEqual(len(chunks[1].split('\n')), 6)
+        self.assertTrue("O'Neil 1" in chunks[1])
+        self.assertTrue('0.5' in chunks[1])
+        self.assertEqual(chunks[1].split('\n')[-1].count('\\N'), 3)
+        self.assertEqual(chunks[-1], '\\.')
+
+    def test_postgres_copy_value_arrays(self):
+        from mamba.enterprise.postgres import PostgreSQL
+
+        copy_value = PostgreSQL(DumpDataThing())._copy_value
+        self.assertEqual(copy_value([1, 2]), '{"1","2"}')
+        self.assertEqual(copy_value([[1], [2]]), '{{"1"},{"2"}}')
+        self.assertEqual(copy_value([u'a', None]), '{"a",NULL}')
+        self.assertEqual(
+            copy_value([u'a,b', u'{c}', u'd e']), '{"a,b","{c}","d e"}')
+        # array escaping first and COPY escaping after that
+        self.assertEqual(copy_value([u'say "hi"']), '{"say \\\\"hi\\\\""}')
+        self.assertEqual(copy_value([u'a\\b']), '{"a\\\\\\\\b"}')
+        self.assertEqual(copy_value([u'a\tb']), '{"a\\tb"}')
+
+
 class NativeEnumTest(unittest.TestCase):
 
     def test_enum(self):
@@ -0,0 +1,62 @@
+
+# Copyright (c) 2012 - 2013 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Tests for mamba.utils.filevariables
+"""
+
+import os
+
+from twisted.trial import unittest
+from twisted.python import filepath
+
+from mamba.utils import filevariables
+
+
+class FileVariablesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file = filepath.FilePath(self.mktemp())
+        self.file.setContent(
+            '# -*- mamba-file-type: mamba-controller -*-\nimport os\n')
+
+    def test_get_value(self):
+        variables = filevariables.FileVariables(self.file.path)
+        self.assertEqual(
+            variables.get_value('mamba-file-type'), 'mamba-controller')
+        self.assertIdentical(variables.get_value('missing'), None)
+
+    def test_raises_without_filename(self):
+        self.assertRaises(
+            filevariables.FileVariableError, filevariables.FileVariables)
+
+    def test_files_are_read_once_per_change(self):
+        reads = []
+        load = filevariables.FileVariables._load_variables
+
+        def _load_variables(self):
+            reads.append(self._filename)
+            return load(self)
+
+        self.patch(
+            filevariables.FileVariables, '_load_variables', _load_variables)
+        filevariables.FileVariables(self.file.path)
+        filevariables.FileVariables(self.file.path)
+        self.assertEqual(len(reads), 1)
+
+        self.file.setContent('# -*- mamba-file-type: mamba-model -*-\n')
+        os.utime(self.file.path, (0, 0))
+        variables = filevariables.FileVariables(self.file.path)
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(variables.get_value('mamba-file-type'), 'mamba-model')
+
+    def test_cached_variables_are_not_shared(self):
+        variables = filevariables.FileVariables(self.file.path)
+        variables.get_variables()['mamba-file-type'] = 'changed'
+
+        self.assertEqual(
+            filevariables.FileVariables(self.file.path).get_value(
+                'mamba-file-type'),
+            'mamba-controller'
+        )
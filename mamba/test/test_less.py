@@ -7,6 +7,8 @@ Tests for mamba.utils.less
 """
 
 import os
+import stat
+import getpass
 import tempfile
 
 from twisted.web import server
@@ -139,6 +141,122 @@ class LessCompilerTests(unittest.TestCase):
         self.flushLoggedErrors()
 
 
+class LessCacheTest(unittest.TestCase):
+    """
+    Tests for mamba.utils.less.LessCache
+    """
+
+    def setUp(self):
+        self.compiles = []
+        self.directory = filepath.FilePath(self.mktemp())
+        self.directory.makedirs()
+        self.styles = filepath.FilePath(self.mktemp())
+        self.styles.makedirs()
+        self.style = self.styles.child('style.less')
+        self.style.setContent('@import "colors";\nbody { color: @red; }')
+        self.colors = self.styles.child('colors.less')
+        self.colors.setContent('@red: #f00;')
+        self.cache = less.LessCache(self.directory.path)
+
+        def compile(compiler):
+            d = defer.Deferred()
+            self.compiles.append(d)
+            return d
+
+        self.patch(less.LessCompiler, 'compile', compile)
+
+    def touch(self, style, mtime):
+        os.utime(style.path, (mtime, mtime))
+
+    def test_dependencies_include_the_imports(self):
+        self.assertEqual(
+            self.cache.dependencies(self.style.path),
+            [self.style.path, self.colors.path]
+        )
+
+    def test_compiled_scripts_are_cached(self):
+        d = self.cache.get(self.style.path)
+        self.compiles[0].callback(u'body { color: #f00; }')
+
+        self.assertEqual(self.successResultOf(d), u'body { color: #f00; }')
+        self.assertEqual(
+            self.cache.get(self.style.path), u'body { color: #f00; }')
+        self.assertEqual(len(self.compiles), 1)
+
+    def test_concurrent_requests_share_the_compilation(self):
+        first = self.cache.get(self.style.path)
+        second = self.cache.get(self.style.path)
+        self.compiles[0].callback(u'css')
+
+        self.assertEqual(len(self.compiles), 1)
+        self.assertEqual(self.successResultOf(first), u'css')
+        self.assertEqual(self.successResultOf(second), u'css')
+
+    def test_modified_imports_invalidate_the_cache(self):
+        self.touch(self.colors, 1000)
+        self.cache.get(self.style.path)
+        self.compiles[0].callback(u'old')
+        self.touch(self.colors, 2000)
+
+        d = self.cache.get(self.style.path)
+        self.compiles[1].callback(u'new')
+        self.assertEqual(self.successResultOf(d), u'new')
+
+    def test_compiled_scripts_are_stored_on_disk(self):
+        self.touch(self.style, 1000)
+        self.cache.get(self.style.path)
+        self.compiles[0].callback(u'old')
+        self.touch(self.style, 2000)
+        self.cache.get(self.style.path)
+        self.compiles[1].callback(u'new')
+
+        cache = less.LessCache(self.directory.path)
+        self.assertEqual(cache.get(self.style.path), u'new')
+        self.assertEqual(len(self.directory.children()), 1)
+
+    def test_fallback_scripts_are_not_stored_on_disk(self):
+
+        def compile(compiler):
+            compiler.fallback = True
+            return u'source'
+
+        self.patch(less.LessCompiler, 'compile', compile)
+        self.assertEqual(
+            self.successResultOf(self.cache.get(self.style.path)), u'source')
+        self.assertEqual(self.directory.children(), [])
+
+
+class CacheDirectoryTest(unittest.TestCase):
+    """
+    Tests for the mamba.utils.less disk cache directory
+    """
+
+    def setUp(self):
+        self.tmp = filepath.FilePath(self.mktemp())
+        self.tmp.makedirs()
+        self.patch(less.tempfile, 'gettempdir', lambda: self.tmp.path)
+        self.patch(less, '_cache', None)
+
+    def test_cache_is_created_on_first_use(self):
+        self.assertIdentical(less._cache, None)
+        cache = less.get_cache()
+        self.assertIdentical(less.get_cache(), cache)
+
+    def test_default_directory_is_private(self):
+        directory = less.get_cache_directory()
+
+        self.assertEqual(filepath.dirname(directory), self.tmp.path)
+        self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0o700)
+
+    def test_insecure_default_directory_is_refused(self):
+        directory = self.tmp.child(
+            'mamba-less-cache-{}'.format(getpass.getuser()))
+        directory.makedirs()
+        directory.chmod(0o777)
+
+        self.assertIdentical(less.get_cache_directory(), None)
+
+
 class LessResourceTest(unittest.TestCase):
     """
     Tests for mamba.utils.less.LessResource
@@ -0,0 +1,136 @@
+
+# Copyright (c) 2012 - Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Tests for mamba.enterprise.metrics
+"""
+
+from twisted.trial import unittest
+from twisted.web.test.test_web import DummyRequest
+
+from mamba.utils import json
+from mamba.core.resource import Metrics
+from mamba.enterprise.database import Transactor
+from mamba.enterprise.metrics import TransactionMetrics
+from mamba.test.test_model import DummyThreadPool, DummyModel
+
+
+class FakeTransaction(object):
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def commit(self):
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        pass
+
+
+class TransactionMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = TransactionMetrics()
+        self.metrics.reset()
+
+    def tearDown(self):
+        self.metrics.reset()
+
+    def test_metrics_are_shared(self):
+        self.metrics.record('Dummy.read', 0.0, 0.0, 'success')
+        self.assertTrue('Dummy.read' in TransactionMetrics().stats()[
+            'transactions'])
+
+    def test_record_aggregates_by_name(self):
+        self.metrics.record('Dummy.read', 0.002, 0.02, 'success')
+        self.metrics.record('Dummy.read', 0.004, 0.01, 'error')
+
+        data = self.metrics.stats()['transactions']['Dummy.read']
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['outcomes'], {'success': 1, 'error': 1})
+        self.assertAlmostEqual(data['wait']['total'], 0.006)
+        self.assertEqual(data['wait']['max'], 0.004)
+        self.assertEqual(data['run']['max'], 0.02)
+        self.assertEqual(data['wait']['histogram'][1], 2)
+        self.assertEqual(data['run']['histogram'][3], 1)
+
+    def test_stats_include_pool_size(self):
+        pool = DummyThreadPool()
+        pool.min, pool.max = 5, 20
+
+        stats = self.metrics.stats(pool)
+        self.assertEqual(stats['pool']['min'], 5)
+        self.assertEqual(stats['pool']['max'], 20)
+
+    def test_transactor_records_transactions(self):
+
+        class Dummy(object):
+            def read(self, name=None):
+                return name
+
+        transactor = Transactor(DummyThreadPool(), FakeTransaction())
+        result = transactor.run(Dummy.read.im_func, Dummy(), name='result')
+
+        def check(result):
+            self.assertEqual(result, 'result')
+            data = self.metrics.stats()['transactions']['Dummy.read']
+            self.assertEqual(data['outcomes'], {'success': 1})
+
+        return result.addCallback(check)
+
+    def test_transactor_records_errors(self):
+
+        def fail():
+            raise RuntimeError
+
+        transactor = Transactor(DummyThreadPool(), FakeTransaction())
+        result = self.assertFailure(transactor.run(fail), RuntimeError)
+
+        def check(ignored):
+            data = self.metrics.stats()['transactions']['fail']
+            self.assertEqual(data['outcomes'], {'error': 1})
+
+        return result.addCallback(check)
+
+    def test_transactor_records_commit_errors(self):
+
+        def write():
+            return 'written'
+
+        transactor = Transactor(
+            DummyThreadPool(), FakeTransaction(RuntimeError()))
+        result = self.assertFailure(transactor.run(write), RuntimeError)
+
+        def check(ignored):
+            data = self.metrics.stats()['transactions']['write']
+            self.assertEqual(data['outcomes'], {'error': 1})
+
+        return result.addCallback(check)
+
+    def test_model_all_is_recorded_with_its_name(self):
+        names = []
+
+        def run(transactor, function, *args, **kwargs):
+            names.append(Transactor._name(function, args))
+
+        class Database(object):
+            pool = DummyThreadPool()
+
+        self.patch(Transactor, 'run', run)
+        self.patch(DummyModel, 'database', Database())
+        DummyModel.all()
+        self.assertEqual(names, ['DummyModel.all'])
+
+    def test_metrics_resource_renders_json(self):
+        self.metrics.record('Dummy.read', 0.0, 0.0, 'success')
+
+        request = DummyRequest([''])
+        result = json.loads(Metrics(None).render_GET(request))
+        self.assertEqual(
+            result['transactions']['Dummy.read']['count'], 1)
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('content-type'),
+            ['application/json']
+        )
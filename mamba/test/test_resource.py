@@ -9,10 +9,12 @@ Tests for mamba.core.resource
 import os
 
 from twisted.trial import unittest
+from twisted.internet import task
 from twisted.web.resource import NoResource
 from twisted.python.filepath import FilePath
 
-from mamba.core.resource import Resource, Assets
+from mamba.core import GNU_LINUX
+from mamba.core.resource import Resource, Assets, RenderKeys
 
 
 class ResourceTest(unittest.TestCase):
@@ -25,6 +27,27 @@ class ResourceTest(unittest.TestCase):
         assert(resource._scripts_manager)
 
 
+class RenderKeysTest(unittest.TestCase):
+
+    def test_modifications_change_the_version(self):
+        keys = RenderKeys({'doctype': 'html'})
+        version = keys.version
+
+        keys['title'] = 'Mamba'
+        self.assertNotEqual(keys.version, version)
+        version = keys.version
+
+        keys.update(title='Mamba')
+        del keys['title']
+        self.assertEqual(keys.version, version + 2)
+
+    def test_reads_do_not_change_the_version(self):
+        keys = RenderKeys({'doctype': 'html'})
+        keys.get('doctype')
+        dict(**keys)
+        self.assertEqual(keys.version, 0)
+
+
 class AssetsTest(unittest.TestCase):
 
     def setUp(self):
@@ -62,3 +85,91 @@ class AssetsTest(unittest.TestCase):
     def test_render_head_is_render_get(self):
 
         self.assertEqual(self.assets.render_HEAD, self.assets.render_GET)
+
+    def test_first_path_wins_on_duplicated_names(self):
+
+        first, second = FilePath(self.mktemp()), FilePath(self.mktemp())
+        for path in (first, second):
+            path.makedirs()
+            path.child('logo.png').setContent(path.path)
+
+        self.assets.add_paths([first.path, second.path])
+        self.assertEqual(
+            self.assets.getChild('logo.png', None).path,
+            first.child('logo.png').path
+        )
+
+    def test_get_child_does_not_list_paths_per_request(self):
+
+        self.assets.add_paths(['../mamba/test/dummy_app/static'])
+        for file in self.assets.paths:
+            file.listNames = lambda: self.fail('listed')
+
+        self.assertIsInstance(
+            self.assets.getChild('favicon.ico', None), FilePath)
+
+    def test_index_is_refreshed_on_notify(self):
+
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        self.assets.add_paths([path.path])
+        path.child('new.png').setContent('')
+        self.assets._notify(None, path.child('new.png'), 0)
+
+        self.assertIn('new.png', self.assets.index)
+
+    def test_index_is_refreshed_on_miss(self):
+
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        self.assets.add_paths([path.path])
+        path.child('new.png').setContent('')
+
+        self.assertIsInstance(self.assets.getChild('new.png', None), FilePath)
+
+    def test_paths_are_not_listed_on_miss(self):
+
+        for file in self.assets.paths:
+            file.listNames = lambda: self.fail('listed')
+
+        self.assertIsInstance(
+            self.assets.getChild('invalid', None), NoResource)
+        self.assertIsInstance(self.assets.getChild('..', None), NoResource)
+
+    def test_missing_names_are_remembered(self):
+
+        self.assets.clock = task.Clock()
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        self.assets.add_paths([path.path])
+
+        self.assertIsInstance(
+            self.assets.getChild('new.png', None), NoResource)
+        path.child('new.png').setContent('')
+        self.assertIsInstance(
+            self.assets.getChild('new.png', None), NoResource)
+
+        self.assets.clock.advance(self.assets.missing_ttl)
+        self.assertIsInstance(self.assets.getChild('new.png', None), FilePath)
+
+    def test_watched_paths_are_not_listed_on_miss(self):
+
+        self.assets.notifier = object()
+        for file in self.assets.paths:
+            file.listNames = lambda: self.fail('listed')
+
+        self.assertIsInstance(
+            self.assets.getChild('invalid', None), NoResource)
+
+    def test_watch(self):
+
+        path = FilePath(self.mktemp())
+        path.makedirs()
+        assets = Assets([path.path])
+        assets.watch()
+        if not GNU_LINUX:
+            self.assertIdentical(assets.notifier, None)
+            return
+
+        self.addCleanup(assets.notifier.loseConnection)
+        self.assertEqual(len(assets.notifier._watchpoints), 1)
@@ -0,0 +1,115 @@
+
+# Copyright (c) 2012 - Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Tests for mamba.enterprise.statements
+"""
+
+from storm.locals import create_database, Store, Int, Unicode
+from twisted.trial import unittest
+
+from mamba.enterprise import statements
+from mamba.enterprise.tracer import QueryTracer
+
+
+class Thing(object):
+    __storm_table__ = 'thing'
+    id = Int(primary=True)
+    name = Unicode()
+
+
+class Pair(object):
+    __storm_table__ = 'pair'
+    __storm_primary__ = 'left', 'right'
+    left = Int()
+    right = Int()
+    name = Unicode()
+
+
+class StatementCacheTest(unittest.TestCase):
+
+    def test_factory_is_called_only_on_miss(self):
+        calls = []
+        cache = statements.StatementCache()
+
+        def factory():
+            calls.append(None)
+            return 'SELECT 1'
+
+        self.assertEqual(cache.get('key', factory), 'SELECT 1')
+        self.assertEqual(cache.get('key', factory), 'SELECT 1')
+        self.assertEqual(len(calls), 1)
+
+    def test_least_recently_used_statements_are_discarded(self):
+        cache = statements.StatementCache(size=2)
+        cache.get('one', lambda: '1')
+        cache.get('two', lambda: '2')
+        cache.get('one', lambda: '1')
+        cache.get('three', lambda: '3')
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('two', lambda: 'new'), 'new')
+
+    def test_none_statements_are_not_cached(self):
+        cache = statements.StatementCache()
+        self.assertIdentical(cache.get('key', lambda: None), None)
+        self.assertEqual(len(cache), 0)
+
+
+class GetTest(unittest.TestCase):
+
+    def setUp(self):
+        statements.cache.clear()
+        self.store = Store(create_database('sqlite:'))
+        self.store.execute(
+            'CREATE TABLE thing (id INTEGER PRIMARY KEY, name VARCHAR)')
+        self.store.execute(
+            'CREATE TABLE pair (left INTEGER, right INTEGER, name VARCHAR, '
+            'PRIMARY KEY (left, right))'
+        )
+        self.store.execute("INSERT INTO thing VALUES (1, 'one')")
+        self.store.execute("INSERT INTO thing VALUES (2, 'two')")
+        self.store.execute("INSERT INTO pair VALUES (1, 2, 'pair')")
+
+    def tearDown(self):
+        self.store.close()
+        statements.cache.clear()
+
+    def test_get_returns_the_object(self):
+        thing = statements.get(self.store, Thing, 2)
+        self.assertEqual(thing.name, u'two')
+
+    def test_get_returns_none_if_not_found(self):
+        self.assertIdentical(statements.get(self.store, Thing, 3), None)
+
+    def test_get_compound_primary_key(self):
+        pair = statements.get(self.store, Pair, (1, 2))
+        self.assertEqual(pair.name, u'pair')
+
+    def test_get_returns_alive_objects(self):
+        thing = self.store.get(Thing, 1)
+        self.assertIdentical(statements.get(self.store, Thing, 1), thing)
+
+    def test_get_reuses_the_compiled_statement(self):
+        tracer = QueryTracer.start(threshold=None)
+        self.addCleanup(QueryTracer.stop)
+
+        statements.get(self.store, Thing, 1)
+        statements.get(self.store, Thing, 2)
+
+        self.assertEqual(len(statements.cache), 1)
+        self.assertEqual(len(tracer.stats()), 1)
+        self.assertEqual(tracer.stats().values()[0]['count'], 2)
+
+    def test_get_flushes_pending_changes(self):
+        thing = Thing()
+        thing.id = 3
+        thing.name = u'three'
+        self.store.add(thing)
+
+        self.assertIdentical(statements.get(self.store, Thing, 3), thing)
+        self.assertEqual(
+            self.store.execute(
+                'SELECT name FROM thing WHERE id = 3').get_one(), (u'three',)
+        )
@@ -0,0 +1,164 @@
+
+# Copyright (c) 2012 - 2013 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Tests for mamba.web.staticfile
+"""
+
+import gzip
+import time
+
+from twisted.trial import unittest
+from twisted.python import filepath
+from twisted.web import http, server
+from twisted.web.test.test_web import DummyRequest
+from twisted.web.test.requesthelper import DummyChannel
+
+from mamba.utils import config
+from mamba.web.staticfile import StaticFile, accepts_gzip
+
+
+class StaticFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = filepath.FilePath(self.mktemp())
+        self.directory.makedirs()
+        self.style = self.directory.child('style.css')
+        self.style.setContent('body {}')
+        self.resource = StaticFile(self.directory.path)
+
+    def configure(self, **options):
+        application = config.Application()
+        for option, value in options.iteritems():
+            setattr(application, option, value)
+            self.addCleanup(delattr, application, option)
+
+    def render(self, name, **headers):
+        request = DummyRequest([''])
+        for header, value in headers.iteritems():
+            request.requestHeaders.setRawHeaders(
+                header.replace('_', '-'), [value])
+
+        self.resource.getChild(name, request).render_GET(request)
+        return request
+
+    def compress(self, child):
+        compressed = gzip.open(child.siblingExtension('.gz').path, 'wb')
+        compressed.write(child.getContent())
+        compressed.close()
+
+    def test_no_cache_headers_by_default(self):
+        request = self.render('style.css')
+
+        self.assertEqual(''.join(request.written), 'body {}')
+        self.assertFalse(request.responseHeaders.hasHeader('cache-control'))
+
+    def test_cache_headers_when_configured(self):
+        self.configure(static_max_age=60)
+        request = self.render('style.css')
+
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('cache-control'),
+            ['public, max-age=60']
+        )
+        self.assertTrue(request.responseHeaders.hasHeader('expires'))
+
+    def test_not_modified_files_are_not_sent(self):
+        request = server.Request(DummyChannel(), False)
+        request.method, request.clientproto = 'GET', 'HTTP/1.1'
+        request.requestHeaders.setRawHeaders(
+            'if-modified-since', [http.datetimeToString(time.time() + 60)])
+
+        self.assertEqual(StaticFile(self.style.path).render(request), '')
+        self.assertEqual(request.code, http.NOT_MODIFIED)
+
+    def test_gzip_sibling_is_sent_when_accepted(self):
+        self.compress(self.style)
+        request = self.render('style.css', accept_encoding='gzip, deflate')
+
+        self.assertEqual(
+            ''.join(request.written),
+            self.style.siblingExtension('.gz').getContent()
+        )
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('content-encoding'),
+            ['gzip']
+        )
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('content-type'),
+            ['text/css']
+        )
+
+    def test_gzip_sibling_is_not_sent_when_not_accepted(self):
+        self.compress(self.style)
+        request = self.render('style.css')
+
+        self.assertEqual(''.join(request.written), 'body {}')
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('vary'),
+            ['accept-encoding']
+        )
+
+    def test_gzip_sibling_is_not_sent_when_refused(self):
+        self.compress(self.style)
+        request = self.render('style.css', accept_encoding='gzip;q=0, *')
+
+        self.assertEqual(''.join(request.written), 'body {}')
+
+    def test_accepts_gzip(self):
+        self.assertTrue(accepts_gzip('deflate, gzip'))
+        self.assertTrue(accepts_gzip('gzip;q=0.5'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertFalse(accepts_gzip(None))
+        self.assertFalse(accepts_gzip('deflate'))
+        self.assertFalse(accepts_gzip('gzip; q=0.0'))
+        self.assertFalse(accepts_gzip('*, gzip;q=0'))
+
+    def test_outdated_gzip_sibling_is_not_sent(self):
+        self.compress(self.style)
+        compressed = self.style.siblingExtension('.gz')
+        mtime = self.style.getModificationTime() - 60
+        filepath.os.utime(compressed.path, (mtime, mtime))
+
+        request = self.render('style.css', accept_encoding='gzip')
+        self.assertEqual(''.join(request.written), 'body {}')
+
+    def test_large_files_are_sent_by_the_front_server(self):
+        self.configure(
+            static_sendfile_header='X-Sendfile', static_sendfile_size=4)
+        request = self.render('style.css')
+
+        self.assertEqual(request.written, [])
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('x-sendfile'),
+            [self.style.path]
+        )
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('content-type'),
+            ['text/css']
+        )
+
+    def test_large_files_are_sent_by_uri_when_prefixed(self):
+        self.configure(
+            static_sendfile_header='X-Accel-Redirect', static_sendfile_size=4,
+            static_sendfile_prefix={self.directory.path: '/protected/'}
+        )
+        request = self.render('style.css')
+
+        self.assertEqual(request.written, [])
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('x-accel-redirect'),
+            ['/protected/style.css']
+        )
+
+    def test_files_out_of_the_prefixes_are_sent_by_mamba(self):
+        self.configure(
+            static_sendfile_header='X-Accel-Redirect', static_sendfile_size=4,
+            static_sendfile_prefix={'/srv/other': '/protected'}
+        )
+        request = self.render('style.css')
+
+        self.assertEqual(''.join(request.written), 'body {}')
+        self.assertFalse(
+            request.responseHeaders.hasHeader('x-accel-redirect'))
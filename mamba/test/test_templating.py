@@ -8,8 +8,13 @@ Tests for mamba.core.templating
 
 import os
 
+from jinja2 import FileSystemBytecodeCache
 from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
 
+from mamba.utils import config
+from mamba.core import templating
+from mamba.web.asynctemplate import AsyncTemplate
 from mamba.core.templating import MambaTemplate, Template
 from mamba.test.dummy_app.application.controller.dummy import DummyController
 from mamba.core.templating import TemplateNotFound, NotConfigured
@@ -131,6 +136,28 @@ class TemplateTest(unittest.TestCase):
         dummy.dummy_test2 = dummy_test2
         self.assertEqual(dummy.dummy_test2(dummy), 'HIDDEN!')
 
+    def test_template_stream(self):
+
+        stream = self.template.stream(
+            'dummy.html', title='Dummy Test', content='Dummy')
+        transport = StringTransport()
+
+        def check(ignored):
+            self.assertIn('<title>Dummy Test</title>', transport.value())
+            self.assertIdentical(transport.producer, None)
+
+        return stream.begin(transport).addCallback(check)
+
+    def test_template_stream_with_controller_and_not_template_argument(self):
+
+        def dummy_test(self):
+            return Template(controller=self).stream(
+                title='Dummy Test', content='Dummy')
+
+        dummy = self.dummy
+        dummy.dummy_test = dummy_test
+        self.assertIsInstance(dummy.dummy_test(dummy), AsyncTemplate)
+
     def test_template_raises_templatenotfound_on_non_existent(self):
         self.assertRaises(
             TemplateNotFound,
@@ -142,3 +169,112 @@ class TemplateTest(unittest.TestCase):
             NotConfigured,
             self.template.render
         )
+
+
+class EnvironmentRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.currdir = os.getcwd()
+        os.chdir('../mamba/test/dummy_app')
+        templating.environments.clear()
+
+    def tearDown(self):
+        os.chdir(self.currdir)
+        templating.environments.clear()
+
+    def test_templates_share_the_environment(self):
+        Template().render('dummy.html', title='One', content='1')
+        result = Template().render('dummy.html', title='Two', content='2')
+
+        self.assertIn('<title>Two</title>', result)
+        self.assertEqual(len(templating.environments), 1)
+        env = templating.environments.get(Template().search_paths)
+        self.assertEqual(len(env.cache), 1)
+
+    def test_templates_are_compiled_once(self):
+        env = templating.environments.get(Template().search_paths)
+        loads = []
+        original = env.loader.get_source
+
+        def get_source(environment, template):
+            loads.append(template)
+            return original(environment, template)
+
+        env.loader.get_source = get_source
+        for i in range(3):
+            Template().render('dummy.html', title='Dummy', content='Dummy')
+
+        self.assertEqual(loads, ['dummy.html'])
+
+    def test_environment_options_do_not_leak(self):
+        Template().render('dummy.html', trim_blocks=True)
+        Template().render('dummy.html')
+
+        self.assertEqual(len(templating.environments), 2)
+        env = templating.environments.get(Template().search_paths)
+        self.assertFalse(env.trim_blocks)
+
+    def test_context_names_are_not_environment_options(self):
+        Template().render('dummy.html', title='One', filters=[], cache={})
+        result = Template().render(
+            'dummy.html', title='Two', content='2', globals=[])
+
+        self.assertIn('<title>Two</title>', result)
+        self.assertEqual(len(templating.environments), 1)
+
+    def test_search_paths_are_absolute(self):
+        env = templating.environments.get(['application/view/templates'])
+        os.chdir('application')
+        self.assertNotIdentical(
+            templating.environments.get(['application/view/templates']), env)
+
+
+class BytecodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.abspath(self.mktemp())
+        os.mkdir(self.directory)
+        self.cache = FileSystemBytecodeCache(self.directory)
+        self.currdir = os.getcwd()
+        os.chdir('../mamba/test/dummy_app')
+
+    def tearDown(self):
+        os.chdir(self.currdir)
+        templating.environments.clear()
+
+    def set_option(self, value):
+        app = config.Application()
+        old = getattr(app, 'templates_bytecode_cache', None)
+        app.templates_bytecode_cache = value
+        self.addCleanup(setattr, app, 'templates_bytecode_cache', old)
+
+    def test_bytecode_cache_can_be_disabled(self):
+        self.set_option(False)
+        self.assertIdentical(templating.get_bytecode_cache(), None)
+
+    def test_bytecode_cache_directory_is_created(self):
+        directory = os.path.join(self.directory, 'templates')
+        self.set_option(directory)
+
+        cache = templating.get_bytecode_cache()
+        self.assertEqual(cache.directory, directory)
+        self.assertTrue(os.path.isdir(directory))
+
+    def test_compile_templates(self):
+        compiled, errors = templating.compile_templates(
+            ['application/view/templates'], self.cache)
+
+        self.assertIn('dummy.html', compiled)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(os.listdir(self.directory)), len(compiled))
+
+    def test_precompiled_templates_are_not_compiled_again(self):
+        self.set_option(self.directory)
+        templating.compile_templates(['application/view/templates'])
+
+        env = templating.environments.get(Template().search_paths)
+        env.compile = lambda *args, **kwargs: self.fail('compiled again')
+        self.assertIn(
+            '<title>Dummy</title>',
+            Template().render('dummy.html', title='Dummy', content='')
+        )
@@ -0,0 +1,85 @@
+
+# Copyright (c) 2012 - Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Tests for mamba.enterprise.tracer
+"""
+
+from storm.locals import create_database, Store
+from storm.tracer import get_tracers
+from twisted.python import log
+from twisted.trial import unittest
+
+from mamba.enterprise.tracer import QueryTracer
+
+
+class QueryTracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = QueryTracer.start(threshold=None)
+        self.store = Store(create_database('sqlite:'))
+        self.store.execute('CREATE TABLE dummy (id INTEGER PRIMARY KEY)')
+
+    def tearDown(self):
+        self.store.close()
+        QueryTracer.stop()
+
+    def test_start_installs_the_tracer(self):
+        self.assertIn(self.tracer, get_tracers())
+        self.assertIs(QueryTracer.start(), self.tracer)
+
+    def test_stop_removes_the_tracer(self):
+        QueryTracer.stop()
+        self.assertNotIn(self.tracer, get_tracers())
+        self.assertIdentical(QueryTracer.instance, None)
+
+    def test_statements_are_aggregated(self):
+        for i in range(3):
+            self.store.execute('INSERT INTO dummy VALUES (?)', (i,))
+
+        data = self.tracer.stats()['INSERT INTO dummy VALUES (?)']
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['rows'], 3)
+        self.assertEqual(data['errors'], 0)
+        self.assertEqual(sum(data['histogram']), 3)
+        self.assertTrue(data['time'] >= data['max'])
+
+    def test_errors_are_counted(self):
+        self.assertRaises(
+            Exception, self.store.execute, 'SELECT * FROM not_a_table')
+
+        data = self.tracer.stats()['SELECT * FROM not_a_table']
+        self.assertEqual(data['errors'], 1)
+
+    def test_bind_records_the_origin(self):
+
+        def read(klass):
+            self.store.execute('SELECT * FROM dummy')
+
+        QueryTracer.current_route = 'GET /dummy'
+        self.addCleanup(setattr, QueryTracer, 'current_route', None)
+        self.tracer.bind(read, 'QueryTracerTest.read')(QueryTracerTest)
+
+        data = self.tracer.stats()['SELECT * FROM dummy']
+        self.assertEqual(
+            data['origins'], {'GET /dummy -> QueryTracerTest.read': 1})
+
+    def test_max_statements_aggregates_the_rest_as_other(self):
+        self.tracer.reset()
+        self.tracer.max_statements = 1
+        self.store.execute('SELECT 1')
+        self.store.execute('SELECT 2')
+
+        self.assertEqual(sorted(self.tracer.stats()), ['<other>', 'SELECT 1'])
+
+    def test_slow_statements_are_logged(self):
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+
+        self.tracer.threshold = 0
+        self.store.execute('SELECT 1')
+
+        self.assertTrue(any(
+            'Slow query' in ''.join(m['message']) for m in messages))
@@ -9,22 +9,27 @@ Tests for mamba.web
 import sys
 import tempfile
 from cStringIO import StringIO
-from os import sep, getcwd, chdir
+from os import sep, getcwd, chdir, utime
 
 from twisted.internet import defer
 from twisted.trial import unittest
 from twisted.python import filepath
+from twisted.web import server
 from twisted.web.server import Request
 from twisted.web.http_headers import Headers
 from twisted.web.test.test_web import DummyRequest
+from twisted.web.test.requesthelper import DummyChannel
+from twisted.test.proto_helpers import StringTransport
+from twisted.internet.task import TaskStopped
 from twisted.internet.error import ProcessTerminated
 from doublex import Stub, ProxySpy, Spy, called, assert_that
 
 from mamba.utils import json
-from mamba.core import packages, GNU_LINUX
+from mamba.core import packages, resource, GNU_LINUX
 from mamba.application import route as decoroute
 from mamba.application import appstyles, controller, scripts
 from mamba.web import stylesheet, page, asyncjson, response, script
+from mamba.web import asynctemplate
 from mamba.web.routing import Route, Router, RouteDispatcher, RouterError
 
 from mamba.test.test_less import less_file
@@ -333,6 +338,72 @@ class AsyncJSONTest(unittest.TestCase):
         self.flushLoggedErrors()
 
 
+class AsyncTemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = StringTransport()
+
+    def test_chunks_are_encoded(self):
+
+        stream = asynctemplate.AsyncTemplate([u'mamba ', u'\xf1'])
+
+        def check(ignored):
+            self.assertEqual(self.transport.value(), 'mamba \xc3\xb1')
+            self.assertIdentical(self.transport.producer, None)
+
+        return stream.begin(self.transport).addCallback(check)
+
+    def test_small_chunks_are_grouped(self):
+
+        writes = []
+        self.transport.write = writes.append
+        stream = asynctemplate.AsyncTemplate(['a'] * 10, chunk_size=4)
+
+        def check(ignored):
+            self.assertEqual(writes, ['aaaa', 'aaaa', 'aa'])
+
+        return stream.begin(self.transport).addCallback(check)
+
+    def test_producer_is_paused_by_the_consumer(self):
+
+        stream = asynctemplate.AsyncTemplate(['a'] * 10, chunk_size=1)
+        d = stream.begin(self.transport)
+        stream.pauseProducing()
+        stream.stopProducing()
+
+        return self.assertFailure(d, TaskStopped)
+
+    def test_send_finishes_the_request(self):
+
+        channel = DummyChannel()
+        request = Request(channel, False)
+        request.method, request.clientproto = 'GET', 'HTTP/1.1'
+        stream = asynctemplate.AsyncTemplate([u'mamba'])
+
+        def check(ignored):
+            self.assertTrue(request.finished)
+            self.assertTrue(channel.transport.written.getvalue().endswith(
+                'mamba\r\n0\r\n\r\n'))
+
+        return stream.send(request).addCallback(check)
+
+    def test_send_closes_the_connection_on_errors(self):
+
+        def stream():
+            yield u'mamba'
+            raise RuntimeError('template error')
+
+        request = Request(DummyChannel(), False)
+        request.method, request.clientproto = 'GET', 'HTTP/1.1'
+
+        def check(ignored):
+            self.assertTrue(request.channel.transport.disconnected)
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+        d = asynctemplate.AsyncTemplate(stream()).send(request)
+        return d.addCallback(check)
+
+
 class PageTest(unittest.TestCase):
 
     def setUp(self):
@@ -429,6 +500,139 @@ class PageTest(unittest.TestCase):
             self.root.children.get('_mamba_pong').render_GET(request), 'PONG'
         )
 
+    def test_page_does_not_add_metrics_by_default(self):
+
+        self.assertTrue('_mamba_metrics' not in self.root.children)
+
+    def test_page_add_metrics_when_configured(self):
+
+        app = self.get_commons()
+        app.mamba_metrics = True
+        root = page.Page(app)
+
+        self.assertIsInstance(
+            root.children.get('_mamba_metrics'), resource.Metrics)
+
+    def test_page_indexes_the_templates(self):
+
+        self.root.environment.list_templates = lambda: [
+            'test.html', 'users/list.html']
+
+        self.assertEqual(
+            self.root.template_index, frozenset(['test', 'users/list']))
+
+    def test_page_get_child_does_not_list_templates_per_request(self):
+
+        self.root.environment.list_templates = lambda: ['test.html']
+        self.root.template_index
+        self.root.environment.list_templates = lambda: self.fail('listed')
+
+        self.assertIdentical(
+            self.root, self.root.getChild('test', DummyRequest([''])))
+
+    def test_page_template_index_is_refreshed_on_notify(self):
+
+        self.root.template_index
+        self.root.environment.list_templates = lambda: ['new.html']
+        self.root._notify_templates(None, filepath.FilePath('new.html'), 0)
+
+        self.assertIdentical(
+            self.root, self.root.getChild('new', DummyRequest([''])))
+
+    def test_page_watches_templates_in_development(self):
+
+        templates = filepath.FilePath(self.mktemp())
+        templates.makedirs()
+        app = self.get_commons()
+        app.development = True
+        root = page.Page(app, templates.path)
+        if not GNU_LINUX:
+            self.assertIdentical(root.notifier, None)
+            return
+
+        self.addCleanup(root.notifier.loseConnection)
+        self.addCleanup(root._assets.notifier.loseConnection)
+        self.assertTrue(len(root.notifier._watchpoints) > 0)
+
+    def get_templates_page(self, **templates):
+
+        path = filepath.FilePath(self.mktemp())
+        path.makedirs()
+        for name, content in templates.iteritems():
+            path.child(name + '.html').setContent(content)
+
+        return page.Page(self.get_commons(), path.path), path
+
+    def get_request(self, name):
+
+        request = DummyRequest([''])
+        request.prepath = [name]
+        return request
+
+    def test_page_caches_rendered_pages(self):
+
+        root, _ = self.get_templates_page(cached='{{ doctype }}')
+        self.assertEqual(root.render_GET(self.get_request('cached')), 'html')
+
+        root.environment.get_template = lambda name: self.fail('rendered')
+        self.assertEqual(root.render_GET(self.get_request('cached')), 'html')
+
+    def test_page_rendered_pages_are_invalidated_on_render_keys_change(self):
+
+        root, _ = self.get_templates_page(cached='{{ doctype }}')
+        root.render_GET(self.get_request('cached'))
+        root.render_keys['doctype'] = 'xhtml'
+
+        self.assertEqual(root.render_GET(self.get_request('cached')), 'xhtml')
+
+    def test_page_rendered_pages_are_invalidated_on_template_change(self):
+
+        root, path = self.get_templates_page(cached='old')
+        root.render_GET(self.get_request('cached'))
+        template = path.child('cached.html')
+        template.setContent('new')
+        utime(template.path, (template.getAccessTime(), 1 << 31))
+
+        self.assertEqual(root.render_GET(self.get_request('cached')), 'new')
+
+    def test_page_missing_templates_fallback_to_index(self):
+
+        root, _ = self.get_templates_page(index='index')
+        lookups = []
+        get_template = root.environment.get_template
+
+        def lookup(name):
+            lookups.append(name)
+            return get_template(name)
+
+        root.environment.get_template = lookup
+        self.assertEqual(root.render_GET(self.get_request('')), 'index')
+        self.assertEqual(root.render_GET(self.get_request('other')), 'index')
+        self.assertEqual(
+            lookups, ['.html', 'index.html', 'other.html', 'index.html'])
+
+    def test_page_streams_templates_when_configured(self):
+
+        app = self.get_commons()
+        app.stream_templates = True
+        path = filepath.FilePath(self.mktemp())
+        path.makedirs()
+        path.child('test.html').setContent('{{ doctype }}')
+        root = page.Page(app, path.path)
+
+        channel = DummyChannel()
+        request = Request(channel, False)
+        request.method, request.clientproto = 'GET', 'HTTP/1.1'
+        request.prepath = ['test']
+
+        def check(ignored):
+            self.assertIn('html', channel.transport.written.getvalue())
+            self.assertEqual(root._rendered_pages, {})
+
+        d = request.notifyFinish().addCallback(check)
+        self.assertEqual(root.render_GET(request), server.NOT_DONE_YET)
+        return d
+
     def test_page_add_script(self):
 
         style = stylesheet.Stylesheet(
@@ -909,6 +1113,16 @@ class TestRouteDispatcher(unittest.TestCase):
         )
         self.assertEqual(route_dispatcher.url, '/test/one')
 
+    def test_process_streamed_templates_are_html(self):
+
+        router = Router()
+        stream = asynctemplate.AsyncTemplate([u'mamba'])
+
+        resp = router._process(stream, request_generator('/test'))
+        self.assertIsInstance(resp, response.Ok)
+        self.assertIdentical(resp.subject, stream)
+        self.assertEqual(resp.headers, {'content-type': 'text/html'})
+
     def test_lookup_returns_route(self):
 
         controller = StubController()
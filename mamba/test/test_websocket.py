@@ -6,14 +6,21 @@
 Tests for mamba.web.websocket
 """
 
+import os
+import time
+import zlib
 import hashlib
+from struct import pack
 
+from twisted.python import log
 from twisted.trial import unittest
-from twisted.internet import address, task
+from twisted.web import server, resource
+from twisted.internet import address, task, protocol, error
 from twisted.web.http import datetimeToString
 from twisted.test import test_policies, proto_helpers
 
 from mamba.web import websocket
+from mamba.application import Controller, websocket_route
 
 data = (
     'GET /chat HTTP/1.1\r\n'
@@ -40,6 +47,13 @@ hybi00_data = (
 )
 
 
+def bytewise_mask(buf, key):
+    """The reference implementation of the RFC6455 masking
+    """
+
+    return ''.join(chr(ord(c) ^ ord(key[i % 4])) for i, c in enumerate(buf))
+
+
 class WebSocketProtocolTest(unittest.TestCase):
     """Test cases for Mamba WebSockets
     """
@@ -72,6 +86,14 @@ class WebSocketProtocolTest(unittest.TestCase):
         self.assertEqual(
             self.port.headers['Sec-WebSocket-Protocol'], 'chat, superchat')
 
+    def test_header_names_are_case_insensitive(self):
+
+        self.port.dataReceived(data.replace(
+            'Sec-WebSocket-Key', 'sec-websocket-key'))
+        self.assertEqual(
+            self.port.headers['Sec-WebSocket-Key'], 'dGhlIHNhbXBsZSBub25jZQ==')
+        self.assertEqual(self.port.state, websocket.FRAMES)
+
     def test_websocket_protocol(self):
 
         self.port.dataReceived(data)
@@ -97,6 +119,88 @@ class WebSocketProtocolTest(unittest.TestCase):
             ).digest().encode('base64').strip()
         )
 
+    def test_masked_frame_is_echoed(self):
+
+        self.port.dataReceived(data)
+        self.tr.clear()
+        self.port.dataReceived(masked_frame('LEMOOOOOOOOOON'))
+        self.assertEqual(self.tr.value(), '\x81\x0eLEMOOOOOOOOOON')
+
+    def test_fragmented_message_is_reassembled(self):
+
+        self.port.dataReceived(data)
+        self.tr.clear()
+        stream = (
+            masked_frame('LEMOO', fin=False) +
+            masked_frame('OOOOO', opcode=0x0, fin=False) +
+            masked_frame('OOON', opcode=0x0)
+        )
+        for byte in stream:
+            self.port.dataReceived(byte)
+
+        self.assertEqual(self.tr.value(), '\x81\x0eLEMOOOOOOOOOON')
+        self.assertEqual(len(self.port.reader.buf), 0)
+
+    def test_frames_sent_with_the_handshake(self):
+
+        self.port.dataReceived(data + masked_frame('LEMOOOOOOOOOON'))
+        self.assertTrue(self.tr.value().endswith('\x81\x0eLEMOOOOOOOOOON'))
+
+    def test_writes_are_coalesced(self):
+
+        self.port.dataReceived(data)
+        self.tr.clear()
+        writes = []
+        self.patch(self.tr, 'writeSequence', writes.append)
+
+        self.port.write('LEMON')
+        self.port.writeSequence(['LEMOOON', 'LEMOOOOOOON'])
+        self.assertEqual(writes, [])
+
+        self.port.factory.clock.advance(0)
+        self.assertEqual(writes, [[
+            '\x81\x05', 'LEMON', '\x81\x07', 'LEMOOON',
+            '\x81\x0b', 'LEMOOOOOOON'
+        ]])
+
+    def test_paused_transport_keeps_frames(self):
+
+        producer = DummyProducer()
+        self.port.dataReceived(data)
+        self.port.registerProducer(producer, True)
+        self.tr.clear()
+
+        self.port.pauseProducing()
+        self.port.write('LEMON')
+        self.port.factory.clock.advance(0)
+        self.assertEqual(self.tr.value(), '')
+        self.assertEqual(producer.state, 'paused')
+
+        self.port.resumeProducing()
+        self.assertEqual(self.tr.value(), '\x81\x05LEMON')
+        self.assertEqual(producer.state, 'producing')
+
+    def test_paused_transport_closes_slow_connections(self):
+
+        self.port.dataReceived(data)
+        self.tr.clear()
+        self.port.max_pending_size = 8
+
+        self.port.pauseProducing()
+        self.port.write('LEMON')
+        self.assertTrue(self.tr.connected)
+        self.port.write('LEMON')
+        self.assertFalse(self.tr.connected)
+        self.assertTrue(self.tr.value().startswith('\x88'))
+
+    def test_lose_connection_sends_pending_frames(self):
+
+        self.port.dataReceived(data)
+        self.tr.clear()
+        self.port.write('LEMON')
+        self.port.loseConnection()
+        self.assertEqual(self.tr.value(), '\x81\x05LEMON')
+
     def test_websocket_protocol_version_hybi00(self):
 
         self.port.dataReceived(hybi00_data)
@@ -157,6 +261,14 @@ class WebSocketProtocolTest(unittest.TestCase):
         frame = websocket.HyBi07Frame('LEMOOOOOOOOOON')
         self.assertEqual(frame.generate(), '\x81\x0eLEMOOOOOOOOOON')
 
+    def test_generate_rfc6455frame_extended_lengths(self):
+
+        frame = websocket.HyBi07Frame('L' * 0x7e).generate()
+        self.assertEqual(frame[:4], '\x81\x7e\x00\x7e')
+        frame = websocket.HyBi07Frame('L' * 0x10000).generate(0x2)
+        self.assertEqual(frame[:10], '\x82\x7f' + pack('>Q', 0x10000))
+        self.assertEqual(len(frame), 0x1000a)
+
     def test_parse_hybi00frame(self):
 
         frame = websocket.HyBi00Frame('\x00LEMOOOOOOOOOON\xff')
@@ -182,6 +294,53 @@ class WebSocketProtocolTest(unittest.TestCase):
             'LEMOOOOOOOOOON'
         )
 
+    def test_mask_matches_bytewise_xor(self):
+        key = '\x0a\x45\x34\x1a'
+        frame = websocket.HyBi07Frame('')
+        for length in (0, 1, 3, 4, 5, 126, 1023, 1024, 1027):
+            buf = os.urandom(length)
+            self.assertEqual(frame.mask(buf, key), bytewise_mask(buf, key))
+
+    def test_mask_leading_zeroes(self):
+        key = '\x0a\x45\x34\x1a'
+        self.assertEqual(
+            websocket.HyBi07Frame('').mask(key * 2, key), '\x00' * 8)
+
+    def test_mask_large_payload_round_trip(self):
+        self.patch(websocket, 'numpy', None)
+        key = os.urandom(4)
+        buf = os.urandom((1 << 20) + 3)
+        frame = websocket.HyBi07Frame('')
+
+        masked = frame.mask(buf, key)
+        self.assertEqual(masked, bytewise_mask(buf, key))
+        self.assertEqual(frame.mask(masked, key), buf)
+
+    def test_mask_numpy(self):
+        if websocket.numpy is None:
+            raise unittest.SkipTest('NumPy is not installed')
+
+        key = os.urandom(4)
+        frame = websocket.HyBi07Frame('')
+        for length in (1024, 1027, (1 << 16) + 1):
+            buf = os.urandom(length)
+            self.assertEqual(frame.mask(buf, key), bytewise_mask(buf, key))
+
+    def test_mask_throughput(self):
+        # benchmark, it only reports the throughput in the test log as it
+        # depends on the load of the machine running the tests
+        key = os.urandom(4)
+        buf = os.urandom(1 << 20)
+        frame = websocket.HyBi07Frame('')
+
+        started = time.time()
+        for i in range(10):
+            masked = frame.mask(buf, key)
+        elapsed = max(time.time() - started, 1e-6)
+
+        self.assertEqual(frame.mask(masked, key), buf)
+        log.msg('unmasking at {:.2f} MB/s'.format(10 / elapsed))
+
     def test_unmasked_text(self):
 
         parser = websocket.HyBi07Frame('\x81\x0eLEMOOOOOOOOOON')
@@ -268,6 +427,666 @@ class WebSocketProtocolTest(unittest.TestCase):
         self.assertEqual(buf, '\x81\x0eLEMOOOO')
 
 
+class HyBi07FrameReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = websocket.HyBi07FrameReader()
+
+    def test_feed_partial_frames(self):
+
+        frame = masked_frame('LEMOOOOOOOOOON')
+        self.assertEqual(self.reader.feed(frame[:5]), [])
+        self.assertEqual(
+            self.reader.feed(frame[5:] + frame[:1]),
+            [(websocket.DATA, 'LEMOOOOOOOOOON')]
+        )
+        self.assertEqual(
+            self.reader.buf[self.reader.offset:], bytearray(frame[:1]))
+
+    def test_control_frames_between_fragments(self):
+
+        frames = self.reader.feed(
+            masked_frame('LEMO', fin=False) +
+            masked_frame('ping', opcode=0x9) +
+            masked_frame('ON', opcode=0x0)
+        )
+        self.assertEqual(frames, [
+            (websocket.PING, 'ping'), (websocket.DATA, 'LEMOON')
+        ])
+
+    def test_binary_messages(self):
+
+        frames = self.reader.feed(
+            masked_frame('\x00\x01', opcode=0x2, fin=False) +
+            masked_frame('\x02', opcode=0x0) +
+            masked_frame('LEMON')
+        )
+        self.assertEqual(frames, [
+            (websocket.BINARY, '\x00\x01\x02'), (websocket.DATA, 'LEMON')
+        ])
+
+    def test_frame_size_limit_from_header(self):
+
+        reader = websocket.HyBi07FrameReader(max_frame_size=0x7e)
+        self.assertRaises(
+            websocket.MessageTooBig, reader.feed, '\x81\xfe\x00\x7f')
+
+    def test_message_size_limit_from_header(self):
+
+        reader = websocket.HyBi07FrameReader(max_message_size=8)
+        reader.feed(masked_frame('LEMON', fin=False))
+        self.assertRaises(
+            websocket.MessageTooBig, reader.feed, '\x00\x84')
+
+    def test_streaming_chunks(self):
+
+        reader = websocket.HyBi07FrameReader(streaming=True)
+        stream = (
+            masked_frame('LEMOOOO', opcode=0x2, fin=False) +
+            masked_frame('ping', opcode=0x9) +
+            masked_frame('OOOOOON', opcode=0x0)
+        )
+        chunks = []
+        for i in range(0, len(stream), 3):
+            chunks.extend(reader.feed(stream[i:i + 3]))
+
+        self.assertEqual(
+            [c for c in chunks if c[0] == websocket.PING],
+            [(websocket.PING, 'ping')]
+        )
+        chunks = [c[1] for c in chunks if c[0] == websocket.CHUNK]
+        self.assertEqual(
+            ''.join(data for opcode, data, last in chunks), 'LEMOOOOOOOOOON')
+        self.assertTrue(
+            all(o == websocket.OPCODE_BINARY for o, d, l in chunks))
+        self.assertEqual([l for o, d, l in chunks].count(True), 1)
+        self.assertTrue(chunks[-1][2])
+        self.assertEqual(len(reader.buf), 0)
+
+    def test_streaming_empty_message(self):
+
+        reader = websocket.HyBi07FrameReader(streaming=True)
+        self.assertEqual(
+            reader.feed(masked_frame('')),
+            [(websocket.CHUNK, (websocket.OPCODE_TEXT, '', True))]
+        )
+
+    def test_continuation_without_message(self):
+
+        self.assertRaises(
+            websocket.WebSocketError,
+            self.reader.feed, masked_frame('LEMON', opcode=0x0)
+        )
+
+    def test_new_message_before_end_of_fragmented_message(self):
+
+        self.assertRaises(
+            websocket.WebSocketError,
+            self.reader.feed,
+            masked_frame('LEMON', fin=False) + masked_frame('LEMON')
+        )
+
+    def test_large_frame_in_small_reads(self):
+
+        payload = os.urandom(0x20000)
+        frame = masked_frame(payload)
+        frames = []
+        for i in range(0, len(frame), 0x1000):
+            frames.extend(self.reader.feed(frame[i:i + 0x1000]))
+
+        self.assertEqual(frames, [(websocket.DATA, payload)])
+        self.assertEqual(len(self.reader.buf), 0)
+
+    def test_buffer_is_compacted(self):
+
+        self.reader.compact_size = 16
+        frame = masked_frame('LEMOOOOOOOOOON')
+        self.reader.feed(frame * 2 + frame[:4])
+        self.assertEqual(self.reader.offset, 0)
+        self.assertEqual(self.reader.buf, bytearray(frame[:4]))
+
+
+class MessageProtocolTest(unittest.TestCase):
+
+    def setUp(self):
+        factory = TestableWebSocketFactory(task.Clock(), EchoMessageFactory())
+        self.port = factory.buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 0))
+        self.tr = proto_helpers.StringTransportWithDisconnection()
+        self.tr.protocol = self.port
+        self.port.makeConnection(self.tr)
+        self.port.dataReceived(data)
+        self.tr.clear()
+
+    def test_messages_are_received_with_opcode(self):
+        self.port.dataReceived(
+            masked_frame('\x00\x01', opcode=0x2) + masked_frame('LEMON'))
+        self.assertEqual(self.port.wrappedProtocol.messages, [
+            (websocket.OPCODE_BINARY, '\x00\x01'),
+            (websocket.OPCODE_TEXT, 'LEMON')
+        ])
+
+    def test_messages_are_sent_with_opcode(self):
+        self.port.dataReceived(
+            masked_frame('\x00\x01', opcode=0x2) + masked_frame('LEMON'))
+        self.assertEqual(
+            self.tr.value(), '\x82\x02\x00\x01\x81\x05LEMON')
+
+    def test_binary_messages_to_stream_protocols(self):
+        self.port.wrappedProtocol = test_policies.EchoProtocol()
+        self.port.wrappedProtocol.makeConnection(self.port)
+        self.port.dataReceived(masked_frame('\x00\x01', opcode=0x2))
+        self.assertEqual(self.tr.value(), '\x81\x02\x00\x01')
+
+
+class LimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = TestableWebSocketFactory(
+            task.Clock(), StreamingFactory())
+        self.port = self.factory.buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 0))
+        self.tr = proto_helpers.StringTransportWithDisconnection()
+        self.tr.protocol = self.port
+        self.port.makeConnection(self.tr)
+
+    def handshake(self):
+        self.port.dataReceived(data.replace(
+            '\r\n\r\n',
+            '\r\nSec-WebSocket-Extensions: permessage-deflate\r\n\r\n'
+        ))
+        response = self.tr.value()
+        self.tr.clear()
+        return response
+
+    def test_too_big_messages_close_with_1009(self):
+        self.factory.max_message_size = 0x100
+        self.handshake()
+        self.port.dataReceived('\x82\xff' + pack('>Q', 1 << 40))
+
+        self.assertEqual(self.tr.value()[2:4], '\x03\xf1')
+        self.assertFalse(self.tr.connected)
+
+    def test_streaming_protocols_receive_chunks(self):
+        self.assertNotIn('Sec-WebSocket-Extensions', self.handshake())
+        frame = masked_frame('LEMOOOOOOOOOON')
+        self.port.dataReceived(frame[:10])
+        self.port.dataReceived(frame[10:])
+
+        self.assertEqual(self.port.wrappedProtocol.chunks, [
+            (websocket.OPCODE_TEXT, 'LEMO', False),
+            (websocket.OPCODE_TEXT, 'OOOOOOOOON', True)
+        ])
+
+
+class UpgradeTest(unittest.TestCase):
+
+    def setUp(self):
+        root = resource.Resource()
+        root.putChild('chat', chat_controller)
+        self.channel = server.Site(root, timeout=None).buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 0))
+        self.tr = proto_helpers.StringTransportWithDisconnection()
+        self.tr.protocol = self.channel
+        self.channel.makeConnection(self.tr)
+
+    def tearDown(self):
+        if self.tr.connected:
+            self.tr.loseConnection()
+
+    def test_websocket_route_upgrades_the_request(self):
+        self.channel.dataReceived(data.replace('/chat', '/chat/lobby'))
+
+        self.assertTrue(self.tr.value().startswith('HTTP/1.1 101 '))
+        self.assertIn(
+            'Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=',
+            self.tr.value()
+        )
+        port = self.tr.protocol
+        self.assertIsInstance(port, websocket.WebSocketProtocol)
+        self.assertEqual(port.wrappedProtocol.room, 'lobby')
+        self.assertIdentical(self.tr.producer, port)
+
+        self.tr.clear()
+        port.dataReceived(masked_frame('LEMOOOOOOOOOON'))
+        self.assertEqual(self.tr.value(), '\x81\x0eLEMOOOOOOOOOON')
+
+    def test_frames_sent_along_with_the_request_are_not_lost(self):
+        self.channel.dataReceived(
+            data.replace('/chat', '/chat/lobby') + masked_frame('LEMON'))
+
+        self.assertTrue(self.tr.value().endswith('\x81\x05LEMON'))
+
+    def test_upgraded_request_is_detached_from_the_channel(self):
+        self.channel.dataReceived(data.replace('/chat', '/chat/lobby'))
+
+        chat = self.tr.protocol.wrappedProtocol
+        self.assertEqual(chat.channel.requests, [])
+        return self.assertFailure(chat.finished, error.ConnectionDone)
+
+    def test_plain_http_requests_are_rejected(self):
+        self.channel.dataReceived(
+            'GET /chat/lobby HTTP/1.1\r\nHost: example.com\r\n\r\n')
+
+        self.assertTrue(self.tr.value().startswith('HTTP/1.1 400 '))
+        self.assertIdentical(self.tr.protocol, self.channel)
+
+    def test_route_returning_none_rejects_the_upgrade(self):
+        self.channel.dataReceived(data.replace('/chat', '/chat/private'))
+
+        self.assertTrue(self.tr.value().startswith('HTTP/1.1 403 '))
+        self.assertIdentical(self.tr.protocol, self.channel)
+
+
+class ControllerFactoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = rooms_controller
+        self.controller.websocket_factory = TestableWebSocketFactory(
+            task.Clock(), protocol.Factory())
+        root = resource.Resource()
+        root.putChild('rooms', self.controller)
+        self.site = server.Site(root, timeout=None)
+        self.transports = []
+
+    def tearDown(self):
+        for tr in self.transports:
+            if tr.connected:
+                tr.loseConnection()
+
+    def connect(self, path):
+        channel = self.site.buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 0))
+        tr = proto_helpers.StringTransportWithDisconnection()
+        tr.protocol = channel
+        channel.makeConnection(tr)
+        channel.dataReceived(data.replace('/chat', path))
+        self.transports.append(tr)
+        return tr.protocol
+
+    def test_routes_share_the_controller_factory(self):
+        factory = self.controller.websocket_factory
+
+        self.assertIdentical(self.connect('/rooms/public').factory, factory)
+        self.assertIdentical(self.connect('/rooms/staff').factory, factory)
+        self.assertEqual(factory.stats()['connections'], 2)
+
+    def test_controller_factory_is_created_once(self):
+        controller = Controller()
+
+        self.assertIsInstance(
+            controller.websocket_factory, websocket.WebSocketFactory)
+        self.assertIdentical(
+            controller.websocket_factory, controller.websocket_factory)
+
+
+class StreamingProtocol(websocket.MessageProtocol):
+
+    streaming = True
+
+    def connectionMade(self):
+        self.chunks = []
+
+    def chunkReceived(self, opcode, data, last):
+        self.chunks.append((opcode, data, last))
+
+
+class StreamingFactory(protocol.ServerFactory):
+    protocol = StreamingProtocol
+
+
+class EchoMessageProtocol(websocket.MessageProtocol):
+
+    def connectionMade(self):
+        self.messages = []
+
+    def messageReceived(self, opcode, data):
+        self.messages.append((opcode, data))
+        self.sendMessage(data, binary=opcode == websocket.OPCODE_BINARY)
+
+
+class EchoMessageFactory(protocol.ServerFactory):
+    protocol = EchoMessageProtocol
+
+
+class PerMessageDeflateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = test_policies.Server()
+        tServer = TestableWebSocketFactory(task.Clock(), self.server)
+        self.port = tServer.buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 0))
+        self.tr = proto_helpers.StringTransportWithDisconnection()
+        self.tr.protocol = self.port
+        self.port.makeConnection(self.tr)
+
+    def handshake(self, offer='permessage-deflate; client_max_window_bits'):
+        self.port.dataReceived(data.replace(
+            '\r\n\r\n',
+            '\r\nSec-WebSocket-Extensions: {}\r\n\r\n'.format(offer)
+        ))
+        response = self.tr.value()
+        self.tr.clear()
+        return response
+
+    def test_negotiate(self):
+        extension = websocket.PerMessageDeflate.negotiate(
+            'permessage-deflate; client_max_window_bits')
+        self.assertEqual(
+            extension.response,
+            'permessage-deflate; client_max_window_bits=15'
+        )
+
+    def test_negotiate_parameters(self):
+        extension = websocket.PerMessageDeflate.negotiate(
+            'permessage-deflate; server_max_window_bits=10; '
+            'client_no_context_takeover; server_no_context_takeover'
+        )
+        self.assertEqual(extension.server_max_window_bits, 10)
+        self.assertTrue(extension.server_no_context_takeover)
+        self.assertTrue(extension.client_no_context_takeover)
+        self.assertEqual(
+            extension.response,
+            'permessage-deflate; client_no_context_takeover; '
+            'server_max_window_bits=10; server_no_context_takeover'
+        )
+
+    def test_negotiate_declines_invalid_offers(self):
+        negotiate = websocket.PerMessageDeflate.negotiate
+        self.assertIdentical(negotiate('x-webkit-deflate-frame'), None)
+        self.assertIdentical(negotiate('permessage-deflate; foo'), None)
+        self.assertIdentical(
+            negotiate('permessage-deflate; server_max_window_bits=8'), None)
+        self.assertIdentical(
+            negotiate('permessage-deflate; client_max_window_bits=16'), None)
+        self.assertIdentical(negotiate(
+            'permessage-deflate; server_no_context_takeover; '
+            'server_no_context_takeover'
+        ), None)
+
+        extension = negotiate(
+            'permessage-deflate; server_max_window_bits=8, '
+            'permessage-deflate')
+        self.assertEqual(extension.response, 'permessage-deflate')
+
+    def test_handshake_response(self):
+        self.assertIn(
+            'Sec-WebSocket-Extensions: permessage-deflate; '
+            'client_max_window_bits=15\r\n\r\n',
+            self.handshake()
+        )
+
+    def test_handshake_without_offer(self):
+        self.port.dataReceived(data)
+        self.assertNotIn('Sec-WebSocket-Extensions', self.tr.value())
+        self.assertIdentical(self.port.extension, None)
+
+    def test_disabled_extension(self):
+        self.port.factory.permessage_deflate = None
+        self.assertNotIn('Sec-WebSocket-Extensions', self.handshake())
+
+    def test_compressed_message_is_echoed_compressed(self):
+        self.handshake()
+        message = '{"lemon": "LEMOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOON"}' * 4
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        payload = compressor.compress(message) + compressor.flush(
+            zlib.Z_SYNC_FLUSH)
+
+        frame = masked_frame(payload[:-4])
+        self.port.dataReceived(chr(ord(frame[0]) | 0x40) + frame[1:])
+
+        response = self.tr.value()
+        self.assertEqual(ord(response[0]), 0xc1)
+        self.assertTrue(len(response) < len(message))
+        self.assertEqual(
+            zlib.decompressobj(-15).decompress(
+                response[2:] + '\x00\x00\xff\xff'),
+            message
+        )
+
+    def test_short_messages_are_not_compressed(self):
+        self.handshake()
+        self.port.dataReceived(masked_frame('LEMON'))
+        self.assertEqual(self.tr.value(), '\x81\x05LEMON')
+
+    def test_compressed_frame_without_extension(self):
+        self.port.dataReceived(data)
+        self.tr.clear()
+        frame = masked_frame('LEMON')
+        self.port.dataReceived(chr(ord(frame[0]) | 0x40) + frame[1:])
+        self.assertTrue(self.tr.value().startswith('\x88'))
+        self.assertFalse(self.tr.connected)
+        self.flushLoggedErrors(websocket.ReservedFlagsInFrame)
+
+    def test_inflate_limit(self):
+        extension = websocket.PerMessageDeflate()
+        extension.max_inflated_size = 1024
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        payload = compressor.compress('\x00' * 2048) + compressor.flush(
+            zlib.Z_SYNC_FLUSH)
+
+        self.assertRaises(
+            websocket.MessageTooBig, extension.decompress, payload[:-4])
+
+    def test_context_takeover(self):
+        extension = websocket.PerMessageDeflate()
+        message = 'LEMOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOOON' * 2
+        first = extension.compress(message)
+        second = extension.compress(message)
+        self.assertTrue(len(second) < len(first))
+        self.assertEqual(extension.decompress(first), message)
+        self.assertEqual(extension.decompress(second), message)
+
+    def test_broadcast_without_context_takeover_is_cached(self):
+        extension = websocket.PerMessageDeflate.accept(
+            ['server_no_context_takeover'])
+        message = websocket.Message('LEMOOOOOOOOOOOOOON' * 8)
+        segments = message.segments(websocket.HyBi07Frame, extension)
+        self.assertEqual(ord(segments[0][0]), 0xc1)
+        self.assertIdentical(
+            message.segments(websocket.HyBi07Frame, extension), segments)
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.expired = []
+        self.wheel = websocket.TimerWheel(
+            self.clock, self.expired.append, resolution=1.0, size=8)
+
+    def test_timers_expire(self):
+        self.wheel.schedule('one', 1)
+        self.wheel.schedule('three', 2.5)
+
+        self.clock.advance(1)
+        self.assertEqual(self.expired, ['one'])
+        self.clock.advance(1)
+        self.assertEqual(self.expired, ['one'])
+        self.clock.advance(1)
+        self.assertEqual(self.expired, ['one', 'three'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_timers_longer_than_the_wheel(self):
+        self.wheel.schedule('twenty', 20)
+        self.clock.pump([1] * 19)
+        self.assertEqual(self.expired, [])
+        self.clock.advance(1)
+        self.assertEqual(self.expired, ['twenty'])
+
+    def test_single_delayed_call(self):
+        for i in range(100):
+            self.wheel.schedule(i, i % 10)
+
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.pump([1] * 10)
+        self.assertEqual(sorted(self.expired), range(100))
+
+    def test_cancel_and_reschedule(self):
+        self.wheel.schedule('one', 1)
+        self.wheel.schedule('two', 1)
+        self.wheel.cancel('one')
+        self.wheel.schedule('two', 3)
+        self.clock.pump([1] * 3)
+        self.assertEqual(self.expired, ['two'])
+
+
+class KeepAliveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = TestableWebSocketFactory(
+            task.Clock(), test_policies.Server())
+        self.factory.ping_interval = 10
+        self.factory.pong_timeout = 5
+        self.port = self.factory.buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 0))
+        self.tr = proto_helpers.StringTransportWithDisconnection()
+        self.tr.protocol = self.port
+        self.port.makeConnection(self.tr)
+        self.port.dataReceived(data)
+        self.tr.clear()
+
+    def test_ping_and_pong(self):
+        self.factory.clock.advance(5)
+        self.port.dataReceived(masked_frame('LEMON'))
+        self.tr.clear()
+
+        self.factory.clock.pump([1] * 9)
+        self.assertEqual(self.tr.value(), '')
+        self.factory.clock.advance(1)
+        self.assertEqual(self.tr.value(), '\x89\x00')
+
+        self.factory.clock.advance(0.5)
+        self.port.dataReceived(masked_frame('', opcode=0xa))
+        self.assertEqual(self.port.latency, 0.5)
+        stats = self.factory.stats()
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['open'], 1)
+        self.assertEqual(stats['pings'], 1)
+        self.assertEqual(stats['latency']['max'], 0.5)
+
+        self.factory.clock.pump([1] * 10)
+        self.assertTrue(self.tr.connected)
+
+    def test_unresponsive_connections_are_closed(self):
+        self.factory.clock.pump([1] * 10)
+        self.assertEqual(self.tr.value(), '\x89\x00')
+        self.factory.clock.pump([1] * 5)
+        self.assertFalse(self.tr.connected)
+        self.assertEqual(self.factory.stats()['timeouts'], 1)
+        self.assertEqual(self.factory.stats()['connections'], 0)
+        self.assertEqual(self.factory.clock.getDelayedCalls(), [])
+
+    def test_idle_connections_are_closed(self):
+        self.factory.idle_timeout = 25
+        for i in range(30):
+            self.factory.clock.advance(1)
+            self.port.dataReceived(masked_frame('', opcode=0x9))
+
+        self.assertFalse(self.tr.connected)
+        self.assertEqual(self.factory.stats()['idle'], 1)
+
+
+class BroadcastTest(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = TestableWebSocketFactory(
+            task.Clock(), test_policies.Server())
+        self.hub = websocket.BroadcastHub()
+        self.addCleanup(self.hub.remove, 'news')
+
+    def connect(self):
+        port = self.factory.buildProtocol(
+            address.IPv4Address('TCP', '127.0.0.1', 0))
+        tr = proto_helpers.StringTransportWithDisconnection()
+        tr.protocol = port
+        port.makeConnection(tr)
+        port.dataReceived(data)
+        tr.clear()
+        return port, tr
+
+    def test_hub_is_shared(self):
+        channel = self.hub.channel('news')
+        self.assertIdentical(websocket.BroadcastHub().channel('news'), channel)
+
+    def test_broadcast_encodes_once(self):
+        connections = [self.connect() for i in range(3)]
+        writes = []
+        for port, tr in connections:
+            self.hub.channel('news').subscribe(port)
+            self.patch(tr, 'writeSequence', writes.append)
+
+        self.assertEqual(self.hub.broadcast('news', 'LEMON'), 3)
+        self.factory.clock.advance(0)
+
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(writes[0], ['\x81\x05', 'LEMON'])
+        self.assertIdentical(writes[0][0], writes[1][0])
+        self.assertIdentical(writes[1][0], writes[2][0])
+
+    def test_broadcast_binary(self):
+        port, tr = self.connect()
+        self.hub.channel('news').subscribe(port)
+        self.hub.broadcast('news', '\x00\x01', binary=True)
+        self.factory.clock.advance(0)
+        self.assertEqual(tr.value(), '\x82\x02\x00\x01')
+
+    def test_broadcast_to_unknown_channel(self):
+        self.assertEqual(self.hub.broadcast('nothing', 'LEMON'), 0)
+
+    def test_slow_consumers_are_evicted(self):
+        channel = self.hub.channel('news')
+        channel.max_queue_size = 8
+        slow, slow_tr = self.connect()
+        fast, fast_tr = self.connect()
+        channel.subscribe(slow)
+        channel.subscribe(fast)
+
+        slow.pauseProducing()
+        channel.broadcast('LEMON')
+        self.factory.clock.advance(0)
+        self.assertEqual(channel.broadcast('LEMON'), 1)
+
+        self.assertEqual(channel.subscribers, set([fast]))
+        self.assertFalse(slow_tr.connected)
+        self.assertTrue(slow_tr.value().startswith('\x88'))
+
+    def test_lost_connections_are_unsubscribed(self):
+        port, tr = self.connect()
+        self.hub.channel('news').subscribe(port)
+        port.loseConnection()
+        self.assertEqual(len(self.hub.channel('news')), 0)
+
+
+class DummyProducer(object):
+
+    state = 'producing'
+
+    def pauseProducing(self):
+        self.state = 'paused'
+
+    def resumeProducing(self):
+        self.state = 'producing'
+
+    def stopProducing(self):
+        self.state = 'stopped'
+
+
+def masked_frame(payload, opcode=0x1, fin=True, key='\x0a\x45\x34\x1a'):
+    """Build a client (masked) HyBi-07+ frame
+    """
+
+    if len(payload) > 0xffff:
+        length = '\xff' + pack('>Q', len(payload))
+    elif len(payload) > 0x7d:
+        length = '\xfe' + pack('>H', len(payload))
+    else:
+        length = chr(0x80 | len(payload))
+
+    return chr((0x80 if fin else 0) | opcode) + length + key + ''.join(
+        chr(ord(c) ^ ord(key[i % 4])) for i, c in enumerate(payload))
+
+
 class TestableWebSocketFactory(websocket.WebSocketFactory):
     """Just for tests purposes
     """
@@ -278,3 +1097,36 @@ class TestableWebSocketFactory(websocket.WebSocketFactory):
 
     def callLater(self, period, func):
         return self.clock.callLater(period, func)
+
+
+class ChatController(Controller):
+
+    __route__ = 'chat'
+
+    @websocket_route('/<room>', factory=TestableWebSocketFactory(
+        task.Clock(), protocol.Factory()))
+    def join(self, request, room, **kwargs):
+        if room != 'private':
+            chat = EchoMessageProtocol()
+            chat.room = room
+            chat.channel = request.channel
+            chat.finished = request.notifyFinish()
+            return chat
+
+
+class RoomsController(Controller):
+
+    __route__ = 'rooms'
+
+    @websocket_route('/public')
+    def public(self, request, **kwargs):
+        return EchoMessageProtocol()
+
+    @websocket_route('/staff')
+    def staff(self, request, **kwargs):
+        return EchoMessageProtocol()
+
+
+# controllers install their routes when they are instantiated
+chat_controller = ChatController()
+rooms_controller = RoomsController()
@@ -71,6 +71,11 @@ class Database(BaseConfig):
             'min_threads': 5,
             'max_threads': 20,
             'auto_adjust_pool_size': false,
+            'keepalive_interval': 300,
+            'connection_retries': 2,
+            'query_tracer': false,
+            'slow_query_threshold': 1.0,
+            'statement_cache_size': 256,
             'create_table_behaviours': {
                 'create_table_if_not_exists': true,
                 'drop_table': false
@@ -87,6 +92,18 @@ class Database(BaseConfig):
     the database. If auto_adjust_pool_size is True, the size of the thread
     pool should be adjust dynamically.
 
+    The *keepalive_interval* is the number of seconds a connection can stay
+    idle before mamba checks that it is still alive when a store is requested
+    with `ensure_connect`, and *connection_retries* is the maximum number of
+    times a transaction is retried when the connection to the database server
+    is lost.
+
+    If *query_tracer* is true, mamba collects timing statistics for every
+    SQL statement and logs the ones that take longer than
+    *slow_query_threshold* seconds. The *statement_cache_size* is the
+    number of compiled SQL statements that mamba keeps to reuse them on
+    hot model operations like read and update.
+
     For *create_table_bevaviour* possible values are:
 
         *create_if_not_exists*
@@ -145,6 +162,11 @@ class Database(BaseConfig):
         self.min_threads = 5
         self.max_threads = 20
         self.auto_adjust_pool_size = False
+        self.keepalive_interval = 300
+        self.connection_retries = 2
+        self.query_tracer = False
+        self.slow_query_threshold = 1.0
+        self.statement_cache_size = 256
         self.create_table_behaviours = {
             'create_table_if_not_exists': True,
             'drop_table': False
@@ -216,9 +238,38 @@ class Application(BaseConfig):
             "favicon": "favicon.ico",
             "platform_debug": false,
             "development": true,
-            "debug": false
+            "debug": false,
+            "mamba_metrics": false
         }
 
+    If `"mamba_metrics"` is true, the database thread pool metrics are
+    served as JSON in the `/_mamba_metrics` URL.
+
+    The compiled Jinja2 templates are cached on disk in the directory set
+    in the `"templates_bytecode_cache"` option (the system temporary
+    directory is used if it is true, that is the default, and the cache is
+    disabled if it is false). Use `mamba-admin view --compile` to fill the
+    cache on deploy time.
+
+    The compiled LESS scripts are cached on disk in the directory set in
+    the `"less_cache"` option (a private directory in the system temporary
+    directory is used if it is true, that is the default, and the disk
+    cache is disabled if it is false).
+
+    The static files (assets, stylesheets and scripts) are sent with
+    `Cache-Control` and `Expires` headers if the `"static_max_age"` option
+    (in seconds) is set. If the `"static_sendfile_header"` option is set
+    (to `X-Sendfile` or `X-Accel-Redirect` for example), static files
+    bigger than `"static_sendfile_size"` bytes (1MB by default) are sent by
+    the web server in front of the application. Set the
+    `"static_sendfile_prefix"` option to map the static directories to
+    URIs if the web server expects URIs (`X-Accel-Redirect` does), see
+    :class:`~mamba.web.staticfile.StaticFile`.
+
+    If `"stream_templates"` is true, the pages rendered by the root page
+    are sent to the browser in chunks as the templates generate them
+    instead of being rendered in memory first (and cached).
+
     If we want to force the mamba application to run under some specific
     twisted reactor, we can add the `"reactor"` option to the configuration
     file to enforce mamba to use the configured reactor.
@@ -250,6 +301,8 @@ class Application(BaseConfig):
         self.content_type = 'text/html'
         self.description = None
         self.favicon = 'favicon.ico'
+        self.mamba_metrics = False
+        self.stream_templates = False
         self.lessjs = False
         self.platform_debug = False
         self.development = False
@@ -11,16 +11,77 @@
 
 """
 
+import os
+import threading
+
 
 class FileVariableError(Exception):
     pass
 
 
+class FileVariablesCache(object):
+    """
+    Cache of the Emacs local variables parsed from files keyed by the file
+    path, its modification time and its size. This way every file is read
+    once per change even when the same files are checked again and again
+    (on inotify events or reloads)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._variables = {}
+
+    def __len__(self):
+        return len(self._variables)
+
+    def get(self, filename, loader):
+        """
+        Return back a copy of the variables of the given file, if they are
+        not cached or the file changed the loader is called to parse them
+
+        :param filename: the file path
+        :type filename: str
+        :param loader: callable that parses the variables of the file
+        :type loader: callable
+        """
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # let the loader raise the error
+            return loader()
+
+        path = os.path.abspath(filename)
+        signature = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            cached = self._variables.get(path)
+
+        if cached is None or cached[0] != signature:
+            cached = (signature, loader())
+            with self._lock:
+                self._variables[path] = cached
+
+        return dict(cached[1])
+
+    def clear(self):
+        """Clear the cache
+        """
+
+        with self._lock:
+            self._variables.clear()
+
+
+cache = FileVariablesCache()
+
+
 class FileVariables(object):
     """
     Emacs local variables format parser for Mamba.
 
     We don't use twisted self implementation because we need extra stuff.
+
+    The variables of every file are cached until the file changes so
+    creating many objects for the same file only reads it once.
     """
 
     _filename = None
@@ -30,7 +91,10 @@ class FileVariables(object):
 
         self._filename = filename
         self._local_vars = dict()
-        self._load_variables()
+        if not self._filename:
+            raise FileVariableError('No filename has been given')
+
+        self._local_vars = cache.get(self._filename, self._load_variables)
 
     def get_value(self, key):
         """Return a value"""
@@ -49,9 +113,6 @@ class FileVariables(object):
         See http://kcy.me/6hso
         """
 
-        if not self._filename:
-            raise FileVariableError('No filename has been given')
-
         fd = file(self._filename, 'r')  # Just the first two lines
         lines = [fd.readline(), fd.readline()]
         fd.close()
@@ -61,6 +122,8 @@ class FileVariables(object):
             except ValueError:
                 pass
 
+        return self._local_vars
+
     def _parse_variables(self, line):
         """
         Accepts a single line in Emacs local variable declaration format and
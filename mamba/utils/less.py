@@ -7,12 +7,25 @@ Mamba less compiler
 """
 
 import os
+import re
+import stat
+import errno
+import getpass
+import hashlib
+import tempfile
 from functools import partial
 
-from twisted.internet import utils
-from twisted.python import filepath
+from twisted.internet import utils, defer
+from twisted.python import filepath, log
 from twisted.web import resource, server
 
+from mamba.utils import config
+
+
+IMPORT_REGEX = re.compile(
+    r'''@import\s*(?:\([^)]*\)\s*)?(?:url\(\s*)?["']([^"']+)["']'''
+)
+
 
 class LessResource(resource.Resource):
     """
@@ -30,14 +43,7 @@ class LessResource(resource.Resource):
         Try to compile a LESS file and then serve it as CSS
         """
 
-        if self.path is None:
-            self.less_compiler = LessCompiler(
-                request.postpath[0], exe=self.less_exec
-            )
-        else:
-            self.less_compiler = LessCompiler(
-                request.prepath[1], exe=self.less_exec, path=self.path
-            )
+        style_path = request.postpath[0] if self.path is None else self.path
 
         # windows can't handle with non existrnt commands in CreateProcess
         # and raises an exception so we have to hack this here to support
@@ -48,16 +54,16 @@ class LessResource(resource.Resource):
         # decided to patch this to make it work but we really need a win
         # developer that care to port mamba to windows properly
 
-        d = self.less_compiler.compile()
+        d = get_cache().get(style_path, exe=self.less_exec)
 
         if type(d) is unicode:
-            return bytes(d)
+            return d.encode('utf-8')
         else:
             def cb_sendback(resp):
                 """
                 Write result from callback
                 """
-                request.write(bytes(resp))
+                request.write(resp.encode('utf-8'))
                 request.finish()
 
             d.addCallback(cb_sendback)
@@ -69,6 +75,9 @@ class LessCompiler(object):
     """
     Compile LESS scripts if LESS NodeJS compiler is present. Otherwise
     adds the less.js JavaScript compiler to the page.
+
+    After compiling, `fallback` is True if the LESS script itself has been
+    returned because the compiler could not be used.
     """
 
     def __init__(self, style, exe='lessc', path=None):
@@ -76,6 +85,7 @@ class LessCompiler(object):
         self.stylesheet = style
         self.exe = exe
         self.path = path
+        self.fallback = False
 
     def compile(self):
         """
@@ -90,10 +100,11 @@ class LessCompiler(object):
         try:
             d = utils.getProcessOutput(self.exe, [style_path], os.environ)
             d.addCallbacks(
-                self._get_compiled, partial(self._get_script, style_path)
+                self._get_compiled, partial(self._fallback, style_path)
             )
             return d
         except Exception:
+            self.fallback = True
             return self._get_script(style_path)
 
     def _get_compiled(self, resp):
@@ -103,6 +114,14 @@ class LessCompiler(object):
 
         return resp.decode('utf-8')
 
+    def _fallback(self, style_path, failure):
+        """
+        The compiler failed, return the LESS script instead
+        """
+
+        self.fallback = True
+        return self._get_script(style_path, failure)
+
     def _get_script(self, style_path, ignore=None):
         """
         Return the LESS script and set Application use of LESS compiler
@@ -112,4 +131,268 @@ class LessCompiler(object):
         return filepath.FilePath(style_path).getContent().decode('utf-8')
 
 
-__all__ = ["LessResource", "LessCompiler"]
+class LessCache(object):
+    """
+    Cache of compiled LESS scripts keyed by the script path and the
+    modification times of the script and every file that it imports, so
+    each script is compiled once (on first request) and then again only
+    when it or any of its imports change.
+
+    The compiled CSS is kept in memory and, if a directory is given, on
+    disk so it survives application restarts. Requests for a script that
+    is being compiled wait for the same compilation.
+
+    The LESS scripts returned back when the compiler is not available are
+    only cached in memory.
+
+    :param directory: the directory where to store the compiled CSS
+    :type directory: str
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._styles = {}
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._styles)
+
+    def get(self, style_path, exe='lessc'):
+        """
+        Return back the compiled CSS for the given LESS script or a
+        Deferred that fires with it if it has to be compiled
+
+        :param style_path: the path of the LESS script
+        :type style_path: str
+        :param exe: the LESS compiler command
+        :type exe: str
+        """
+
+        style_path = os.path.abspath(style_path)
+        cached = self._styles.get(style_path)
+        if cached is not None:
+            signature, css = cached
+            if all(mtime(path) == modified for path, modified in signature):
+                return css
+
+        signature = tuple(
+            (path, mtime(path)) for path in self.dependencies(style_path))
+
+        css = self._load(style_path, signature)
+        if css is not None:
+            self._styles[style_path] = (signature, css)
+            return css
+
+        return self._compile(style_path, signature, exe)
+
+    def dependencies(self, style_path):
+        """
+        Return back a list with the given LESS script path and the paths
+        of all the local files that it imports (recursively)
+
+        :param style_path: the absolute path of the LESS script
+        :type style_path: str
+        """
+
+        paths, pending = [], [style_path]
+        while pending:
+            path = pending.pop(0)
+            if path in paths:
+                continue
+
+            paths.append(path)
+            try:
+                with open(path) as style:
+                    source = style.read()
+            except IOError:
+                continue
+
+            for name in IMPORT_REGEX.findall(source):
+                if '://' in name:
+                    continue
+
+                if os.path.splitext(name)[1] == '':
+                    name += '.less'
+
+                pending.append(
+                    os.path.normpath(
+                        os.path.join(os.path.dirname(path), name))
+                )
+
+        return paths
+
+    def clear(self):
+        """Forget all the compiled scripts kept in memory
+        """
+
+        self._styles.clear()
+
+    def _compile(self, style_path, signature, exe):
+        """Compile the LESS script or wait for the running compilation
+        """
+
+        key = (style_path, signature)
+        waiting = self._pending.get(key)
+        if waiting is not None:
+            d = defer.Deferred()
+            waiting.append(d)
+            return d
+
+        waiting = self._pending[key] = []
+        compiler = LessCompiler(style_path, exe=exe)
+        d = compiler.compile()
+        if type(d) is unicode:
+            d = defer.succeed(d)
+
+        def cb_compiled(css):
+            del self._pending[key]
+            self._styles[style_path] = (signature, css)
+            if not compiler.fallback:
+                self._store(style_path, signature, css)
+
+            for deferred in waiting:
+                deferred.callback(css)
+
+            return css
+
+        def eb_failed(failure):
+            del self._pending[key]
+            for deferred in waiting:
+                deferred.errback(failure)
+
+            return failure
+
+        return d.addCallbacks(cb_compiled, eb_failed)
+
+    def _cache_file(self, style_path, signature=None):
+        """
+        Return back the path of the cache file for the given script path
+        and signature, or the pattern that matches any of its cache files
+        """
+
+        return os.path.join(self.directory, '{}-{}.css'.format(
+            hashlib.sha1(style_path).hexdigest(),
+            '*' if signature is None else hashlib.sha1(
+                repr(signature)).hexdigest()
+        ))
+
+    def _load(self, style_path, signature):
+        """Load the compiled CSS from the disk cache if possible
+        """
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._cache_file(style_path, signature)) as cache_file:
+                return cache_file.read().decode('utf-8')
+        except (IOError, UnicodeDecodeError):
+            return None
+
+    def _store(self, style_path, signature, css):
+        """Store the compiled CSS in the disk cache replacing old versions
+        """
+
+        if self.directory is None:
+            return
+
+        cache_file = filepath.FilePath(self._cache_file(style_path, signature))
+        try:
+            for old in filepath.FilePath(self.directory).globChildren(
+                    os.path.basename(self._cache_file(style_path))):
+                old.remove()
+
+            cache_file.setContent(css.encode('utf-8'))
+        except (IOError, OSError) as error:
+            log.msg('Can not store compiled LESS script {}: {}'.format(
+                style_path, error))
+
+
+def mtime(path):
+    """Return back the modification time of path or None if missing
+    """
+
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def get_cache():
+    """
+    Return back the :class:`LessCache` shared by the LESS resources, it is
+    created on first use so importing this module does not read the
+    application configuration nor touch the file system
+    """
+
+    global _cache
+
+    if _cache is None:
+        _cache = LessCache(get_cache_directory())
+
+    return _cache
+
+
+def get_cache_directory():
+    """
+    Return back the directory where the compiled LESS scripts are stored
+    that is configured with the `less_cache` option of the application
+    configuration. It can be a directory, true to use a private directory
+    in the system temporary directory (the default) or false to disable the
+    disk cache. Returns None if the disk cache is disabled or unusable
+    """
+
+    directory = getattr(config.Application(), 'less_cache', True)
+    if directory is None or directory is False:
+        return None
+
+    try:
+        if directory is True:
+            return _get_default_cache_directory()
+
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        return directory
+    except (OSError, KeyError) as error:
+        log.msg('LESS disk cache disabled: {}'.format(error))
+        return None
+
+
+def _get_default_cache_directory():
+    """
+    Return back the cache directory in the system temporary directory, as
+    its name is predictable it is created only readable by the current user
+    and refused if someone else owns it or it is accessible by others
+    """
+
+    directory = os.path.join(
+        tempfile.gettempdir(), 'mamba-less-cache-{}'.format(getpass.getuser())
+    )
+
+    if os.name == 'nt':
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        return directory
+
+    try:
+        os.mkdir(directory, stat.S_IRWXU)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+            or stat.S_IMODE(info.st_mode) != stat.S_IRWXU):
+        raise OSError(
+            errno.EACCES, 'insecure cache directory {}'.format(directory))
+
+    return directory
+
+
+_cache = None
+
+
+__all__ = ["LessResource", "LessCompiler", "LessCache", "get_cache"]
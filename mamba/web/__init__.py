@@ -9,7 +9,7 @@ Subpackage containing the modules that implement web stuff for projects
 from twisted.web.server import NOT_DONE_YET
 
 from page import Page
-from routing import Router, Route, RouteDispatcher
+from routing import Router, Route, WebSocketRoute, RouteDispatcher
 from script import Script, ScriptManager, ScriptError
 from response import (
     Response, NotFound, NotImplemented, Ok, InternalServerError,
@@ -20,17 +20,21 @@ from stylesheet import (
     FileDontExists
 )
 
-from websocket import WebSocketError, WebSocketProtocol, WebSocketFactory
+from websocket import (
+    WebSocketError, WebSocketProtocol, WebSocketFactory, BroadcastHub, Channel,
+    MessageProtocol
+)
 
 
 __all__ = [
     'Page',
-    'Router', 'Route', 'RouteDispatcher',
+    'Router', 'Route', 'WebSocketRoute', 'RouteDispatcher',
     'Response', 'NotFound', 'NotImplemented', 'Ok', 'InternalServerError',
     'BadRequest', 'Conflict', 'AlreadyExists', 'Found', 'Unauthorized',
     'Script', 'ScriptManager', 'ScriptError',
     'Stylesheet', 'StylesheetError', 'InvalidFile', 'InvalidFileExtension',
     'FileDontExists',
     'WebSocketError', 'WebSocketProtocol', 'WebSocketFactory',
+    'BroadcastHub', 'Channel', 'MessageProtocol',
     'NOT_DONE_YET'
 ]
@@ -0,0 +1,101 @@
+# -*- test-case-name: mamba.test.test_web -*-
+# Copyright (c) 2012 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+Asynchronous streamed template response
+"""
+
+from twisted.python import log
+from twisted.internet.task import cooperate, TaskStopped
+
+
+class AsyncTemplate(object):
+    """
+    Asynchronous streamed template response.
+
+    I use a cooperate Twisted task in order to create a producer that
+    writes the output of a Jinja2 template as it is being generated, the
+    chunks are encoded and grouped until they reach `chunk_size` bytes
+    before write them into the consumer.
+
+    As the consumer pauses the producer when its buffers are full, big
+    pages are never materialized in memory and the first bytes are sent
+    to the browser while the rest of the template is still rendering.
+
+    :param stream: iterable of unicode chunks like the one returned by
+        :meth:`jinja2.Template.generate`
+    :param encoding: the encoding of the output
+    :type encoding: str
+    :param chunk_size: minimum size of the writes to the consumer
+    :type chunk_size: int
+    """
+
+    def __init__(self, stream, encoding='utf-8', chunk_size=8192):
+        self._stream = stream
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+
+    def begin(self, consumer):
+        self._consumer = consumer
+        self._consumer.registerProducer(self, True)
+        self._task = cooperate(self._produce())
+        defer = self._task.whenDone()
+        defer.addBoth(self._unregister)
+        return defer
+
+    def send(self, request):
+        """
+        Stream the template into the given request and finish it when the
+        template is done. If the template fails to render after sending
+        the headers nothing else can be done than close the connection
+
+        :param request: the Twisted request object
+        :type request: :class:`twisted.web.server.Request`
+        """
+
+        def finish(ignored):
+            request.finish()
+
+        def failed(failure):
+            if failure.check(TaskStopped) is None:
+                log.err(failure, 'Template streaming failed:')
+                request.loseConnection()
+
+        return self.begin(request).addCallbacks(finish, failed)
+
+    def pause(self):
+        self._task.pause()
+
+    def resume(self):
+        self._task.resume()
+
+    def stop(self):
+        self._task.stop()
+
+    def _produce(self):
+        buffered, size = [], 0
+        for chunk in self._stream:
+            chunk = chunk.encode(self.encoding)
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= self.chunk_size:
+                self._consumer.write(''.join(buffered))
+                buffered, size = [], 0
+                yield None
+
+        if buffered:
+            self._consumer.write(''.join(buffered))
+
+    def _unregister(self, passthrough):
+        self._consumer.unregisterProducer()
+        return passthrough
+
+    def pauseProducing(self):
+        self.pause()
+
+    def resumeProducing(self):
+        self.resume()
+
+    def stopProducing(self):
+        self.stop()
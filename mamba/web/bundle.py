@@ -0,0 +1,277 @@
+# -*- test-case-name: mamba.test.test_bundle -*-
+# Copyright (c) 2012 - 2013 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+.. module: bundle
+    :platform: Unix, Windows
+    :synopsis: Bundles of minified scripts and stylesheets
+
+.. moduleauthor:: Oscar Campos <oscar.campos@member.fsf.org>
+"""
+
+import os
+import re
+import hashlib
+import urlparse
+
+from twisted.python import filepath, log
+
+from mamba.utils import json
+from mamba.web.staticfile import StaticFile
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+
+CSS_TOKENS = re.compile(
+    r'''("(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|/\*[\s\S]*?\*/)'''
+)
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]*)\1\s*\)''', re.I)
+CSS_IMPORT = re.compile(r'@import\b', re.I)
+ABSOLUTE_URL = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|/|#)', re.I)
+
+# one year, the bundles file names change every time their content does
+MAX_AGE = 31536000
+
+
+def minify_css(source):
+    """
+    Minify the given CSS source removing comments and whitespace, the
+    rcssmin module is used when is installed
+
+    :param source: the CSS source
+    :type source: str
+    """
+
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+
+    strings = []
+
+    def replace(match):
+        if match.group(0).startswith('/*'):
+            return ' '
+
+        strings.append(match.group(0))
+        return '\x00{}\x00'.format(len(strings) - 1)
+
+    css = re.sub(r'\s+', ' ', CSS_TOKENS.sub(replace, source))
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css).replace(';}', '}')
+
+    return re.sub(
+        '\x00(\\d+)\x00', lambda match: strings[int(match.group(1))], css
+    ).strip()
+
+
+def minify_js(source):
+    """
+    Minify the given JavaScript source using the rjsmin module, the source
+    is returned back untouched if it is not installed because removing
+    anything safely (think on template literals) needs a JavaScript parser
+
+    :param source: the JavaScript source
+    :type source: str
+    """
+
+    if rjsmin is None:
+        return source
+
+    return rjsmin.jsmin(source)
+
+
+def rewrite_css_urls(source, location):
+    """
+    Rewrite the relative `url()` references of the given CSS source
+    against the URL where it is served, so they still work when the
+    source is moved into a bundle
+
+    :param source: the CSS source
+    :type source: str
+    :param location: the URL where the CSS source is served
+    :type location: str
+    """
+
+    def replace(match):
+        quote, url = match.groups()
+        if not url or ABSOLUTE_URL.match(url):
+            return match.group(0)
+
+        return 'url({0}{1}{0})'.format(quote, urlparse.urljoin(location, url))
+
+    return CSS_URL.sub(replace, source)
+
+
+def build(styles, scripts, directory='static/bundles', url='/bundles'):
+    """
+    Concatenate and minify the CSS stylesheets and JavaScript scripts of
+    every shared package (and the application) into one bundle per package
+    and type named after its content hash. Then write a manifest that is
+    used by :func:`apply` to reference the bundles instead of the files.
+
+    LESS and Dart scripts are not bundled, neither are stylesheets that
+    contain `@import` rules as they are only valid at the top of a file.
+    Relative URLs in the bundled stylesheets are rewritten against the
+    URL where each stylesheet is served.
+
+    :param styles: the application stylesheets
+    :type styles: :class:`~mamba.application.appstyles.AppStyles`
+    :param scripts: the application scripts
+    :type scripts: :class:`~mamba.application.scripts.AppScripts`
+    :param directory: the directory where to write the bundles
+    :type directory: str
+    :param url: the URL where the bundles directory is served
+    :type url: str
+    :returns: the manifest
+    """
+
+    directory = filepath.FilePath(directory)
+    if not directory.exists():
+        directory.makedirs()
+
+    manifest = {'styles': [], 'scripts': []}
+    for manager in styles.managers:
+        files = [
+            style for style in manager.stylesheets.values()
+            if not style.less and not CSS_IMPORT.search(_read(style))
+        ]
+        bundle = _write_bundle(
+            directory, _package(manager._styles_store), 'css', files,
+            minify_css, '', lambda f: rewrite_css_urls(_read(f), f.data)
+        )
+        if bundle is not None:
+            bundle['data'] = '{}/{}'.format(url, bundle['data'])
+            manifest['styles'].append(bundle)
+
+    if rjsmin is None:
+        log.msg('rjsmin is not installed, JavaScript bundles are not minified')
+
+    for manager in scripts.managers:
+        files = [
+            script for script in manager.scripts.values()
+            if script.type == 'text/javascript'
+        ]
+        bundle = _write_bundle(
+            directory, _package(manager._scripts_store), 'js', files,
+            minify_js, ';'
+        )
+        if bundle is not None:
+            bundle['data'] = '{}/{}'.format(url, bundle['data'])
+            bundle['type'] = 'text/javascript'
+            manifest['scripts'].append(bundle)
+
+    directory.child('manifest.json').setContent(
+        json.dumps(manifest, indent=4))
+
+    return manifest
+
+
+def load_manifest(directory='static/bundles'):
+    """
+    Load the bundles manifest written by :func:`build` from the given
+    directory, returns None if there is no manifest
+
+    :param directory: the bundles directory
+    :type directory: str
+    """
+
+    manifest = filepath.FilePath(directory).child('manifest.json')
+    if not manifest.exists():
+        return None
+
+    return json.loads(manifest.getContent())
+
+
+def apply(styles, scripts, manifest):
+    """
+    Replace the bundled stylesheets and scripts in the given lists by
+    their bundles in the manifest
+
+    :param styles: the stylesheets
+    :type styles: list
+    :param scripts: the scripts
+    :type scripts: list
+    :param manifest: the bundles manifest
+    :type manifest: dict
+    :returns: a tuple with the new list of styles and scripts
+    """
+
+    if manifest is None:
+        return styles, scripts
+
+    def replace(files, bundles):
+        bundled = set(name for bundle in bundles for name in bundle['files'])
+        return [f for f in files if f.name not in bundled] + bundles
+
+    return (
+        replace(styles, manifest.get('styles', [])),
+        replace(scripts, manifest.get('scripts', []))
+    )
+
+
+class Bundles(StaticFile):
+    """
+    Static resource that serves the bundles with far-future expiration
+    headers, this is safe because the bundles file names change with their
+    content
+    """
+
+    max_age = MAX_AGE
+
+
+def _package(store):
+    """Return the name of the package (or application) of a files store
+    """
+
+    return os.path.basename(os.path.dirname(os.path.dirname(
+        os.path.abspath(store))))
+
+
+def _read(f):
+    """Return the content of a stylesheet or script
+    """
+
+    return filepath.FilePath(f.path).getContent()
+
+
+def _write_bundle(
+        directory, name, extension, files, minify, separator, read=_read):
+    """
+    Write the bundle of the given files into the directory removing its
+    previous versions, returns None if there is nothing to bundle
+    """
+
+    if not files:
+        return None
+
+    files = sorted(files, key=lambda f: f.name)
+    content = '{}\n'.format(separator).join(minify(read(f)) for f in files)
+    digest = hashlib.sha1(content).hexdigest()[:12]
+
+    bundle = directory.child('{}-{}.{}'.format(name, digest, extension))
+    for old in directory.globChildren('{}-*.{}'.format(name, extension)):
+        if old != bundle:
+            old.remove()
+
+    bundle.setContent(content)
+
+    return {
+        'name': name,
+        'data': bundle.basename(),
+        'files': [f.name for f in files]
+    }
+
+
+__all__ = [
+    'minify_css', 'minify_js', 'rewrite_css_urls', 'build', 'load_manifest',
+    'apply', 'Bundles'
+]
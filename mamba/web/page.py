@@ -16,8 +16,16 @@ from twisted.web import static, server
 from twisted.python import log, filepath
 from twisted.python.logfile import DailyLogFile
 
+from mamba.core import GNU_LINUX
+from mamba.web import asynctemplate, bundle
+from mamba.web.staticfile import StaticFile
 from mamba.utils.less import LessResource
 from mamba.core import templating, resource
+from mamba.enterprise.database import Database
+
+if GNU_LINUX:
+    from twisted.internet import inotify
+    from twisted.python._inotify import INotifyError
 
 os = filepath.os
 
@@ -31,6 +39,13 @@ class Page(resource.Resource):
     register any package shared controller because we want to overwrite
     them if our application defines the same routes.
 
+    The names of the templates that can be rendered are indexed at startup
+    so requests don't traverse the templates directories, in development
+    mode the index is refreshed when templates are added or removed (and
+    the assets index when assets are).
+    Rendered pages are cached until the render keys or templates change
+    unless the application streams the templates.
+
     :param app: The Mamba Application that implements this page
     :type app: :class:`~mamba.application.app.Application`
     :param template_paths: additional template paths for resources
@@ -40,6 +55,12 @@ class Page(resource.Resource):
 
     def __init__(self, app, template_paths=None, cache_size=50, loader=None):
         resource.Resource.__init__(self)
+        self.notifier = None
+        self._template_index = None
+        self._rendered_pages = {}
+        self._rendered_version = None
+        self._missing_templates = set()
+        self.stream_templates = getattr(app, 'stream_templates', False) is True
 
         # register log file if any
         if (app.development is False and
@@ -75,13 +96,65 @@ class Page(resource.Resource):
         self.insert_scripts()
         # register service ponger
         self.putChild('_mamba_pong', static.Data('PONG', 'text/plain'))
+        # register database metrics (if configured)
+        if getattr(app, 'mamba_metrics', False) is True:
+            self.putChild('_mamba_metrics', resource.Metrics(Database.pool))
 
         # static accessible data (scripts, css, images, and others)
         self.putChild('assets', self._assets)
+        # scripts and stylesheets bundles (if built)
+        bundles = filepath.FilePath(os.getcwd() + '/static/bundles')
+        if bundles.exists():
+            self.putChild('bundles', bundle.Bundles(bundles.path))
 
         # other initializations
         self.generate_dispatches()
         self.initialize_templating_system(template_paths, cache_size, loader)
+        if getattr(app, 'development', False) is True:
+            self.watch_templates()
+            self._assets.watch()
+
+    @property
+    def template_index(self):
+        """
+        Set with the names (without extension) of all the templates that
+        can be found in the templates search paths
+        """
+
+        if self._template_index is None:
+            self._template_index = frozenset(
+                template.rsplit('.', 1)[0]
+                for template in self.environment.list_templates()
+            )
+
+        return self._template_index
+
+    def watch_templates(self):
+        """
+        Watch the templates directories so the templates index is refreshed
+        when a template is added, removed or renamed and the rendered pages
+        are discarded when a template changes (only on Linux)
+        """
+
+        if not GNU_LINUX:
+            return
+
+        self.notifier = inotify.INotify()
+        self.notifier.startReading()
+        for path in self.template_paths:
+            try:
+                self.notifier.watch(
+                    filepath.FilePath(path),
+                    mask=(
+                        inotify.IN_CREATE | inotify.IN_DELETE |
+                        inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO |
+                        inotify.IN_MODIFY
+                    ),
+                    autoAdd=True, recursive=True,
+                    callbacks=[self._notify_templates]
+                )
+            except (INotifyError, OSError):
+                log.msg('Can not watch templates path {}'.format(path))
 
     def getChild(self, path, request):
         """
@@ -104,9 +177,8 @@ class Page(resource.Resource):
         if path == '' or path is None or path == 'index':
             return self
 
-        for template in self.environment.list_templates():
-            if path == template.rsplit('.', 1)[0]:
-                return self
+        if path in self.template_index:
+            return self
 
         return resource.Resource.getChild(self, path, request)
 
@@ -117,25 +189,62 @@ class Page(resource.Resource):
         if not request.prepath[0].endswith('.html'):
             request.prepath[0] += '.html'
 
-        try:
-            template = templating.Template(
-                self.environment, template=request.prepath[0]
-            )
-            return template.render(**self.render_keys).encode('utf-8')
-        except templating.TemplateNotFound:
-            try:
-                template = templating.Template(
-                    self.environment, template='index.html'
-                )
-                return template.render(**self.render_keys).encode('utf-8')
-            except templating.TemplateNotFound:
-                pass
+        if self.stream_templates:
+            return self.stream_template(request, request.prepath[0])
 
-        template = templating.Template(
-            self.environment,
-            template='root_page.html'
-        )
-        return template.render(**self.render_keys).encode('utf-8')
+        return self.render_template(request.prepath[0])
+
+    def render_template(self, name):
+        """
+        Render the given template (or the index.html or root_page.html
+        templates if it can not be found) with the page render keys.
+
+        Rendered pages are cached until the render keys or the template
+        change, in development mode included and extended templates
+        changes are also noticed (only on Linux)
+
+        :param name: the template name
+        :type name: str
+        :returns: the rendered page encoded as utf-8
+        """
+
+        if self._rendered_version != self.render_keys.version:
+            self.invalidate_rendered_pages()
+
+        cached = self._rendered_pages.get(name)
+        if cached is not None and cached[0].is_up_to_date:
+            return cached[1]
+
+        template = self._resolve_template(name)
+        rendered = template.render(**self.render_keys).encode('utf-8')
+        self._rendered_pages[name] = (template, rendered)
+
+        return rendered
+
+    def stream_template(self, request, name):
+        """
+        Render the given template (or its fallbacks) into the request in
+        chunks as the template generates them, the rendered page is never
+        materialized in memory so it is not cached
+
+        :param request: the Twisted request object
+        :param name: the template name
+        :type name: str
+        """
+
+        template = self._resolve_template(name)
+        asynctemplate.AsyncTemplate(
+            template.generate(**self.render_keys)).send(request)
+
+        return server.NOT_DONE_YET
+
+    def invalidate_rendered_pages(self):
+        """Discard all the cached rendered pages
+        """
+
+        self._rendered_pages.clear()
+        self._missing_templates.clear()
+        self._rendered_version = self.render_keys.version
 
     def generate_dispatches(self):
         """Generate singledispatches
@@ -150,7 +259,7 @@ class Page(resource.Resource):
         """Adds a script to the page
         """
 
-        self.putChild(script.prefix, static.File(script.path))
+        self.putChild(script.prefix, StaticFile(script.path))
 
     def register_controllers(self):
         """Add a child for each controller in the ControllerManager
@@ -204,12 +313,12 @@ class Page(resource.Resource):
         if loader is None:
             loader = templating.FileSystemLoader
 
+        # absolute paths so the bytecode cache is shared with Template
         self.environment = templating.Environment(
-            autoescape=lambda name: (
-                name.rsplit('.', 1)[1] == 'html' if name is not None else False
-            ),
+            autoescape=templating.autoescape,
             cache_size=cache_size,
-            loader=loader(self.template_paths)
+            loader=loader([os.path.abspath(p) for p in self.template_paths]),
+            bytecode_cache=templating.get_bytecode_cache()
         )
 
     def insert_stylesheets(self):
@@ -223,14 +332,14 @@ class Page(resource.Resource):
                 )
                 continue
 
-            self.containers['styles'].putChild(name, static.File(style.path))
+            self.containers['styles'].putChild(name, StaticFile(style.path))
 
     def insert_scripts(self):
         """Insert scripts to the HTML
         """
 
         for name, script in self._scripts_manager.get_scripts().iteritems():
-            self.containers['scripts'].putChild(name, static.File(script.path))
+            self.containers['scripts'].putChild(name, StaticFile(script.path))
 
     def run(self, port=8080):
         """
@@ -299,6 +408,34 @@ class Page(resource.Resource):
                 controller.get('object')
             )
 
+    def _resolve_template(self, name):
+        """
+        Get the Jinja2 template for name falling back to index.html and
+        root_page.html, the templates that are not found are remembered so
+        they are not looked up again until the templates change
+        """
+
+        for candidate in (name, 'index.html', 'root_page.html'):
+            if candidate in self._missing_templates:
+                continue
+
+            try:
+                return self.environment.get_template(candidate)
+            except templating.TemplateNotFound:
+                self._missing_templates.add(candidate)
+
+        raise templating.TemplateNotFound(name)
+
+    def _notify_templates(self, ignore, file_path, mask):
+        """
+        Invalidate the rendered pages when the templates change and the
+        templates index when they are added, removed or renamed
+        """
+
+        self.invalidate_rendered_pages()
+        if not mask & inotify.IN_MODIFY:
+            self._template_index = None
+
     def _build_controllers_tree(self):
         """Build the full controllers tree
         """
@@ -51,6 +51,23 @@ class Response(object):
         )
 
 
+@implementer(IResponse)
+class SwitchingProtocols(Response):
+    """
+    Switching Protocols 101 HTTP Response
+
+    The connection has been taken over by another protocol so there is
+    nothing to send back through the HTTP request
+
+    :param subject: the protocol that took over the connection
+    :type subject: :class:`twisted.internet.protocol.Protocol`
+    """
+
+    def __init__(self, subject, headers={}):
+        super(SwitchingProtocols, self).__init__(
+            http.SWITCHING, subject, headers)
+
+
 @implementer(IResponse)
 class Ok(Response):
     """
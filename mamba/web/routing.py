@@ -21,9 +21,10 @@ from twisted.python import log
 from twisted.internet import defer
 from twisted.web.http import parse_qs
 
-from mamba.web import response
+from mamba.web import response, asynctemplate
 from mamba.utils import output, config, json
 from mamba.application.model import Model
+from mamba.enterprise.tracer import QueryTracer
 from mamba.utils.converter import Converter
 from mamba.web.url_sanitizer import UrlSanitizer
 
@@ -138,6 +139,73 @@ class Route(object):
         return self.callback(controller, request, **self.callback_args)
 
 
+class WebSocketRoute(Route):
+    """
+    I am a Route that upgrades GET requests into WebSocket connections in
+    the same port that serves the rest of the web site.
+
+    The decorated method must return the protocol to wrap into the new
+    WebSocket connection (or a Deferred that fires with it). If it returns
+    None the upgrade is rejected with a 403 Forbidden response.
+
+    .. versionadded:: 0.3.6
+    """
+
+    def __init__(self, url, callback, factory=None):
+        """
+        Initializes the Route object with the given data from decorator
+
+        :param url: the URL path
+        :type url: string
+        :param callback: the callable callback
+        :type callback: callabe object
+        :param factory: the factory used for the WebSocket connections, if
+                        None the controller `websocket_factory` is used
+        :type factory: :class:`~mamba.web.websocket.WebSocketFactory`
+        """
+
+        self.factory = factory
+        super(WebSocketRoute, self).__init__('GET', url, callback)
+
+    def __call__(self, controller, request):
+        """
+        Call the decorated method and upgrade the request with the
+        returned protocol
+
+        :param request: the HTTP request
+        :type request: :class:`~twisted.web.server.Request`
+        """
+
+        upgrade = request.getHeader('upgrade')
+        if upgrade is None or upgrade.lower() != 'websocket':
+            return response.BadRequest(
+                'ERROR 400: {} only accepts WebSocket connections'.format(
+                    self.url),
+                {'content-type': 'text/plain'}
+            )
+
+        result = defer.maybeDeferred(
+            super(WebSocketRoute, self).__call__, controller, request)
+        result.addCallback(self._upgrade, controller, request)
+        return result
+
+    def _upgrade(self, protocol, controller, request):
+        """Hand the request connection over to the WebSocket factory
+        """
+
+        if protocol is None:
+            return response.Forbidden(
+                'ERROR 403: WebSocket connection rejected',
+                {'content-type': 'text/plain'}
+            )
+
+        factory = self.factory
+        if factory is None:
+            factory = controller.websocket_factory
+
+        return response.SwitchingProtocols(factory.upgrade(request, protocol))
+
+
 class Router(object):
     """
     I store, lookup, cache and dispatch routes for Mamba
@@ -163,6 +231,8 @@ class Router(object):
         self._prepare_response.register(Model, self._prepare_response_model)
         self._prepare_response.register(
             response.Response, self._prepare_response_object)
+        self._prepare_response.register(
+            asynctemplate.AsyncTemplate, self._prepare_response_template)
 
         super(Router, self).__init__()
 
@@ -178,10 +248,16 @@ class Router(object):
         try:
             route, obj = RouteDispatcher(self, controller, request).lookup()
 
-            if type(route) is Route:
+            if isinstance(route, Route):
                 # at this point we can get a Deferred or an inmediate result
                 # depending on the user code
-                result = defer.maybeDeferred(route, obj, request)
+                if QueryTracer.instance is not None:
+                    QueryTracer.current_route = '{} {}'.format(
+                        route.method, route.url)
+                try:
+                    result = defer.maybeDeferred(route, obj, request)
+                finally:
+                    QueryTracer.current_route = None
                 result.addCallback(self._process, request)
                 result.addErrback(self._process_error, request=request)
             elif route == 'NotImplemented':
@@ -311,6 +387,32 @@ class Router(object):
 
         return decorator
 
+    # decorator
+    def websocket_route(self, url, factory=None):
+        """Register WebSocket endpoints for controllers.
+
+        The decorated method returns the protocol to wrap::
+
+            @websocket_route('/chat/<room>')
+            def chat(self, request, room, **kwargs):
+                return ChatProtocol(room)
+
+        Connections are served by the controller `websocket_factory`
+        unless a `factory` is given for the route.
+
+        .. versionadded:: 0.3.6
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return func
+
+            setattr(wrapper, 'route', WebSocketRoute(url, func, factory))
+
+            return wrapper
+
+        return decorator
+
     def _process(self, result, request):
         """Prepare and process the result.
         """
@@ -356,6 +458,12 @@ class Router(object):
 
         return result
 
+    def _prepare_response_template(self, result, request):
+        """Streamed templates are always sent as 'text/html'
+        """
+
+        return response.Ok(result, {'content-type': 'text/html'})
+
     def _prepare_response_object(self, result, request):
         """Renders the result.subject into JSON if needed
         """
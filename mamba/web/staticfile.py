@@ -0,0 +1,180 @@
+# -*- test-case-name: mamba.test.test_staticfile -*-
+# Copyright (c) 2012 - 2013 Oscar Campos <oscar.campos@member.fsf.org>
+# See LICENSE for more details
+
+"""
+.. module: staticfile
+    :platform: Unix, Windows
+    :synopsis: Static files with cache policy and precompressed variants
+
+.. moduleauthor:: Oscar Campos <oscar.campos@member.fsf.org>
+"""
+
+import os
+import time
+import urllib
+
+from twisted.web import static, http
+
+from mamba.utils import config
+
+
+class StaticFile(static.File):
+    """
+    Static file (or directory) resource that is used to serve the mamba
+    assets, stylesheets and scripts.
+
+    Responses include `Cache-Control` and `Expires` headers if the
+    `static_max_age` option (in seconds) of the application configuration
+    is set and `If-Modified-Since` requests are answered with a 304 when
+    the file has not been modified.
+
+    If there is a `.gz` sibling of the requested file (not older than it)
+    it is sent instead to the clients that accept gzip encoding.
+
+    If the `static_sendfile_header` option is set (for example to
+    `X-Sendfile` or `X-Accel-Redirect`), files larger than the
+    `static_sendfile_size` option (1MB by default) are not sent by mamba,
+    the header is set to the file path instead so the web server in front
+    of the application sends the file using zero-copy transfers.
+
+    Web servers like nginx expect an URI instead of a path, in that case
+    set the `static_sendfile_prefix` option to a dictionary that maps the
+    static directories to the URIs where the web server serves them, the
+    files out of those directories are sent by mamba.
+    """
+
+    # use the static_max_age option when None
+    max_age = None
+
+    def render_GET(self, request):
+        self.restat(False)
+        if not self.exists() or self.isdir():
+            return static.File.render_GET(self, request)
+
+        options = config.Application()
+        self._set_cache_headers(request, options)
+
+        compressed = self._compressed(request)
+        if compressed is not None:
+            return static.File.render_GET(compressed, request)
+
+        header = getattr(options, 'static_sendfile_header', None)
+        if header and self.getsize() >= getattr(
+                options, 'static_sendfile_size', 1048576):
+            location = self._sendfile_location(options)
+            if location is not None:
+                return self._sendfile(request, header, location)
+
+        return static.File.render_GET(self, request)
+
+    render_HEAD = render_GET
+
+    def _set_cache_headers(self, request, options):
+        """Set the Cache-Control and Expires headers if configured
+        """
+
+        max_age = self.max_age
+        if max_age is None:
+            max_age = getattr(options, 'static_max_age', None)
+            if max_age is None:
+                return
+
+        request.setHeader('cache-control', 'public, max-age={}'.format(
+            max_age))
+        request.setHeader(
+            'expires', http.datetimeToString(time.time() + max_age))
+
+    def _compressed(self, request):
+        """
+        Return back the gzip compressed sibling of this file if it exists
+        and the client accepts gzip encoded responses
+        """
+
+        if self.splitext()[1] == '.gz':
+            return None
+
+        sibling = self.siblingExtension('.gz')
+        if not sibling.isfile():
+            return None
+
+        request.setHeader('vary', 'accept-encoding')
+        if not accepts_gzip(request.getHeader('accept-encoding')):
+            return None
+
+        if sibling.getModificationTime() < self.getModificationTime():
+            return None
+
+        return self.createSimilarFile(sibling.path)
+
+    def _sendfile_location(self, options):
+        """
+        Return back the location of the file that the front web server
+        expects, the file path or its URI if the `static_sendfile_prefix`
+        option is set (None if the file is not in any of its directories)
+        """
+
+        prefixes = getattr(options, 'static_sendfile_prefix', None)
+        if not prefixes:
+            return self.path
+
+        for path, uri in sorted(
+                prefixes.items(), key=lambda item: len(item[0]),
+                reverse=True):
+            path = os.path.abspath(path)
+            if self.path.startswith(path + os.sep):
+                return uri.rstrip('/') + urllib.quote(
+                    self.path[len(path):].replace(os.sep, '/'))
+
+        return None
+
+    def _sendfile(self, request, header, location):
+        """Let the front web server send the file
+        """
+
+        if request.setLastModified(self.getModificationTime()) is http.CACHED:
+            return ''
+
+        content_type, encoding = static.getTypeAndEncoding(
+            self.basename(), self.contentTypes, self.contentEncodings,
+            self.defaultType
+        )
+        request.setHeader('content-type', content_type)
+        if encoding is not None:
+            request.setHeader('content-encoding', encoding)
+
+        request.setHeader(header, location)
+        return ''
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Return back True if the given Accept-Encoding header value accepts the
+    gzip encoding with a quality value greater than zero
+
+    :param accept_encoding: the Accept-Encoding header value
+    :type accept_encoding: str
+    """
+
+    qualities = {}
+    for coding in (accept_encoding or '').split(','):
+        params = coding.split(';')
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities[params[0].strip().lower()] = quality
+
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+
+    return False
+
+
+__all__ = ['StaticFile', 'accepts_gzip']
@@ -13,20 +13,46 @@
 
 """
 
+import zlib
+import math
 from string import digits
 from hashlib import sha1, md5
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from
+from binascii import hexlify, unhexlify
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from zope.interface import implementer
 from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.internet import reactor
+from twisted.internet.error import ConnectionDone
+from twisted.internet.protocol import Protocol
 from twisted.web.http import datetimeToString
-from twisted.internet.interfaces import ISSLTransport
+from twisted.internet.interfaces import ISSLTransport, IPushProducer
 from twisted.protocols.policies import ProtocolWrapper, WrappingFactory
 
-DATA, CLOSE, PING, PONG = range(4)                    # frame control
+from mamba.utils import borg
+
+DATA, CLOSE, PING, PONG, BINARY, CHUNK = range(6)     # frame control
 HYBI00, HYBI07, HYBI10, RFC6455 = range(4)            # supported versions
 HANDSHAKE, NEGOTIATION, CHALLENGE, FRAMES = range(4)  # state machine.
 
+OPCODE_TEXT, OPCODE_BINARY = 0x1, 0x2                 # message opcodes
+
 NORMAL_CLOSURE = 0x3e8
+PROTOCOL_ERROR = 0x3ea
+MESSAGE_TOO_BIG = 0x3f1
+
+# header names are case insensitive, we store the ones we use canonicalized
+CANONICAL_HEADERS = dict((name.lower(), name) for name in (
+    'Host', 'Origin', 'Connection', 'Upgrade', 'WebSocket-Protocol',
+    'Sec-WebSocket-Protocol', 'Sec-WebSocket-Version', 'Sec-WebSocket-Key',
+    'Sec-WebSocket-Key1', 'Sec-WebSocket-Key2', 'Sec-WebSocket-Extensions'
+))
 
 
 class WebSocketError(Exception):
@@ -59,6 +85,11 @@ class ReservedFlagsInFrame(WebSocketError):
     """
 
 
+class MessageTooBig(WebSocketError):
+    """Fired when a frame or a message is bigger than the allowed size
+    """
+
+
 class UnknownFrameOpcode(WebSocketError):
     """Fired when we get an unused RFC6455 frame opcode
     """
@@ -139,12 +170,20 @@ class HyBi07HandshakePreamble(HandshakePreamble):
             '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
         )
 
-        return [
-            'Sec-WebSocket-Accept: {}\r\n\r\n'.format(
+        data = [
+            'Sec-WebSocket-Accept: {}\r\n'.format(
                 sha1(key).digest().encode('base64').strip()
             )
         ]
 
+        if protocol.extension is not None:
+            data.append('Sec-WebSocket-Extensions: {}\r\n'.format(
+                protocol.extension.response
+            ))
+
+        data.append('\r\n')
+        return data
+
 
 class InvalidProtocolVersionPreamble(HandshakePreamble):
     """Send invalid protocol version response
@@ -191,18 +230,22 @@ class HyBi00Frame(object):
         """Check if the buffer is valid (no xff characters on it)
         """
 
-        for ch in self.buf:
-            if ord(ch) == 0xff:
-                return False
-
-        return True
+        return '\xff' not in self.buf
 
     def generate(self, opcode=0x00):
         """Generate a HyBi-00/Hixie-76 frame.
         """
 
+        return ''.join(self.segments(opcode))
+
+    def segments(self, opcode=0x00):
+        """
+        Generate a HyBi-00/Hixie-76 frame as a list of strings ready to be
+        passed to `writeSequence` so the payload is never copied
+        """
+
         if self.is_valid:
-            return '\x00{buf}\xff'.format(buf=self.buf)
+            return ['\x00', self.buf, '\xff']
 
         raise InvalidCharacterInHyBi00Frame(
             'Invalid character \xff in HyBi-00/Hixie-76'
@@ -272,6 +315,18 @@ class HyBi07Frame(object):
         0xa: PONG
     }
 
+    # precomputed headers of final frames with payloads up to 125 octets
+    short_headers = dict(
+        (opcode, tuple(chr(0x80 | opcode) + chr(i) for i in range(0x7e)))
+        for opcode in (0x1, 0x2, 0x8, 0x9, 0xa)
+    )
+
+    # reserved flags that can be set because of a negotiated extension
+    allowed_flags = 0x00
+
+    # the biggest frame payload that we accept (None for no limit)
+    max_frame_size = None
+
     def __init__(self, buf):
         self.buf = buf
 
@@ -288,16 +343,42 @@ class HyBi07Frame(object):
         :type opcode: int
         """
 
-        if len(self.buf) > 0xffff:
-            length = '\x7f%s' % (pack('>Q', len(self.buf)),)
-        elif len(self.buf) > 0x7d:
-            length = '\x7e%s' % (pack('>H', len(self.buf)),)
-        else:
-            length = chr(len(self.buf))
+        return ''.join(self.segments(opcode))
 
-        return '{header}{length}{buf}'.format(
-            header=chr(0x80 | opcode), length=length, buf=self.buf
-        )
+    def segments(self, opcode=0x1):
+        """
+        Generate a HyBi-07+ frame as a list with the header and the payload
+        ready to be passed to `writeSequence` so the payload is never copied
+
+        :param opcode: the opcode to use
+        :type opcode: int
+        """
+
+        return [self.header(len(self.buf), opcode), self.buf]
+
+    @classmethod
+    def header(cls, length, opcode=0x1, flags=0x00):
+        """Return back the header of a final frame of the given length
+
+        :param length: the length of the payload
+        :type length: int
+        :param opcode: the opcode to use
+        :type opcode: int
+        :param flags: the reserved flags to set (RSV1 is 0x40)
+        :type flags: int
+        """
+
+        header = 0x80 | flags | opcode
+        if length > 0xffff:
+            return pack('>BBQ', header, 0x7f, length)
+        elif length > 0x7d:
+            return pack('>BBH', header, 0x7e, length)
+
+        headers = cls.short_headers.get(opcode)
+        if headers is None or flags:
+            return pack('>BB', header, length)
+
+        return headers[length]
 
     def parse(self):
         """Parse HyBi-07+ frame.
@@ -307,127 +388,208 @@ class HyBi07Frame(object):
         frames = []
 
         while True:
-            # is there are not at least two bytes in the buffer, bail
-            if len(self.buf) - start < 2:
+            frame = self.read_frame(start)
+            if frame is None:
                 break
 
-            # grab the header, this first byte of data contains FIN, RSV1-3
-            # and the opcode
-            header = ord(self.buf[start])
-            fin = (header & 0x80) != 0
-            if header & 0x70:
-                # at least one of the reserved flags is set.
-                # TODO: look at extensions to chekc if something is negotiated
-                #       as is specified by [RFC6455][Page 28]
-                # Someday, perhaps...
-                raise ReservedFlagsInFrame(
-                    'Reserved flag in HyBi-07 frame {}'.format(
-                        '{:#x} ({:#b})'.format(header, header)
-                    )
-                )
+            fin, flags, raw_opcode, payload_data, start = frame
+            frames.append((self.opcodes[raw_opcode], payload_data))
 
-            # get the opcode
-            raw_opcode = header & 0xf
-            opcode = self.opcodes.get(raw_opcode)
-            if opcode is None:
-                raise UnknownFrameOpcode(
-                    'Unknown opcode {:#b} in HyBi-07 frame'.format(raw_opcode)
-                )
+        return frames, self.buf[start:]
 
-            # get the mask flag and payload length from the next byte and
-            # determine if we have to look for any extra length
-            data = ord(self.buf[start + 1])
-            masked = (data & 0x80) != 0  # most significant bit (should be 1)
-            length = data & 0x7f
-
-            # check opcodes for given frames
-            if opcode >= CLOSE:
-                # control frames shouldn't be fragmented
-                if fin is False:
-                    raise WebSocketError(
-                        'Fragmented control frame with opcode {:#x}'.format(
-                            raw_opcode
-                        )
-                    )
+    def read_frame(self, start=0):
+        """
+        Read a single HyBi-07+ frame from the buffer beginning at the given
+        offset. The buffer is never sliced, just the payload is copied out
+        of it (unmasking it on the way) so it can be an str or a bytearray.
 
-                # control frames shouldn't have more than 125 octects length
-                if length > 0x7d:
-                    raise WebSocketError(
-                        'Control frame with payload longer than 125 octets, '
-                        'opcode {:#b}'.format(raw_opcode)
-                    )
+        Returns None if the frame is not complete yet, otherwise a tuple with
+        the FIN flag, the reserved flags, the raw opcode, the payload and the
+        offset in the buffer where the next frame begins.
 
-                # opcodes 0xb to 0xf are reserved for further control frames
-                if opcode > PONG:
-                    raise WebSocketError(
-                        'Control frame using reserved opcode {:#x}'.format(
-                            raw_opcode
-                        )
-                    )
+        :param start: the offset in the buffer where the frame begins
+        :type start: int
+        """
+
+        header = self.read_header(start)
+        if header is None:
+            return None
+
+        fin, flags, raw_opcode, mask_key, length, offset = header
+
+        # get the payload data
+        if len(self.buf) - offset < length:
+            return None
+
+        payload_data = self.unmask(offset, length, mask_key)
+
+        if self.opcodes[raw_opcode] == CLOSE:
+            if len(payload_data) >= 2:
+                # unpack the opcode and return usable data
+                payload_data = (
+                    unpack('>H', payload_data[:2])[0], payload_data[2:])
             else:
-                # data frames can only use opcodes 0x0, 0x1 and 0x2
-                if opcode != DATA:
-                    raise WebSocketError(
-                        'Data frame using weird opcode {:#x}'.format(
-                            raw_opcode
-                        )
-                    )
+                payload_data = NORMAL_CLOSURE, 'No reason given'
 
-            # the offset we're going to use to walk through the frame
-            offset = 2
+        return fin, flags, raw_opcode, payload_data, offset + length
 
-            # extra length fields. if the value is 126 then the following 2
-            # bytes interpreted as 16-bit unsigned integer are the payload
-            # length
-            if length == 0x7e:
-                if len(self.buf) - start < 4:
-                    break
+    def read_header(self, start=0):
+        """
+        Read the header of a HyBi-07+ frame from the buffer beginning at the
+        given offset.
 
-                # read the next two bytes (start + 2:start + 4) and unpack
-                length = unpack('>H', self.buf[start + 2:start + 4])[0]
-                offset += 2
-            # if the value is 127 then the following 8 bytes interpreted as
-            # a 64-bit unsigned integer are the payload length that is a
-            # ridiculous big length of data but hey what the fuck I know
-            elif length == 0x7f:
-                if len(self.buf) - start < 10:
-                    break
+        Returns None if the header is not complete yet, otherwise a tuple
+        with the FIN flag, the reserved flags, the raw opcode, the masking
+        key (None for unmasked frames), the payload length and the offset
+        in the buffer where the payload begins.
 
-                # read the next eigth bytes (start +2:start +10) and unpack
-                length = unpack('>Q', self.buff[start + 2:start + 10])[0]
-                offset += 8
+        :param start: the offset in the buffer where the frame begins
+        :type start: int
+        """
 
-            # browser client is supossed to send all frames masked so this
-            # should be always True
-            if masked:
-                if len(self.buf) - (start + offset) < 4:
-                    break
+        available = len(self.buf) - start
+
+        # is there are not at least two bytes in the buffer, bail
+        if available < 2:
+            return None
+
+        # grab the header, this first byte of data contains FIN, RSV1-3
+        # and the opcode, the second one contains the mask flag and the
+        # payload length
+        header, data = unpack_from('>BB', self.buf, start)
+        fin = (header & 0x80) != 0
+        flags = header & 0x70
+        if flags & ~self.allowed_flags or (flags and header & 0x08):
+            # at least one of the reserved flags is set and it has not been
+            # negotiated by an extension (or it is a control frame) as is
+            # specified by [RFC6455][Page 28]
+            raise ReservedFlagsInFrame(
+                'Reserved flag in HyBi-07 frame {}'.format(
+                    '{:#x} ({:#b})'.format(header, header)
+                )
+            )
 
-                # get the mask key
-                mask_key = self.buf[start + offset:start + offset + 4]
-                offset += 4
+        # get the opcode
+        raw_opcode = header & 0xf
+        opcode = self.opcodes.get(raw_opcode)
+        if opcode is None:
+            raise UnknownFrameOpcode(
+                'Unknown opcode {:#b} in HyBi-07 frame'.format(raw_opcode)
+            )
 
-            # get the payload data
-            if len(self.buf) - (start + offset) < length:
-                break
+        # determine if we have to look for any extra length
+        masked = (data & 0x80) != 0  # most significant bit (should be 1)
+        length = data & 0x7f
+
+        # check opcodes for given frames
+        if opcode >= CLOSE:
+            # control frames shouldn't be fragmented
+            if fin is False:
+                raise WebSocketError(
+                    'Fragmented control frame with opcode {:#x}'.format(
+                        raw_opcode
+                    )
+                )
+
+            # control frames shouldn't have more than 125 octects length
+            if length > 0x7d:
+                raise WebSocketError(
+                    'Control frame with payload longer than 125 octets, '
+                    'opcode {:#b}'.format(raw_opcode)
+                )
+
+            # opcodes 0xb to 0xf are reserved for further control frames
+            if opcode > PONG:
+                raise WebSocketError(
+                    'Control frame using reserved opcode {:#x}'.format(
+                        raw_opcode
+                    )
+                )
+        else:
+            # data frames can only use opcodes 0x0, 0x1 and 0x2
+            if opcode != DATA:
+                raise WebSocketError(
+                    'Data frame using weird opcode {:#x}'.format(
+                        raw_opcode
+                    )
+                )
+
+        # the offset we're going to use to walk through the frame
+        offset = 2
+
+        # extra length fields. if the value is 126 then the following 2
+        # bytes interpreted as 16-bit unsigned integer are the payload
+        # length
+        if length == 0x7e:
+            if available < 4:
+                return None
+
+            length = unpack_from('>H', self.buf, start + 2)[0]
+            offset += 2
+        # if the value is 127 then the following 8 bytes interpreted as
+        # a 64-bit unsigned integer are the payload length that is a
+        # ridiculous big length of data but hey what the fuck I know
+        elif length == 0x7f:
+            if available < 10:
+                return None
+
+            length = unpack_from('>Q', self.buf, start + 2)[0]
+            offset += 8
+
+        # don't wait for payloads that we are not going to accept anyway
+        self.check_length(raw_opcode, length)
+
+        # browser client is supossed to send all frames masked so this
+        # should be always True
+        mask_key = None
+        if masked:
+            if available - offset < 4:
+                return None
+
+            # get the mask key
+            mask_key = str(buffer(self.buf, start + offset, 4))
+            offset += 4
+
+        return fin, flags, raw_opcode, mask_key, length, start + offset
+
+    def check_length(self, raw_opcode, length):
+        """Raise :class:`MessageTooBig` if the frame is too big
+
+        :param raw_opcode: the frame opcode
+        :type raw_opcode: int
+        :param length: the frame payload length
+        :type length: int
+        """
 
-            payload_data = self.buf[start + offset:start + offset + length]
+        if self.max_frame_size is not None and length > self.max_frame_size:
+            raise MessageTooBig(
+                'Frame of {} bytes is bigger than the {} bytes limit'.format(
+                    length, self.max_frame_size)
+            )
 
-            if masked:
-                payload_data = self.mask(payload_data, mask_key)
+    def unmask(self, start, length, mask_key, position=0):
+        """
+        Copy (and unmask) `length` bytes of payload from the buffer.
+
+        :param start: the offset in the buffer where the data begins
+        :type start: int
+        :param length: the number of bytes to copy
+        :type length: int
+        :param mask_key: the masking key of the frame or None
+        :type mask_key: str
+        :param position: the position of the data in the frame payload
+        :type position: int
+        """
 
-            if opcode == CLOSE:
-                if len(payload_data) >= 2:
-                    # unpack the opcode and return usable data
-                    payload_data = (
-                        unpack('>H', payload_data[:2])[0], payload_data[2:])
-                else:
-                    payload_data = NORMAL_CLOSURE, 'No reason given'
+        payload_data = buffer(self.buf, start, length)
+        if mask_key is None:
+            return str(payload_data)
 
-            frames.append((opcode, payload_data))
-            start += offset + length
+        # rotate the key if the data doesn't start in a multiple of four
+        if position % 4:
+            mask_key = mask_key[position % 4:] + mask_key[:position % 4]
 
-        return frames, self.buf[start:]
+        return self.mask(payload_data, mask_key)
 
     def mask(self, buf, key):
         """Mask or unmask a buffer of bytes with a masking key
@@ -445,18 +607,537 @@ class HyBi07Frame(object):
         connection we are exposed. For more information about this please,
         refer to [RFC6455][Page31]
 
+        The whole buffer is XORed at once instead of byte by byte, we use
+        NumPy if it is available or big Python integers otherwise, both of
+        them operate over machine words in C so we don't have to walk the
+        payload in the Python side.
+
         :param buf: the buffer to mask or unmask
         :param key: the masking key, it shoudl be exactly four bytes long
         """
 
-        key = [ord(i) for i in key]
-        buf = list(buf)
+        length = len(buf)
+        if length == 0:
+            return ''
+
+        if numpy is not None and length >= 0x400:
+            return self._mask_numpy(buf, key)
 
-        for i in range(len(buf)):
-            buf[i] = chr(ord(buf[i]) ^ key[i % 4])
-        return ''.join(buf)
+        key = (key * ((length + 3) // 4))[:length]
+        return unhexlify('{:0{}x}'.format(
+            int(hexlify(buf), 16) ^ int(hexlify(key), 16), length * 2
+        ))
+
+    def _mask_numpy(self, buf, key):
+        """Mask or unmask a buffer using NumPy 32-bit word operations
+        """
 
+        words, tail = divmod(len(buf), 4)
+        data = numpy.frombuffer(buf, dtype=numpy.uint8).copy()
+        data[:words * 4].view(numpy.uint32)[:] ^= numpy.frombuffer(
+            key, dtype=numpy.uint32)[0]
+        if tail:
+            data[words * 4:] ^= numpy.frombuffer(key[:tail], dtype=numpy.uint8)
 
+        return data.tostring()
+
+
+class HyBi07FrameReader(HyBi07Frame):
+    """
+    Incremental HyBi-07+ frame parser used by :class:`WebSocketProtocol`.
+
+    Incoming data is appended to a `bytearray` and the frames are consumed
+    in place moving an offset forward, the consumed data is discarded from
+    the buffer only when the whole buffer has been consumed or when the
+    consumed part grows bigger than `compact_size` and than the rest of
+    the buffer. This way we don't copy the rest of the buffer on every
+    TCP read while waiting for large messages.
+
+    Continuation frames (opcode 0x0) are reassembled with the data frame
+    that started the message so only complete messages are returned.
+    Control frames can be interleaved with the fragments of a message.
+
+    Messages compressed by the negotiated extension (if any) are returned
+    already decompressed. Text messages are returned as `DATA` and binary
+    messages as `BINARY`.
+
+    Frames and messages bigger than `max_frame_size` and `max_message_size`
+    raise :class:`MessageTooBig` as soon as their header is received.
+
+    In streaming mode, the payload of the data frames is not buffered,
+    it is returned as it arrives as `CHUNK` frames which data is a tuple
+    with the message opcode, the chunk and a flag that is True for the
+    last chunk of the message. Compressed messages can't be streamed.
+
+    :param buf: the initial data
+    :type buf: str
+    :param extension: the negotiated extension if any
+    :type extension: :class:`PerMessageDeflate`
+    :param max_frame_size: the biggest frame payload accepted
+    :type max_frame_size: int
+    :param max_message_size: the biggest message accepted
+    :type max_message_size: int
+    :param streaming: if True return the data as it arrives
+    :type streaming: bool
+
+    .. versionadded:: 0.3.6
+    """
+
+    compact_size = 0x10000
+
+    def __init__(self, buf='', extension=None, max_frame_size=None,
+                 max_message_size=None, streaming=False):
+        super(HyBi07FrameReader, self).__init__(bytearray(buf))
+        self.offset = 0
+        self.fragments = []
+        self.in_message = False
+        self.compressed = False
+        self.message_opcode = None
+        self.message_size = 0
+        self.extension = extension
+        self.max_frame_size = max_frame_size
+        self.max_message_size = max_message_size
+        self.streaming = streaming
+        self.remaining = 0
+        self.position = 0
+        self.frame_fin = False
+        self.frame_key = None
+        if extension is not None:
+            self.allowed_flags = extension.flags
+
+    def feed(self, data):
+        """
+        Append data to the buffer and return back the list of complete
+        messages and control frames as (opcode, data) tuples
+
+        :param data: the data received from the transport
+        :type data: str
+        """
+
+        self.buf.extend(data)
+        return self.parse()[0]
+
+    def parse(self):
+        """
+        Parse all the complete frames in the buffer. The incomplete ones are
+        kept in our own buffer so the remaining buffer is always empty
+        """
+
+        frames = []
+
+        while True:
+            if self.remaining > 0:
+                chunk = self.read_chunk()
+                if chunk is None:
+                    break
+
+                frames.append(chunk)
+                continue
+
+            if self.streaming is True:
+                header = self.read_header(self.offset)
+                if header is None:
+                    break
+
+                fin, flags, raw_opcode, mask_key, length, start = header
+                if self.opcodes[raw_opcode] == DATA:
+                    self.start_frame(fin, flags, raw_opcode, length)
+                    self.offset = start
+                    self.remaining, self.position = length, 0
+                    self.frame_fin, self.frame_key = fin, mask_key
+                    if length == 0 and fin is True:
+                        frames.append((CHUNK, (self.message_opcode, '', True)))
+                    continue
+
+            frame = self.read_frame(self.offset)
+            if frame is None:
+                break
+
+            fin, flags, raw_opcode, payload_data, end = frame
+            opcode = self.opcodes[raw_opcode]
+            if opcode == DATA:
+                self.start_frame(fin, flags, raw_opcode, len(payload_data))
+
+            self.offset = end
+            if opcode == DATA:
+                payload_data = self.reassemble(fin, payload_data)
+                if payload_data is None:
+                    continue
+
+                if self.message_opcode == OPCODE_BINARY:
+                    opcode = BINARY
+
+            frames.append((opcode, payload_data))
+
+        self.compact()
+        return frames, ''
+
+    def check_length(self, raw_opcode, length):
+        """Raise :class:`MessageTooBig` if the frame or message is too big
+        """
+
+        super(HyBi07FrameReader, self).check_length(raw_opcode, length)
+        if self.max_message_size is None or raw_opcode not in (0x0, 0x1, 0x2):
+            return
+
+        if raw_opcode == 0x0:
+            length += self.message_size
+
+        if length > self.max_message_size:
+            raise MessageTooBig(
+                'Message of {} bytes is bigger than the {} bytes limit'.format(
+                    length, self.max_message_size)
+            )
+
+    def start_frame(self, fin, flags, raw_opcode, length):
+        """
+        Check that a data frame continues (or starts) a message as it should
+        and keep track of the message that it belongs to
+        """
+
+        if raw_opcode == 0x0:
+            if self.in_message is False:
+                raise WebSocketError(
+                    'Continuation frame without a message to continue')
+            if flags:
+                raise ReservedFlagsInFrame(
+                    'Reserved flag in HyBi-07 continuation frame {:#x}'.format(
+                        flags)
+                )
+
+            self.message_size += length
+        else:
+            if self.in_message is True:
+                raise WebSocketError(
+                    'New data frame {:#x} before the end of the fragmented '
+                    'message'.format(raw_opcode)
+                )
+
+            self.compressed = (flags & 0x40) != 0
+            if self.compressed is True and self.streaming is True:
+                raise WebSocketError('Compressed messages can\'t be streamed')
+
+            self.message_opcode = raw_opcode
+            self.message_size = length
+
+        self.in_message = not fin
+
+    def read_chunk(self):
+        """Return back the available payload of the current frame as a chunk
+        """
+
+        length = min(len(self.buf) - self.offset, self.remaining)
+        if length == 0:
+            return None
+
+        data = self.unmask(self.offset, length, self.frame_key, self.position)
+        self.offset += length
+        self.position += length
+        self.remaining -= length
+
+        last = self.remaining == 0 and self.frame_fin is True
+        return CHUNK, (self.message_opcode, data, last)
+
+    def reassemble(self, fin, payload_data):
+        """
+        Reassemble fragmented messages, returns None until the final
+        fragment of the message is received.
+        """
+
+        if fin is True and not self.fragments:
+            return self.decompress(payload_data)
+
+        self.fragments.append(payload_data)
+        if fin is False:
+            return None
+
+        message = ''.join(self.fragments)
+        self.fragments = []
+        return self.decompress(message)
+
+    def decompress(self, message):
+        """Decompress the message if it was compressed by the extension
+        """
+
+        if self.compressed is True:
+            return self.extension.decompress(message)
+
+        return message
+
+    def compact(self):
+        """Discard the already consumed part of the buffer if needed
+        """
+
+        if self.offset == len(self.buf):
+            del self.buf[:]
+            self.offset = 0
+        elif (self.offset >= self.compact_size
+                and self.offset >= len(self.buf) - self.offset):
+            del self.buf[:self.offset]
+            self.offset = 0
+
+
+class PerMessageDeflate(object):
+    """
+    The permessage-deflate WebSocket extension as is defined in [RFC7692].
+
+    The class attributes define the server limits: the window bits and
+    memory level used by the compressors, the compression level, the
+    smallest message that is worth to compress and the biggest size that
+    a compressed message is allowed to inflate to. Every connection that
+    negotiates the extension uses a compressor and a decompressor so lower
+    window bits and memory level (or disabling the server context takeover
+    so the compressor is released after every message) reduce the memory
+    that every connection needs.
+
+    :param server_no_context_takeover: reset the compressor every message
+    :type server_no_context_takeover: bool
+    :param client_no_context_takeover: reset the decompressor every message
+    :type client_no_context_takeover: bool
+    :param server_max_window_bits: the window bits of our compressor
+    :type server_max_window_bits: int
+    :param client_max_window_bits: the window bits of the client compressor
+    :type client_max_window_bits: int
+
+    .. versionadded:: 0.3.6
+    """
+
+    name = 'permessage-deflate'
+    flags = 0x40
+
+    server_no_context_takeover = False
+    server_max_window_bits = 15
+    client_max_window_bits = 15
+    mem_level = 8
+    compression_level = 6
+    min_size = 64
+    max_inflated_size = 0x1000000
+
+    def __init__(self, server_no_context_takeover=False,
+                 client_no_context_takeover=False, server_max_window_bits=15,
+                 client_max_window_bits=15):
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.response = self.name
+        self.key = (
+            self.name, server_max_window_bits,
+            self.mem_level, self.compression_level
+        )
+        self._compressor = None
+        self._decompressor = None
+
+    @classmethod
+    def negotiate(cls, offers):
+        """
+        Look for an acceptable permessage-deflate offer in the value of a
+        `Sec-WebSocket-Extensions` header and return back an extension
+        instance for the first one or None if there is no one
+
+        :param offers: the value of the `Sec-WebSocket-Extensions` header
+        :type offers: str
+        """
+
+        for offer in offers.split(','):
+            params = [param.strip() for param in offer.split(';')]
+            if params[0] != cls.name:
+                continue
+
+            extension = cls.accept(params[1:])
+            if extension is not None:
+                return extension
+
+        return None
+
+    @classmethod
+    def accept(cls, params):
+        """
+        Create an extension instance for an offer with the given parameters
+        or return None if the offer can't be accepted
+
+        :param params: the offer parameters like `client_max_window_bits=10`
+        :type params: list
+        """
+
+        options = {}
+        for param in params:
+            key, sep, value = param.partition('=')
+            key = key.strip()
+            if key in options:
+                return None
+
+            options[key] = value.strip().strip('"') if sep else None
+
+        server_no_context_takeover = cls.server_no_context_takeover
+        client_no_context_takeover = False
+        server_max_window_bits = cls.server_max_window_bits
+        client_max_window_bits = 15
+        response = []
+
+        for key, value in options.iteritems():
+            if key in ('server_no_context_takeover',
+                       'client_no_context_takeover'):
+                if value is not None:
+                    return None
+            elif key in ('server_max_window_bits', 'client_max_window_bits'):
+                if value is None and key == 'client_max_window_bits':
+                    value = '15'
+                if value is None or not value.isdigit() or not (
+                        8 <= int(value) <= 15):
+                    return None
+            else:
+                return None
+
+            if key == 'server_no_context_takeover':
+                server_no_context_takeover = True
+            elif key == 'client_no_context_takeover':
+                client_no_context_takeover = True
+                response.append(key)
+            elif key == 'server_max_window_bits':
+                # zlib can not compress using a window of 256 bytes
+                if int(value) < 9:
+                    return None
+
+                server_max_window_bits = min(
+                    server_max_window_bits, int(value))
+                response.append('{}={}'.format(key, server_max_window_bits))
+            elif key == 'client_max_window_bits':
+                client_max_window_bits = min(
+                    cls.client_max_window_bits, int(value))
+                response.append('{}={}'.format(key, client_max_window_bits))
+
+        if server_no_context_takeover is True:
+            response.append('server_no_context_takeover')
+
+        extension = cls(
+            server_no_context_takeover, client_no_context_takeover,
+            server_max_window_bits, client_max_window_bits
+        )
+        extension.response = '; '.join([cls.name] + sorted(response))
+        return extension
+
+    def compress(self, data):
+        """Compress a message payload
+
+        :param data: the message payload
+        :type data: str
+        """
+
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(
+                self.compression_level, zlib.DEFLATED,
+                -self.server_max_window_bits, self.mem_level
+            )
+
+        data = self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH)
+        if self.server_no_context_takeover is True:
+            self._compressor = None
+
+        # remove the empty stored block added by the sync flush
+        return data[:-4] if data.endswith('\x00\x00\xff\xff') else data
+
+    def decompress(self, data):
+        """Decompress a message payload
+
+        :param data: the compressed message payload
+        :type data: str
+        """
+
+        if self._decompressor is None:
+            # zlib doesn't support 8 bits windows but a 512 bytes window
+            # is able to inflate data compressed with a 256 bytes window
+            self._decompressor = zlib.decompressobj(
+                -max(self.client_max_window_bits, 9))
+
+        try:
+            data = self._decompressor.decompress(
+                data + '\x00\x00\xff\xff', self.max_inflated_size)
+        except zlib.error as error:
+            raise WebSocketError('Invalid compressed message: {}'.format(
+                error))
+
+        if self._decompressor.unconsumed_tail:
+            raise MessageTooBig(
+                'Compressed message inflates to more than {} bytes'.format(
+                    self.max_inflated_size)
+            )
+
+        if self.client_no_context_takeover is True:
+            self._decompressor = None
+
+        return data
+
+    def segments(self, data, opcode=0x1):
+        """
+        Generate a HyBi-07+ frame compressing the payload if it is worth
+        it, as a list of strings ready to be passed to `writeSequence`
+
+        :param data: the message payload
+        :type data: str
+        :param opcode: the opcode to use
+        :type opcode: int
+        """
+
+        if len(data) < self.min_size:
+            return HyBi07Frame(data).segments(opcode)
+
+        data = self.compress(data)
+        return [HyBi07Frame.header(len(data), opcode, self.flags), data]
+
+
+class Message(object):
+    """
+    A message that is encoded into a frame just once no matter to how many
+    connections it is written, the very same frame strings are written to
+    every connection that uses the same frame format
+
+    :param data: the message payload
+    :type data: str
+    :param opcode: the opcode to use (0x1 text, 0x2 binary)
+    :type opcode: int
+    """
+
+    def __init__(self, data, opcode=0x1):
+        self.data = data
+        self.opcode = opcode
+        self._segments = {}
+
+    def __len__(self):
+        return len(self.data)
+
+    def segments(self, frame_generator, extension=None):
+        """Return back the (cached) encoded frame for the given frame class
+
+        Messages compressed by an extension that keeps the compression
+        context between messages are different for every connection and
+        can't be cached.
+
+        :param frame_generator: :class:`HyBi07Frame` or :class:`HyBi00Frame`
+        :param extension: the extension negotiated by the connection
+        :type extension: :class:`PerMessageDeflate`
+        """
+
+        if extension is None:
+            key = frame_generator
+        elif extension.server_no_context_takeover is True:
+            key = extension.key
+        else:
+            return extension.segments(self.data, self.opcode)
+
+        segments = self._segments.get(key)
+        if segments is None:
+            if extension is None:
+                segments = frame_generator(self.data).segments(self.opcode)
+            else:
+                segments = extension.segments(self.data, self.opcode)
+            self._segments[key] = segments
+
+        return segments
+
+
+@implementer(IPushProducer)
 class WebSocketProtocol(ProtocolWrapper):
     """
     Wrapped protocol to handle Websockaet transport layer. The websocket
@@ -483,10 +1164,19 @@ class WebSocketProtocol(ProtocolWrapper):
 
         reactor.listenTCP(6543, websocket.WebSocketFactory(EchoFactory()))
 
+    The frames written in the same reactor iteration are coalesced into a
+    single `writeSequence` call. The protocol registers itself as producer
+    of the underlying transport, while the transport is paused the frames
+    are kept in the protocol (pausing the producer registered by the
+    wrapped protocol if any) and the connection is closed if more than
+    `max_pending_size` bytes are waiting to be sent.
+
     .. versionadded:: 0.3.6
 
     """
 
+    max_pending_size = 0x1000000
+
     def __init__(self, *args, **kwargs):
         ProtocolWrapper.__init__(self, *args, **kwargs)
         self.buf = ''
@@ -496,7 +1186,20 @@ class WebSocketProtocol(ProtocolWrapper):
         self.origin = ''
         self.version = None
         self.state = HANDSHAKE
+        self.reader = None
+        self.extension = None
         self.pending_frames = []
+        self.pending_size = 0
+        self.flush_call = None
+        self.receiving = False
+        self.paused = False
+        self.wrapped_producer = None
+        self.wrapped_streaming = None
+        self.channels = set()
+        self.last_received = None
+        self.last_message = None
+        self.ping_sent = None
+        self.latency = None
         self.protocols = []
         self.headers = {}
 
@@ -509,6 +1212,39 @@ class WebSocketProtocol(ProtocolWrapper):
 
         return ISSLTransport(self.transport, None) is not None
 
+    def makeConnection(self, transport):
+        """
+        Connect the wrapped protocol and register ourselves as producer of
+        the transport so we get notified when its write buffer is full
+        """
+
+        ProtocolWrapper.makeConnection(self, transport)
+        transport.registerProducer(self, True)
+
+    def connectionLost(self, reason):
+        """Cancel any scheduled flush and notify the wrapped protocol
+        """
+
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+
+        self.flush_call = None
+        for channel in list(self.channels):
+            channel.unsubscribe(self)
+
+        self.factory.keepalive.remove(self)
+
+        ProtocolWrapper.connectionLost(self, reason)
+
+    @property
+    def streaming(self):
+        """
+        True if the wrapped protocol wants to receive the messages in chunks
+        as they arrive (see :meth:`MessageProtocol.chunkReceived`)
+        """
+
+        return getattr(self.wrappedProtocol, 'streaming', False) is True
+
     @property
     def codecs(self):
         """Return the list of available codecs (WS protocols)
@@ -547,28 +1283,39 @@ class WebSocketProtocol(ProtocolWrapper):
         we need to manually kick pending frames.
         """
 
-        self.buf += data
+        if self.reader is not None:
+            self.reader.buf.extend(data)
+        else:
+            self.buf += data
+
+        if self.state == FRAMES:
+            self.last_received = self.factory.clock.seconds()
+
         oldstate = None
+        self.receiving = True
 
-        while oldstate != self.state:
-            oldstate = self.state
-
-            if self.state == HANDSHAKE:         # HANDSHAKE
-                self.handle_handshake()
-            elif self.state == NEGOTIATION:     # NEGOTIATION
-                try:
-                    self.handle_negotiation()
-                except InvalidProtocolVersion:
-                    preamble = InvalidProtocolVersionPreamble()
-                    preamble.write_to_transport(self.transport)
-                    self.close('Invalid Protocol Version')
-                except (InvalidProtocol, NoWebSocketCodec) as error:
-                    log.err(error)
-                    self.loseConnection()
-            elif self.state == CHALLENGE:       # CHALLEMGE
-                self.handle_challenge()
-            elif self.state == FRAMES:          # FRAMES
-                self.handle_frames()
+        try:
+            while oldstate != self.state:
+                oldstate = self.state
+
+                if self.state == HANDSHAKE:         # HANDSHAKE
+                    self.handle_handshake()
+                elif self.state == NEGOTIATION:     # NEGOTIATION
+                    try:
+                        self.handle_negotiation()
+                    except InvalidProtocolVersion:
+                        preamble = InvalidProtocolVersionPreamble()
+                        preamble.write_to_transport(self.transport)
+                        self.close('Invalid Protocol Version')
+                    except (InvalidProtocol, NoWebSocketCodec) as error:
+                        log.err(error)
+                        self.loseConnection()
+                elif self.state == CHALLENGE:       # CHALLEMGE
+                    self.handle_challenge()
+                elif self.state == FRAMES:          # FRAMES
+                    self.handle_frames()
+        finally:
+            self.receiving = False
 
         # kick pending frames
         if len(self.pending_frames) > 0:
@@ -660,9 +1407,44 @@ class WebSocketProtocol(ProtocolWrapper):
                     log.msg('Starting RFC 6455 conversation')
                     self.version = RFC6455
 
+                self.negotiate_extensions()
                 preamble = HyBi07HandshakePreamble(self)
                 preamble.write_to_transport(self.transport)
+                self.reader = HyBi07FrameReader(
+                    self.buf, self.extension,
+                    max_frame_size=self.factory.max_frame_size,
+                    max_message_size=self.factory.max_message_size,
+                    streaming=self.streaming
+                )
+                self.buf = ''
                 self.state = FRAMES
+                self.factory.keepalive.add(self)
+
+    def negotiate_extensions(self):
+        """
+        Negotiate the extensions offered by the client in the
+        `Sec-WebSocket-Extensions` header, at the moment we only support
+        permessage-deflate as is defined in [RFC7692]. Set the
+        `permessage_deflate` attribute of the factory to None to disable it.
+
+        Compression is never negotiated for protocols in streaming mode
+        """
+
+        offers = self.headers.get('Sec-WebSocket-Extensions')
+        extension = getattr(self.factory, 'permessage_deflate', None)
+        if offers is None or extension is None or self.streaming is True:
+            return
+
+        self.extension = extension.negotiate(offers)
+        if self.extension is not None:
+            if self.factory.max_message_size is not None:
+                self.extension.max_inflated_size = min(
+                    self.extension.max_inflated_size,
+                    self.factory.max_message_size
+                )
+
+            log.msg('Negotiated WebSocket extension {}'.format(
+                self.extension.response))
 
     def handle_challenge(self):
         """Handle challenge. This is exclusive to HyBi-00/Hixie-76
@@ -680,6 +1462,7 @@ class WebSocketProtocol(ProtocolWrapper):
 
             # we are done here, start sending frames
             self.state = FRAMES
+            self.factory.keepalive.add(self)
 
     def handle_frames(self):
         """
@@ -690,7 +1473,7 @@ class WebSocketProtocol(ProtocolWrapper):
         if self.version == HYBI00:
             frame_parser = HyBi00Frame(self.buf)
         elif self.version in (HYBI07, HYBI10, RFC6455):
-            frame_parser = HyBi07Frame(self.buf)
+            frame_parser = self.reader
         else:
             raise InvalidProtocolVersion(
                 'Unknown version {!r}'.format(self.version)
@@ -698,16 +1481,34 @@ class WebSocketProtocol(ProtocolWrapper):
 
         try:
             frames, self.buf = frame_parser.parse()
+        except MessageTooBig as error:
+            log.msg('Closing connection: {}'.format(error))
+            self.close(str(error), MESSAGE_TOO_BIG)
+            return
         except WebSocketError as error:
             log.err(error)
-            self.close(error)
+            self.close(str(error), PROTOCOL_ERROR)
+            return
+
+        max_message_size = self.factory.max_message_size
+        if (self.version == HYBI00 and max_message_size is not None
+                and len(self.buf) > max_message_size):
+            log.msg('Closing connection: HyBi-00 frame bigger than {}'.format(
+                max_message_size))
+            self.close()
             return
 
         for frame in frames:
             opcode, data = frame
-            if opcode == DATA:
-                # pass the frame to the underlying protocol
-                ProtocolWrapper.dataReceived(self, data)
+            if opcode in (DATA, BINARY):
+                # pass the message to the underlying protocol
+                self.last_message = self.last_received
+                self.message_received(
+                    OPCODE_BINARY if opcode == BINARY else OPCODE_TEXT, data)
+            elif opcode == CHUNK:
+                # pass the chunk to the underlying protocol in streaming mode
+                self.last_message = self.last_received
+                self.wrappedProtocol.chunkReceived(*data)
             elif opcode == CLOSE:
                 # the other side want's to close
                 reason, text = data
@@ -722,6 +1523,53 @@ class WebSocketProtocol(ProtocolWrapper):
                 self.transport.write(
                     HyBi07Frame(data).generate(0xa)
                 )
+            elif opcode == PONG:
+                if self.ping_sent is not None:
+                    self.latency = self.last_received - self.ping_sent
+                    self.ping_sent = None
+                    self.factory.keepalive.record_latency(self.latency)
+
+    def message_received(self, opcode, data):
+        """
+        Pass a complete message to the wrapped protocol. If the protocol
+        defines a `messageReceived` method (like :class:`MessageProtocol`
+        does) it gets the message opcode and payload, otherwise just the
+        payload is passed to its `dataReceived` method
+
+        :param opcode: :data:`OPCODE_TEXT` or :data:`OPCODE_BINARY`
+        :type opcode: int
+        :param data: the message payload
+        :type data: str
+        """
+
+        handler = getattr(self.wrappedProtocol, 'messageReceived', None)
+        if handler is not None:
+            handler(opcode, data)
+        else:
+            ProtocolWrapper.dataReceived(self, data)
+
+    def send(self, data, binary=False):
+        """Send a text or binary message to the other side
+
+        :param data: the message payload
+        :type data: str
+        :param binary: if True send a binary message instead of a text one
+        :type binary: bool
+        """
+
+        self.write_message(
+            Message(data, OPCODE_BINARY if binary is True else OPCODE_TEXT))
+
+    def ping(self, data=''):
+        """Send a ping to the other side
+
+        :param data: the ping payload (up to 125 octets)
+        :type data: str
+        """
+
+        if self.version in (HYBI07, HYBI10, RFC6455):
+            self.ping_sent = self.factory.clock.seconds()
+            self.transport.write(HyBi07Frame(data).generate(0x9))
 
     def write(self, data):
         """Write to the transport.
@@ -730,7 +1578,8 @@ class WebSocketProtocol(ProtocolWrapper):
         """
 
         self.pending_frames.append(data)
-        self._send()
+        self.pending_size += len(data)
+        self._schedule_send()
 
     def writeSequence(self, data):
         """Write a sequence of data to the transport
@@ -738,29 +1587,166 @@ class WebSocketProtocol(ProtocolWrapper):
         :param data: the sequence to be written
         """
 
-        self.pending_frames.extend(data)
+        for frame in data:
+            self.pending_frames.append(frame)
+            self.pending_size += len(frame)
+
+        self._schedule_send()
+
+    def write_message(self, message):
+        """Write an already encoded :class:`Message` to the transport
+
+        :param message: the message to write
+        :type message: :class:`Message`
+        """
+
+        self.pending_frames.append(message)
+        self.pending_size += len(message)
+        self._schedule_send()
+
+    def drop(self, reason=''):
+        """Discard all the pending frames and close the connection
+
+        :param reason: the reason to send in the close frame
+        :type reason: str
+        """
+
+        self.pending_frames = []
+        self.pending_size = 0
+        self.close(reason)
+
+    def loseConnection(self):
+        """Send all pending frames and lose the connection
+        """
+
+        self._send(force=True)
+        ProtocolWrapper.loseConnection(self)
+
+    def registerProducer(self, producer, streaming):
+        """
+        Register a producer for the wrapped protocol. We are the producer
+        registered in the real transport so we just keep it around and
+        notify it when the transport gets paused or resumed
+
+        :param producer: the producer to register
+        :param streaming: True if the producer is a push producer
+        :type streaming: bool
+        """
+
+        if self.wrapped_producer is not None:
+            raise RuntimeError(
+                'Cannot register producer {}, because producer {} was '
+                'never unregistered.'.format(producer, self.wrapped_producer)
+            )
+
+        self.wrapped_producer = producer
+        self.wrapped_streaming = streaming
+        if not streaming:
+            producer.resumeProducing()
+        elif self.paused:
+            producer.pauseProducing()
+
+    def unregisterProducer(self):
+        """Unregister the producer of the wrapped protocol
+        """
+
+        self.wrapped_producer = None
+        self.wrapped_streaming = None
+
+    def pauseProducing(self):
+        """The transport write buffer is full, stop sending frames
+        """
+
+        self.paused = True
+        if self.wrapped_producer is not None and self.wrapped_streaming:
+            self.wrapped_producer.pauseProducing()
+
+    def resumeProducing(self):
+        """The transport write buffer has been drained, send pending frames
+        """
+
+        self.paused = False
         self._send()
+        if self.wrapped_producer is not None and self.wrapped_streaming:
+            self.wrapped_producer.resumeProducing()
 
-    def _send(self, binary=False):
-        """Send all pending frames
+    def stopProducing(self):
+        """The transport is going away, stop the wrapped producer
         """
 
-        if self.state == FRAMES:
-            if self.version == HYBI00:
-                frame_generator = HyBi00Frame
-            elif self.version in (HYBI07, HYBI10, RFC6455):
-                frame_generator = HyBi07Frame
+        if self.wrapped_producer is not None:
+            self.wrapped_producer.stopProducing()
+
+    def _schedule_send(self):
+        """
+        Schedule a flush of the pending frames for the end of the current
+        reactor iteration so all the frames written on it are coalesced
+        """
+
+        if self.paused and self.pending_size > self.max_pending_size:
+            log.msg(
+                'Closing slow connection with {} bytes pending'.format(
+                    self.pending_size)
+            )
+            self.drop('Too much data pending')
+            return
+
+        # frames written while we are receiving are sent after the data
+        # has been processed so there is nothing to schedule
+        if self.receiving or self.flush_call is not None:
+            return
+
+        if self.state == FRAMES and not self.paused:
+            self.flush_call = self.factory.callLater(0, self._send)
+
+    def _send(self, binary=False, force=False):
+        """Send all pending frames in a single write to the transport
+
+        :param binary: if True send binary frames instead of text ones
+        :type binary: bool
+        :param force: if True send them even if the transport is paused
+        :type force: bool
+        """
+
+        if self.flush_call is not None:
+            if self.flush_call.active():
+                self.flush_call.cancel()
+            self.flush_call = None
+
+        if self.state != FRAMES or (self.paused and not force):
+            return
+
+        if self.version == HYBI00:
+            frame_generator = HyBi00Frame
+        elif self.version in (HYBI07, HYBI10, RFC6455):
+            frame_generator = HyBi07Frame
+        else:
+            raise InvalidProtocolVersion(
+                'Unknown version {!r}'.format(self.version)
+            )
+
+        frames, self.pending_frames = self.pending_frames, []
+        self.pending_size = 0
+        if len(frames) == 0:
+            return
+
+        opcode = OPCODE_BINARY if binary is True else OPCODE_TEXT
+        segments = []
+        for frame in frames:
+            if isinstance(frame, Message):
+                segments.extend(
+                    frame.segments(frame_generator, self.extension))
+            elif self.extension is not None:
+                segments.extend(self.extension.segments(frame, opcode))
             else:
-                raise InvalidProtocolVersion(
-                    'Unknown version {!r}'.format(self.version)
-                )
+                segments.extend(frame_generator(frame).segments(opcode))
 
-            for frame in self.pending_frames:
-                self.transport.write(frame_generator(frame).generate())
+        self.transport.writeSequence(segments)
 
-            self.pending_frames = []
+        if self.wrapped_producer is not None and not self.wrapped_streaming:
+            self.wrapped_producer.resumeProducing()
 
-    def close(self, reason=''):
+    def close(self, reason='', code=NORMAL_CLOSURE):
         """
         Close the connection.
 
@@ -772,12 +1758,19 @@ class WebSocketProtocol(ProtocolWrapper):
         shouldn't be a problem.
 
         Refer to [RFC6455][Page 35][Page 41] for more details
+
+        :param reason: the reason of the closing
+        :type reason: str
+        :param code: the close status code (1000 is normal closure)
+        :type code: int
         """
 
+        self._send(force=True)
         if self.version in (HYBI07, HYBI10, RFC6455):
-            self.transport.write(HyBi07Frame(reason).generate(opcode=0x8))
+            payload = pack('>H', code) + reason[:0x7b]
+            self.transport.write(HyBi07Frame(payload).generate(opcode=0x8))
 
-        self.loseConnection()
+        ProtocolWrapper.loseConnection(self)
 
     def complete_hybi00(self, challenge):
         """Generate the response for a HyBi-00 challenge.
@@ -806,13 +1799,535 @@ class WebSocketProtocol(ProtocolWrapper):
             packed = [i.strip() for i in line.split(':', 1)]
             if len(packed) > 1:
                 k, v = packed
-                self.headers[k] = v
+                self.headers[CANONICAL_HEADERS.get(k.lower(), k)] = v
+
+
+class MessageProtocol(Protocol):
+    """
+    Base class for protocols wrapped by :class:`WebSocketProtocol` that
+    work with whole messages instead of a stream of data. Messages are
+    received with their opcode so text and binary messages can be told
+    apart and can be sent as binary messages, for example::
+
+        class PositionsProtocol(websocket.MessageProtocol):
+
+            def messageReceived(self, opcode, data):
+                if opcode == websocket.OPCODE_BINARY:
+                    x, y = struct.unpack('>ff', data)
+                    self.sendMessage(struct.pack('>ff', x, y), binary=True)
+
+    Protocols that set `streaming` to True receive the messages in chunks
+    as they arrive in :meth:`chunkReceived` instead, this is useful to
+    process big messages without buffering them in memory.
+
+    .. versionadded:: 0.3.6
+    """
+
+    streaming = False
+
+    def messageReceived(self, opcode, data):
+        """Called with every complete message, override it
+
+        :param opcode: :data:`OPCODE_TEXT` or :data:`OPCODE_BINARY`
+        :type opcode: int
+        :param data: the message payload
+        :type data: str
+        """
+
+    def chunkReceived(self, opcode, data, last):
+        """Called with every chunk of data in streaming mode, override it
+
+        :param opcode: :data:`OPCODE_TEXT` or :data:`OPCODE_BINARY`
+        :type opcode: int
+        :param data: the chunk of the message payload
+        :type data: str
+        :param last: True if this is the last chunk of the message
+        :type last: bool
+        """
+
+    def sendMessage(self, data, binary=False):
+        """Send a text or binary message
+
+        :param data: the message payload
+        :type data: str
+        :param binary: if True send a binary message instead of a text one
+        :type binary: bool
+        """
+
+        self.transport.send(data, binary)
 
 
 class WebSocketFactory(WrappingFactory):
     """
     Factory that wraps another factory to provide WebSockets transports
     for all of its protocols
+
+    The factory sends pings to connections that didn't send anything in
+    `ping_interval` seconds and closes them if they don't answer in
+    `pong_timeout` seconds. Connections that didn't send any message in
+    `idle_timeout` seconds are closed as well. Set them to None to disable
+    the keepalive pings or the idle connections reaping.
+
+    Connections that send frames bigger than `max_frame_size` or messages
+    bigger than `max_message_size` are closed with status 1009 (message
+    too big) as soon as the frame header is received.
     """
 
     protocol = WebSocketProtocol
+    permessage_deflate = PerMessageDeflate
+    clock = reactor
+
+    ping_interval = 30
+    pong_timeout = 30
+    idle_timeout = None
+
+    max_frame_size = None
+    max_message_size = 0x1000000
+
+    def __init__(self, wrappedFactory):
+        WrappingFactory.__init__(self, wrappedFactory)
+        self.keepalive = KeepAlive(self)
+
+    def callLater(self, period, func):
+        """Wrapper around `reactor.callLater` for test purposes
+        """
+
+        return self.clock.callLater(period, func)
+
+    def upgrade(self, request, wrappedProtocol):
+        """
+        Take over the connection of an HTTP request already parsed by a
+        :class:`twisted.web.server.Site` and turn it into a WebSocket
+        connection that wraps the given protocol, this way WebSockets can
+        be served in the same port (and TLS context) than the web site.
+
+        The HTTP channel is detached from the transport and the request is
+        fed back into the new :class:`WebSocketProtocol` so the handshake
+        is done exactly as for connections accepted by this factory. The
+        HTTP request is detached from its channel as if its connection
+        had been lost, so its `notifyFinish` Deferreds errback with
+        :class:`twisted.internet.error.ConnectionDone`.
+
+        Only data that was received along with the request is forwarded,
+        clients must wait for the handshake response before sending any
+        frame (RFC 6455 section 4.1).
+
+        :param request: the HTTP upgrade request
+        :type request: :class:`twisted.web.server.Request`
+        :param wrappedProtocol: the protocol to wrap
+        :type wrappedProtocol: :class:`twisted.internet.protocol.Protocol`
+        :returns: the new :class:`WebSocketProtocol`
+        """
+
+        channel = request.channel
+        channel.setTimeout(None)
+        transport, channel.transport = channel.transport, None
+
+        protocol = self.protocol(self, wrappedProtocol)
+        if isinstance(transport, ProtocolWrapper):
+            # TLS connections are wrapped by TLSMemoryBIOProtocol
+            transport.wrappedProtocol = protocol
+        else:
+            transport.protocol = protocol
+
+        # newer versions of twisted.web register the channel as producer
+        # of the transport, and all of them pause it while the request is
+        # being handled
+        if getattr(transport, 'producer', None) is not None:
+            transport.unregisterProducer()
+        protocol.makeConnection(transport)
+        producer = IPushProducer(transport, None)
+        if producer is not None:
+            producer.resumeProducing()
+
+        head = ['{} {} HTTP/1.1'.format(request.method, request.uri)]
+        for name, values in request.requestHeaders.getAllRawHeaders():
+            head.append('{}: {}'.format(name, ', '.join(values)))
+
+        request.content.seek(0)
+        content = request.content.read()
+
+        if request in channel.requests:
+            channel.requests.remove(request)
+        request.connectionLost(Failure(ConnectionDone(
+            'connection upgraded to WebSocket')))
+
+        protocol.dataReceived('{}\r\n\r\n{}{}'.format(
+            '\r\n'.join(head), content, channel.clearLineBuffer()))
+
+        return protocol
+
+    def stats(self):
+        """
+        Return back the number of live connections (and how many of them
+        already completed the handshake) and the keepalive statistics
+        """
+
+        return dict(self.keepalive.stats(), connections=len(self.protocols))
+
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel. Timers are stored in `size` slots of `resolution`
+    seconds and a single reactor call ticks the wheel every `resolution`
+    seconds while there is any timer scheduled, so thousands of timers
+    cost just one reactor delayed call. Timers longer than a full turn of
+    the wheel wait the needed number of rounds in its slot.
+
+    :param clock: the object used to schedule the ticks (the reactor)
+    :type clock: :class:`twisted.internet.interfaces.IReactorTime`
+    :param callback: the function called with every expired item
+    :type callback: callable
+    :param resolution: seconds per slot
+    :type resolution: float
+    :param size: number of slots
+    :type size: int
+
+    .. versionadded:: 0.3.6
+    """
+
+    def __init__(self, clock, callback, resolution=1.0, size=64):
+        self.clock = clock
+        self.callback = callback
+        self.resolution = resolution
+        self.slots = [{} for i in range(size)]
+        self.position = 0
+        self.timers = {}
+        self.call = None
+
+    def __len__(self):
+        return len(self.timers)
+
+    def schedule(self, item, delay):
+        """Schedule (or re-schedule) a timer for an item
+
+        :param item: the item to pass to the callback when the timer expires
+        :param delay: seconds until the timer expires
+        :type delay: float
+        """
+
+        self.cancel(item)
+        ticks = max(1, int(math.ceil(delay / self.resolution)))
+        rounds, ticks = divmod(ticks - 1, len(self.slots))
+        slot = (self.position + ticks + 1) % len(self.slots)
+
+        self.slots[slot][item] = rounds
+        self.timers[item] = slot
+        if self.call is None:
+            self.call = self.clock.callLater(self.resolution, self.tick)
+
+    def cancel(self, item):
+        """Cancel the timer of an item if any
+
+        :param item: the item which timer should be cancelled
+        """
+
+        slot = self.timers.pop(item, None)
+        if slot is not None:
+            del self.slots[slot][item]
+
+    def tick(self):
+        """Move the wheel one slot forward and expire its timers
+        """
+
+        self.call = None
+        self.position = (self.position + 1) % len(self.slots)
+        slot = self.slots[self.position]
+
+        expired = []
+        for item, rounds in slot.items():
+            if rounds > 0:
+                slot[item] = rounds - 1
+            else:
+                expired.append(item)
+                del slot[item]
+                del self.timers[item]
+
+        for item in expired:
+            try:
+                self.callback(item)
+            except Exception as error:
+                log.err(error)
+
+        if self.timers and self.call is None:
+            self.call = self.clock.callLater(self.resolution, self.tick)
+
+    def stop(self):
+        """Cancel all the timers and stop ticking
+        """
+
+        for slot in self.slots:
+            slot.clear()
+
+        self.timers.clear()
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+
+class KeepAlive(object):
+    """
+    Sends keepalive pings and reaps idle and unresponsive connections for
+    all the connections of a :class:`WebSocketFactory` using a single
+    :class:`TimerWheel`. Activity on the connections just updates a
+    timestamp, the timers are only re-scheduled when they expire.
+
+    :param factory: the factory that the connections belong to
+    :type factory: :class:`WebSocketFactory`
+
+    .. versionadded:: 0.3.6
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.wheel = None
+        self.pings = 0
+        self.timeouts = 0
+        self.idle = 0
+        self.pongs = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def enabled(self):
+        """True if pings or idle connections reaping are enabled
+        """
+
+        return (self.factory.ping_interval is not None
+                or self.factory.idle_timeout is not None)
+
+    def add(self, protocol):
+        """Start tracking a connection that just completed its handshake
+
+        :param protocol: the connection
+        :type protocol: :class:`WebSocketProtocol`
+        """
+
+        now = self.factory.clock.seconds()
+        protocol.last_received = protocol.last_message = now
+        if not self.enabled:
+            return
+
+        if self.wheel is None:
+            self.wheel = TimerWheel(self.factory.clock, self.check)
+
+        self.wheel.schedule(protocol, self._delay(protocol, now))
+
+    def remove(self, protocol):
+        """Stop tracking a connection
+
+        :param protocol: the connection
+        :type protocol: :class:`WebSocketProtocol`
+        """
+
+        if self.wheel is not None:
+            self.wheel.cancel(protocol)
+
+    def check(self, protocol):
+        """
+        Called by the timer wheel, ping the connection or close it if it is
+        idle or it didn't answer our last ping
+
+        :param protocol: the connection
+        :type protocol: :class:`WebSocketProtocol`
+        """
+
+        factory = self.factory
+        now = factory.clock.seconds()
+
+        if (factory.idle_timeout is not None
+                and now - protocol.last_message >= factory.idle_timeout):
+            self.idle += 1
+            log.msg('Closing idle WebSocket connection {}'.format(
+                protocol.getPeer()))
+            protocol.close('Idle connection')
+            return
+
+        if protocol.ping_sent is not None:
+            if now - protocol.ping_sent >= factory.pong_timeout:
+                self.timeouts += 1
+                log.msg('Closing unresponsive WebSocket connection {}'.format(
+                    protocol.getPeer()))
+                protocol.close('Ping timeout')
+                return
+        elif (factory.ping_interval is not None
+                and protocol.version != HYBI00
+                and now - protocol.last_received >= factory.ping_interval):
+            self.pings += 1
+            protocol.ping()
+
+        self.wheel.schedule(protocol, self._delay(protocol, now))
+
+    def record_latency(self, latency):
+        """Record the time that a connection took to answer a ping
+
+        :param latency: seconds between the ping and the pong
+        :type latency: float
+        """
+
+        self.pongs += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def stats(self):
+        """Return back the keepalive statistics
+        """
+
+        return {
+            'open': len(self.wheel) if self.wheel is not None else 0,
+            'pings': self.pings,
+            'pongs': self.pongs,
+            'timeouts': self.timeouts,
+            'idle': self.idle,
+            'latency': {
+                'average': (
+                    self.latency_total / self.pongs if self.pongs else 0.0),
+                'max': self.latency_max
+            }
+        }
+
+    def _delay(self, protocol, now):
+        """Seconds until the next time that the connection must be checked
+        """
+
+        factory = self.factory
+        delays = []
+        if factory.idle_timeout is not None:
+            delays.append(protocol.last_message + factory.idle_timeout - now)
+        if protocol.ping_sent is not None:
+            delays.append(protocol.ping_sent + factory.pong_timeout - now)
+        elif factory.ping_interval is not None:
+            delays.append(
+                protocol.last_received + factory.ping_interval - now)
+
+        return max(min(delays), 0)
+
+
+class Channel(object):
+    """
+    A group of WebSocket connections that receive the same messages.
+
+    Every message broadcasted to the channel is encoded once and the same
+    bytes are queued in every subscribed connection. Connections that have
+    more than `max_queue_size` bytes waiting to be sent (because they can't
+    keep up with the messages rate) are evicted from the channel and closed
+
+    :param name: the channel name
+    :type name: str
+    :param max_queue_size: max bytes queued in a connection before eviction
+    :type max_queue_size: int
+
+    .. versionadded:: 0.3.6
+    """
+
+    def __init__(self, name, max_queue_size=0x100000):
+        self.name = name
+        self.max_queue_size = max_queue_size
+        self.subscribers = set()
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self, protocol):
+        """Subscribe a connection to the channel
+
+        :param protocol: the connection to subscribe
+        :type protocol: :class:`WebSocketProtocol`
+        """
+
+        self.subscribers.add(protocol)
+        protocol.channels.add(self)
+
+    def unsubscribe(self, protocol):
+        """Unsubscribe a connection from the channel
+
+        :param protocol: the connection to unsubscribe
+        :type protocol: :class:`WebSocketProtocol`
+        """
+
+        self.subscribers.discard(protocol)
+        protocol.channels.discard(self)
+
+    def broadcast(self, data, binary=False):
+        """
+        Send a message to every connection subscribed to the channel and
+        return back the number of connections that the message was queued in
+
+        :param data: the message to send
+        :type data: str
+        :param binary: if True send a binary message instead of a text one
+        :type binary: bool
+        """
+
+        message = Message(
+            data, OPCODE_BINARY if binary is True else OPCODE_TEXT)
+        sent = 0
+
+        for protocol in list(self.subscribers):
+            if protocol.pending_size + len(message) > self.max_queue_size:
+                log.msg('Evicting slow consumer {} from channel {}'.format(
+                    protocol.getPeer(), self.name
+                ))
+                self.unsubscribe(protocol)
+                protocol.drop('Slow consumer')
+                continue
+
+            protocol.write_message(message)
+            sent += 1
+
+        return sent
+
+
+class BroadcastHub(borg.Borg):
+    """
+    Keeps the broadcast channels of the application. It inherits from
+    :class:`~mamba.utils.borg.Borg` so every instance shares the same
+    channels::
+
+        >>> BroadcastHub().channel('news').subscribe(self.transport)
+        >>> BroadcastHub().broadcast('news', json.dumps(news))
+        1
+
+    .. versionadded:: 0.3.6
+    """
+
+    max_queue_size = 0x100000
+
+    def __init__(self):
+        super(BroadcastHub, self).__init__()
+        if not hasattr(self, 'channels'):
+            self.channels = {}
+
+    def channel(self, name):
+        """Return back the channel with the given name creating it if needed
+
+        :param name: the channel name
+        :type name: str
+        """
+
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels[name] = Channel(name, self.max_queue_size)
+
+        return channel
+
+    def broadcast(self, name, data, binary=False):
+        """
+        Send a message to every connection subscribed to the given channel,
+        see :meth:`Channel.broadcast`
+        """
+
+        channel = self.channels.get(name)
+        if channel is None:
+            return 0
+
+        return channel.broadcast(data, binary)
+
+    def remove(self, name):
+        """Unsubscribe every connection from the given channel and remove it
+        """
+
+        channel = self.channels.pop(name, None)
+        if channel is not None:
+            for protocol in list(channel.subscribers):
+                channel.unsubscribe(protocol)